@@ -1,10 +1,170 @@
-from flask import Flask, request, jsonify
-from model.model_logic import process_letter
+from flask import Flask, Response, request, jsonify
+from model.job_queue import JobStore, PriorityJobQueue
+from model.metrics import metrics
+from model.model_logic import (
+    analyze_letter,
+    company_registry,
+    complete_letter,
+    is_warm,
+    llm_cache,
+    llm_limiter,
+    llm_load,
+    near_duplicates,
+    process_batch,
+    process_letter,
+    process_letter_stream,
+    process_letter_variants,
+    warm_up,
+)
+from model.resilience import error_http_status
+from api_common import format_result, request_route, request_timeout
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
 import traceback
 
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False  # чтобы русский текст не экранировался
 
+# максимум писем в одном запросе /process/batch
+BATCH_MAX_LETTERS = int(os.getenv("BATCH_MAX_LETTERS", "1000"))
+# максимум вариантов ответа в одном запросе /process/variants
+VARIANTS_MAX = int(os.getenv("VARIANTS_MAX", "6"))
+# память /analyze: столько последних текстов и столько секунд (сроки считаются от текущей даты)
+ANALYZE_MEMO_SIZE = int(os.getenv("ANALYZE_MEMO_SIZE", "1024"))
+ANALYZE_MEMO_TTL = float(os.getenv("ANALYZE_MEMO_TTL", "300"))
+# воркеры очереди /jobs: столько писем одновременно ждут модель
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# раз в столько секунд ожидания задача получает +1 к приоритету в очереди
+JOB_AGING_SECONDS = float(os.getenv("JOB_AGING_SECONDS", "30"))
+# SQLite-файл со статусами и результатами /jobs, общий для воркеров gunicorn: опрос
+# GET /jobs/<id> может прийти не в тот процесс, что принял задачу. Пусто — только в памяти
+# процесса (один процесс); gunicorn.conf.py задаёт его сам, если воркеров больше одного.
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH") or None
+
+
+def run_letter_job(job) -> dict:
+    analysis, tone, length, use_cache, llm_mode, route = job.payload
+    return format_result(
+        complete_letter(analysis, tone, length, use_cache, llm_mode=llm_mode, route=route)
+    )
+
+
+def observe_job_wait(job, waited: float) -> None:
+    metrics.observe("letter_stage_seconds", waited, stage=f"queue_wait_p{job.priority}")
+
+
+# Очередь LLM-работы по приоритету письма (calculate_priority): правила считаются
+# сразу при POST /jobs, а резюме и ответ — воркерами в порядке приоритета.
+letter_jobs = PriorityJobQueue(
+    handler=run_letter_job,
+    workers=JOB_WORKERS,
+    aging_seconds=JOB_AGING_SECONDS,
+    on_wait=observe_job_wait,
+    store=JobStore(JOBS_DB_PATH) if JOBS_DB_PATH else None,
+)
+
+metrics.register_collector(lambda: [
+    ("job_queue_depth", "gauge", {}, letter_jobs.depth()),
+    ("job_queue_running", "gauge", {}, letter_jobs.running()),
+])
+# очередь /jobs тоже считается нагрузкой на модель при переходе в деградацию
+llm_load.add_queue_source(letter_jobs.depth)
+
+# Остановка (SIGTERM от gunicorn, см. gunicorn.conf.py): /readyz отвечает 503, чтобы
+# балансировщик убрал процесс, новые /jobs не принимаются, уже принятые доделываются.
+draining = threading.Event()
+
+
+def begin_drain() -> None:
+    draining.set()
+
+
+def drain(timeout: float | None = None) -> bool:
+    """Дожидается очереди /jobs; False — не успели за timeout."""
+    begin_drain()
+    return letter_jobs.drain(timeout)
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # процесс жив и отвечает; готовность к письмам — /readyz
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    if draining.is_set():
+        return jsonify({"status": "draining"}), 503
+    if not is_warm():
+        return jsonify({"status": "starting"}), 503
+    return jsonify({"status": "ready", "jobs_queued": letter_jobs.depth()})
+
+
+# (текст, компания, версия реестра) -> (когда посчитано, готовое тело ответа)
+analyze_memo: OrderedDict = OrderedDict()
+analyze_memo_lock = threading.Lock()
+
+
+def analyze_body(text: str, sender_company: str | None) -> bytes:
+    """
+    Компактный JSON правил для /analyze. Повтор того же текста (ввод остановился,
+    вернули удалённый символ, второй оператор с тем же письмом) отдаётся из памяти.
+    Перезагрузка реестра компаний меняет ключ — приоритеты пересчитываются.
+    """
+    key = (text, sender_company, company_registry.generation)
+    now = time.monotonic()
+    with analyze_memo_lock:
+        item = analyze_memo.get(key)
+        if item is not None and now - item[0] < ANALYZE_MEMO_TTL:
+            analyze_memo.move_to_end(key)
+            metrics.inc("analyze_memo_total", outcome="hit")
+            return item[1]
+    metrics.inc("analyze_memo_total", outcome="miss")
+
+    analysis = analyze_letter(text, sender_company, draft=True)
+    body = json.dumps(
+        {
+            "classification": analysis["category"],
+            "extractedInfo": analysis["info"],
+            "urgency": analysis["urgency"],
+            "priority": analysis["priority"]["final_priority"],
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    ).encode("utf-8")
+
+    with analyze_memo_lock:
+        analyze_memo[key] = (now, body)
+        analyze_memo.move_to_end(key)
+        while len(analyze_memo) > ANALYZE_MEMO_SIZE:
+            analyze_memo.popitem(last=False)
+    return body
+
+
+@app.route("/analyze", methods=["POST"])
+def analyze():
+    """
+    Только правила, без модели: категория, факты, срочность, приоритет — для показа
+    по мере набора письма. Тело: {"text", "sender_company"?}.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    text = data.get("text", "")
+    sender_company = data.get("sender_company")
+    if not isinstance(text, str):
+        return jsonify({"error": "Поле 'text' должно быть строкой"}), 400
+    if sender_company is not None and not isinstance(sender_company, str):
+        return jsonify({"error": "Поле 'sender_company' должно быть строкой"}), 400
+    text = text.strip()
+    if not text:
+        return jsonify({"error": "Поле 'text' обязательно"}), 400
+    return Response(analyze_body(text, sender_company), mimetype="application/json")
+
 
 @app.route("/process", methods=["POST"])
 def process():
@@ -13,25 +173,261 @@ def process():
         text = data.get("text", "").strip()
         tone = data.get("tone", "деловой")
         length = data.get("length", "medium")
+        # no_cache=true — пользователь хочет свежий вариант ответа («Перегенерировать»)
+        no_cache = bool(data.get("no_cache", False))
+        # mode="combined" — резюме и ответ одним вызовом модели, "separate" — двумя
+        llm_mode = data.get("mode")
 
         if not text:
             return jsonify({"error": "Поле 'text' обязательно"}), 400
 
-        result = process_letter(text, tone=tone, answer_length=length)
+        result = process_letter(
+            text,
+            tone=tone,
+            answer_length=length,
+            use_cache=not no_cache,
+            llm_mode=llm_mode,
+            route=request_route(data),
+            timeout=request_timeout(request.headers, data),
+        )
 
-        return jsonify({
-            "classification": result["category"],
-            "extractedInfo": result["info"],
-            "response": result["response"],
-            "urgency": result.get("urgency"),
-            "summary": result.get("summary")
-        })
+        # ответа модели нет: 504 — не успели до дедлайна, 503 — модель перегружена/недоступна
+        return jsonify(format_result(result)), error_http_status(result["errors"].get("response"))
+
+    except Exception as e:
+        metrics.inc("errors_total", stage="api", type=type(e).__name__)
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/process/stream", methods=["POST"])
+def process_stream():
+    """
+    То же, что /process, но в виде server-sent events: meta → delta… → summary → done.
+    Первые символы ответа приходят через время первого токена модели, а не всей генерации.
+    """
+    data = request.get_json(silent=True) or {}
+    text = data.get("text", "").strip()
+    tone = data.get("tone", "деловой")
+    length = data.get("length", "medium")
+    no_cache = bool(data.get("no_cache", False))
+
+    if not text:
+        return jsonify({"error": "Поле 'text' обязательно"}), 400
+
+    def events():
+        try:
+            for event, payload in process_letter_stream(
+                text,
+                tone=tone,
+                answer_length=length,
+                use_cache=not no_cache,
+                route=request_route(data),
+            ):
+                yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            metrics.inc("errors_total", stage="api", type=type(e).__name__)
+            app.logger.error(traceback.format_exc())
+            yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/process/variants", methods=["POST"])
+def process_variants():
+    """
+    Несколько вариантов ответа на одно письмо за время одного вызова модели.
+    Тело: {"text", "variants"?: [{"tone"?, "length"?}, ...]} или {"text", "tones": [...], "length"?}
+    (+ "no_cache", "route", "timeout" как у /process). Без variants и tones — все тона.
+    Ответ — как у /process плюс "variants": [{"tone", "length", "response", "error"?}, ...].
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        text = data.get("text", "").strip()
+        if not text:
+            return jsonify({"error": "Поле 'text' обязательно"}), 400
+
+        variants = data.get("variants")
+        if variants is None and data.get("tones"):
+            variants = [{"tone": tone} for tone in data["tones"]]
+        if variants is not None and (
+            not isinstance(variants, list) or not all(isinstance(v, dict) for v in variants)
+        ):
+            return jsonify({"error": "Поле 'variants' должно быть списком объектов"}), 400
+        if variants and len(variants) > VARIANTS_MAX:
+            return jsonify({"error": f"Не более {VARIANTS_MAX} вариантов в одном запросе"}), 400
+
+        result = process_letter_variants(
+            text,
+            variants,
+            answer_length=data.get("length"),
+            use_cache=not data.get("no_cache", False),
+            route=request_route(data),
+            timeout=request_timeout(request.headers, data),
+        )
+        payload = format_result(result)
+        payload["variants"] = result["variants"]
+        return jsonify(payload), error_http_status(result["errors"].get("response"))
 
     except Exception as e:
+        metrics.inc("errors_total", stage="api", type=type(e).__name__)
         app.logger.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/process/batch", methods=["POST"])
+def process_batch_route():
+    """
+    Тело: {"letters": [{"text", "tone"?, "length"?, "no_cache"?, "mode"?, "route"?}, ...], "concurrency"?: N,
+    "stream"?: bool, "mode"?: режим по умолчанию для писем батча}.
+    Без stream — {"results": [...]} в порядке писем; со stream (или Accept: application/x-ndjson) —
+    NDJSON, по строке {"index": i, ...} на каждое письмо по мере готовности.
+    """
+    data = request.get_json(silent=True) or {}
+    letters = data.get("letters")
+
+    if not isinstance(letters, list) or not letters:
+        return jsonify({"error": "Поле 'letters' должно быть непустым списком"}), 400
+    if len(letters) > BATCH_MAX_LETTERS:
+        return jsonify({"error": f"Не более {BATCH_MAX_LETTERS} писем в одном запросе"}), 400
+
+    jobs: list[dict] = []
+    job_indexes: list[int] = []
+    invalid: dict[int, dict] = {}
+    for i, item in enumerate(letters):
+        text = item.get("text", "").strip() if isinstance(item, dict) else ""
+        if not text:
+            invalid[i] = {"index": i, "error": "Поле 'text' обязательно"}
+            continue
+        jobs.append({
+            "text": text,
+            "tone": item.get("tone", "деловой"),
+            "length": item.get("length", "medium"),
+            "use_cache": not item.get("no_cache", False),
+            "llm_mode": item.get("mode", data.get("mode")),
+            "route": request_route(item),
+        })
+        job_indexes.append(i)
+
+    concurrency = data.get("concurrency")
+    timeout = request_timeout(request.headers, data)
+    stream = bool(data.get("stream")) or "application/x-ndjson" in request.headers.get("Accept", "")
+
+    def results():
+        yield from invalid.values()
+        try:
+            for j, result in process_batch(jobs, max_concurrency=concurrency, timeout=timeout):
+                yield {"index": job_indexes[j], **format_result(result)}
+        except Exception as e:
+            metrics.inc("errors_total", stage="api", type=type(e).__name__)
+            app.logger.error(traceback.format_exc())
+            yield {"error": str(e)}
+
+    if stream:
+        def ndjson():
+            for item in results():
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        return Response(ndjson(), mimetype="application/x-ndjson")
+
+    ordered: list = [None] * len(letters)
+    for item in results():
+        if "index" not in item:
+            return jsonify(item), 500
+        ordered[item["index"]] = item
+    return jsonify({"results": ordered})
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Асинхронная обработка: тело как у /process (+ "callback_url"?).
+    Сразу возвращает 202 с job_id и приоритетом; результат — GET /jobs/<job_id>
+    или POST на callback_url, когда задача выполнится.
+    """
+    data = request.get_json(silent=True) or {}
+    text = data.get("text", "").strip()
+    tone = data.get("tone", "деловой")
+    length = data.get("length", "medium")
+    no_cache = bool(data.get("no_cache", False))
+    llm_mode = data.get("mode")
+    callback_url = data.get("callback_url")
+
+    if not text:
+        return jsonify({"error": "Поле 'text' обязательно"}), 400
+    if draining.is_set():
+        return jsonify({"error": "Сервис останавливается, повторите запрос"}), 503
+
+    analysis = analyze_letter(text)
+    priority = analysis["priority"]["final_priority"]
+    try:
+        job = letter_jobs.submit(
+            priority,
+            (analysis, tone, length, not no_cache, llm_mode, request_route(data)),
+            callback_url,
+        )
+    except RuntimeError as e:
+        # очередь закрылась между проверкой и submit
+        return jsonify({"error": str(e)}), 503
+
+    snapshot = job.snapshot()
+    snapshot["classification"] = analysis["category"]
+    snapshot["urgency"] = analysis["urgency"]
+    return jsonify(snapshot), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = letter_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Задача не найдена"}), 404
+
+    snapshot = job.snapshot()
+    if job.status == "done":
+        snapshot["result"] = job.result
+    return jsonify(snapshot)
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(llm_cache.stats())
+
+
+@app.route("/duplicates/stats", methods=["GET"])
+def duplicates_stats():
+    # индекс почти-дубликатов: сколько писем получили готовый ответ похожего письма
+    return jsonify(near_duplicates.stats())
+
+
+@app.route("/limiter/stats", methods=["GET"])
+def limiter_stats():
+    # клиентский лимитер модели: текущий лимит параллельности, остаток квот RPM/TPM, 429
+    return jsonify(llm_limiter.snapshot())
+
+
+@app.route("/registry/reload", methods=["POST"])
+def registry_reload():
+    # индекс перестраивается в фоне, запросы пока обслуживает старый
+    started = company_registry.reload(background=True)
+    return jsonify({**company_registry.stats(), "started": started}), 202
+
+
+@app.route("/registry/stats", methods=["GET"])
+def registry_stats():
+    return jsonify(company_registry.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    # текстовый формат Prometheus: время этапов, категории, токены, ошибки, кэш
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
+    # конфиг и клиент модели создаются один раз до приёма запросов
+    warm_up()
     # Запуск: python api.py (открыть http://localhost:5001/process)
-    app.run(host="0.0.0.0", port=5001, debug=True)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=5001, debug=True)
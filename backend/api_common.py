@@ -0,0 +1,46 @@
+from collections.abc import Mapping
+
+from model.model_logic import LLM_CALL_TIMEOUT
+
+# Общее для api.py (Flask) и async_api.py (Quart): разбор параметров запроса
+# и формат ответа /process, без привязки к веб-фреймворку.
+
+
+def format_result(result: dict) -> dict:
+    payload = {
+        "classification": result["category"],
+        "extractedInfo": result["info"],
+        "response": result["response"],
+        "urgency": result.get("urgency"),
+        "summary": result.get("summary")
+    }
+    # частичный результат: один из LLM-вызовов упал или не уложился в таймаут
+    if result.get("errors"):
+        payload["errors"] = result["errors"]
+    if result.get("route"):
+        payload["route"] = result["route"]
+    # длинное письмо ушло в модель сжатым: сколько токенов и предложений отрезано
+    if result.get("prompt_stats"):
+        payload["promptStats"] = result["prompt_stats"]
+    return payload
+
+
+def request_route(data: dict) -> str | None:
+    # route: "llm" / "template" / "auto"; «Перегенерировать» (no_cache) — всегда ответ модели
+    return data.get("route") or ("llm" if data.get("no_cache") else None)
+
+
+def request_timeout(headers: Mapping[str, str], data: dict) -> float | None:
+    """
+    Дедлайн запроса в секундах: заголовок X-Request-Timeout или поле "timeout"
+    (клиент всё равно перестанет ждать — незачем повторять вызовы модели дольше).
+    Не больше LLM_CALL_TIMEOUT; None — LLM_CALL_TIMEOUT.
+    """
+    value = headers.get("X-Request-Timeout") or data.get("timeout")
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None
+    if timeout <= 0:
+        return None
+    return min(timeout, LLM_CALL_TIMEOUT) if LLM_CALL_TIMEOUT > 0 else timeout
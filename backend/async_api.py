@@ -0,0 +1,55 @@
+from quart import Quart, request, jsonify
+from model.model_logic import process_letter_async, warm_up
+from model.resilience import error_http_status
+from api_common import format_result, request_route, request_timeout
+import traceback
+
+# Асинхронный вариант backend/api.py: пока LLM отвечает, воркер не держит поток,
+# поэтому один процесс может вести сотни писем одновременно.
+# Запуск: hypercorn backend/async_api.py:app --bind 0.0.0.0:5001
+# (или python backend/async_api.py для локальной отладки)
+app = Quart(__name__)
+app.json.ensure_ascii = False  # чтобы русский текст не экранировался
+
+
+@app.before_serving
+async def startup():
+    # конфиг и клиенты модели создаются один раз до приёма запросов
+    warm_up()
+
+
+@app.route("/process", methods=["POST"])
+async def process():
+    try:
+        data = await request.get_json()
+        text = data.get("text", "").strip()
+        tone = data.get("tone", "деловой")
+        length = data.get("length", "medium")
+        # no_cache=true — пользователь хочет свежий вариант ответа («Перегенерировать»)
+        no_cache = bool(data.get("no_cache", False))
+        # mode="combined" — резюме и ответ одним вызовом модели, "separate" — двумя
+        llm_mode = data.get("mode")
+
+        if not text:
+            return jsonify({"error": "Поле 'text' обязательно"}), 400
+
+        result = await process_letter_async(
+            text,
+            tone=tone,
+            answer_length=length,
+            use_cache=not no_cache,
+            llm_mode=llm_mode,
+            route=request_route(data),
+            timeout=request_timeout(request.headers, data),
+        )
+
+        # ответа модели нет: 504 — не успели до дедлайна, 503 — модель перегружена/недоступна
+        return jsonify(format_result(result)), error_http_status(result["errors"].get("response"))
+
+    except Exception as e:
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5001)
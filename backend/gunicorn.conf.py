@@ -0,0 +1,91 @@
+# Продакшен-запуск бэкенда (run.py --prod делает то же самое):
+#   gunicorn -c backend/gunicorn.conf.py --pythonpath backend api:app   (из корня репозитория)
+#
+# Процессы — чтобы правила (классификация, факты, приоритет — чистый Python под GIL)
+# занимали все ядра; потоки в каждом — чтобы ожидание модели не держало процесс.
+# Код и правила загружаются один раз в мастере (preload_app) и делятся с воркерами
+# через fork; клиенты модели, соединение с дисковым кэшем и фоновые потоки каждый воркер
+# поднимает сам (post_worker_init).
+#
+# Остановка и деплой без потери писем: SIGTERM мастеру → воркеры перестают принимать
+# соединения, /readyz отвечает 503, запросы и очередь /jobs доделываются в пределах
+# graceful_timeout. SIGHUP — плавная замена воркеров с новым конфигом.
+import multiprocessing
+import os
+import signal
+import tempfile
+
+bind = os.getenv("BACKEND_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("BACKEND_WORKERS", str(multiprocessing.cpu_count())))
+threads = int(os.getenv("BACKEND_THREADS", "16"))
+worker_class = "gthread"
+preload_app = True
+keepalive = 5
+# письмо может ждать модель до LLM_CALL_TIMEOUT (с повторами) — столько и ждём при остановке
+graceful_timeout = int(os.getenv(
+    "BACKEND_GRACEFUL_TIMEOUT", str(int(float(os.getenv("LLM_CALL_TIMEOUT", "60"))) + 10)
+))
+# пустое значение — без access-лога
+accesslog = os.getenv("BACKEND_ACCESS_LOG", "-") or None
+
+# Квоты провайдера (rate_limit.py) считаются в каждом процессе отдельно: делим общую
+# квоту между воркерами. Исходное значение сохраняется в *_TOTAL — при SIGHUP конфиг
+# перечитывается, и делить второй раз нельзя.
+for _name in ("LLM_RPM", "LLM_TPM"):
+    _total = float(os.environ.setdefault(f"{_name}_TOTAL", os.getenv(_name, "0")))
+    if _total > 0:
+        os.environ[_name] = str(_total / workers)
+
+
+# Задачи /jobs выполняет принявший их воркер, а опрос GET /jobs/<id> приходит в любой —
+# статусы и результаты лежат в общем SQLite-файле (api.JOBS_DB_PATH). По умолчанию — временный
+# файл этого мастера (при SIGHUP pid тот же, файл сохраняется), удаляется при остановке.
+def _default_jobs_db() -> str:
+    return os.path.join(tempfile.gettempdir(), f"letter_jobs_{os.getpid()}.sqlite3")
+
+
+if workers > 1 and not os.getenv("JOBS_DB_PATH"):
+    os.environ["JOBS_DB_PATH"] = _default_jobs_db()
+
+
+def on_starting(server):
+    # модули приложения уже импортированы (preload_app): дочитываем конфиг и клиентские библиотеки
+    from model.model_logic import preload
+
+    preload()
+
+
+def post_worker_init(worker):
+    import api
+    from model.model_logic import warm_up
+
+    warm_up()
+
+    # SIGTERM: сначала помечаем процесс как останавливающийся (для /readyz и /jobs),
+    # потом — штатная обработка gunicorn (перестать принимать соединения, доделать запросы)
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_term(signum, frame):
+        api.begin_drain()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def worker_exit(server, worker):
+    import api
+
+    if not api.drain(timeout=graceful_timeout):
+        server.log.warning("Очередь /jobs не доделана к остановке воркера %s", worker.pid)
+
+
+def on_exit(server):
+    # заданный явно файл не трогаем — только временный по умолчанию
+    path = os.environ.get("JOBS_DB_PATH")
+    if path == _default_jobs_db():
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
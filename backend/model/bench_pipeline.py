@@ -0,0 +1,269 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter, perf_counter_ns
+
+from model_logic import (
+    PROMPT_TOKEN_BUDGET,
+    analyze_letter,
+    calculate_priority,
+    classify_letter,
+    estimate_urgency,
+    extract_entities,
+    extract_info,
+    preprocess_text,
+)
+from prompt_budget import compress_letter
+
+# Бенчмарк правил пайплайна без модели и без ключей: синтетические деловые письма
+# нескольких размеров, время каждого этапа отдельно и analyze_letter целиком
+# (в режиме черновика: правила без сжатия текста для промпта — оно отдельным этапом).
+#
+#   python bench_pipeline.py                         — все размеры, результат в bench_pipeline.json
+#   python bench_pipeline.py -o after.json --compare before.json --fail-on-regression
+#
+# В JSON — ops/s, p50 и p99 (мкс) для каждой пары (этап, размер) и коммит git, так что
+# прогоны до и после изменения можно сравнить (--compare).
+
+# размер письма в символах: от короткого уведомления до регуляторного запроса на 50 КБ
+SIZES = {
+    "notice": 400,
+    "letter": 2_000,
+    "long": 10_000,
+    "regulatory": 50_000,
+}
+
+COMPANIES = [
+    'ООО "Ромашка"', "ООО «Вектор Плюс»", "АО «Северный Гранит»", "ПАО «Меридиан»",
+    "ЗАО «Импульс-Торг»", "ИП Иванов Сергей Петрович", "ООО «Альфа Логистик»",
+]
+
+OPENINGS = {
+    "Официальная жалоба или претензия": [
+        "Настоящим заявляем претензию в связи с ненадлежащим исполнением договора №{doc} от {date}.",
+        "Выражаем несогласие с действиями Банка: {date} с нашего счёта были списаны {amount} руб. без распоряжения.",
+    ],
+    "Регуляторный запрос": [
+        "В соответствии с предписанием Банка России № {doc} просим предоставить сведения об операциях клиента в срок до {date}.",
+        "На основании статьи 26 Федерального закона «О банках и банковской деятельности» направляем запрос № {doc}.",
+    ],
+    "Запрос на согласование": [
+        "Просим согласовать изменение графика платежей по кредитному договору №{doc} от {date}.",
+        "Направляем на согласование проект дополнительного соглашения №{doc} к договору банковского счёта.",
+    ],
+    "Запрос информации/документов": [
+        "Просим предоставить выписку по расчётному счёту за период с {date} по {date2}.",
+        "Прошу направить справку об отсутствии задолженности по договору №{doc} в срок до {date}.",
+    ],
+    "Партнёрское предложение": [
+        "Предлагаем рассмотреть возможность сотрудничества в области зарплатных проектов для наших сотрудников.",
+        "Наша компания заинтересована в партнёрстве по эквайрингу и готова обсудить условия до {date}.",
+    ],
+    "Уведомление или информирование": [
+        "Уведомляем Вас о смене юридического адреса компании с {date}.",
+        "Информируем, что с {date} полномочия генерального директора переходят к новому руководителю.",
+    ],
+}
+
+BODY = [
+    "Сумма задолженности по состоянию на {date} составляет {amount} руб.",
+    "Просим рассмотреть обращение в течение {n} рабочих дней с момента получения.",
+    "Ранее направленное письмо исх. №{doc} от {date} оставлено без ответа.",
+    "Пунктом {n} статьи {m} Федерального закона от {date} № {k}-ФЗ предусмотрена обязанность кредитной организации предоставить указанные сведения.",
+    "К письму прилагаются копии платёжных поручений на общую сумму {amount} рублей.",
+    "В случае неисполнения требования мы будем вынуждены обратиться в суд.",
+    "Обращаем внимание, что срок исполнения истекает {date}, просим не затягивать с ответом.",
+    "Контактное лицо по данному вопросу — финансовый директор, который готов предоставить пояснения.",
+    "Все расчёты выполнены в соответствии с условиями договора и действующими тарифами Банка.",
+    "Дополнительно сообщаем, что реквизиты для перечисления средств остались без изменений.",
+]
+
+SIGNATURE = (
+    "С уважением,\nГенеральный директор\n{company}\n"
+    "Адрес: 123456, г. Москва, ул. Лесная, д. {n}, оф. {m}\n"
+    "Тел.: +7 (495) {k}-45-67\nE-mail: office@example.ru\nИНН 77{doc_digits}"
+)
+
+
+def _fill(template: str, rng: random.Random, today: datetime) -> str:
+    date = today + timedelta(days=rng.randint(-90, 60))
+    return template.format(
+        doc=f"{rng.choice(['БС', 'КД', 'ДС', ''])}-{rng.randint(100, 99999)}".lstrip("-"),
+        date=date.strftime("%d.%m.%Y"),
+        date2=(date + timedelta(days=rng.randint(10, 90))).strftime("%d.%m.%Y"),
+        amount=f"{rng.randint(10, 9_999_999):,}".replace(",", " "),
+        n=rng.randint(2, 30),
+        m=rng.randint(1, 99),
+        k=rng.randint(100, 999),
+        company=rng.choice(COMPANIES),
+        doc_digits=rng.randint(10_000_000, 99_999_999),
+    )
+
+
+def generate_letter(chars: int, rng: random.Random, today: datetime) -> str:
+    """Письмо примерно на chars символов: обращение, суть, абзацы с фактами, подпись с реквизитами."""
+    category = rng.choice(list(OPENINGS))
+    paragraphs = [
+        "Уважаемые коллеги!",
+        f"{rng.choice(COMPANIES)} сообщает следующее. " + _fill(rng.choice(OPENINGS[category]), rng, today),
+    ]
+    signature = _fill(SIGNATURE, rng, today)
+    size = sum(len(p) for p in paragraphs) + len(signature)
+    while size < chars:
+        paragraph = " ".join(_fill(rng.choice(BODY), rng, today) for _ in range(rng.randint(2, 5)))
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs + [signature])
+
+
+def generate_corpus(chars: int, count: int, seed: int = 42) -> list[str]:
+    rng = random.Random(seed + chars)
+    today = datetime(2025, 12, 1)
+    return [generate_letter(chars, rng, today) for _ in range(count)]
+
+
+def bench(fn, inputs: list, min_time: float, min_iters: int, max_iters: int) -> dict:
+    """Вызывает fn по кругу на inputs; время каждого вызова отдельно — для перцентилей."""
+    for item in inputs[:3]:
+        fn(item)  # прогрев: ленивые кэши, компиляция регулярок
+
+    samples: list[int] = []
+    started = perf_counter()
+    i = 0
+    while i < max_iters and (i < min_iters or perf_counter() - started < min_time):
+        item = inputs[i % len(inputs)]
+        t = perf_counter_ns()
+        fn(item)
+        samples.append(perf_counter_ns() - t)
+        i += 1
+
+    samples.sort()
+    total = sum(samples) / 1e9
+    return {
+        "n": len(samples),
+        "ops_per_sec": round(len(samples) / total, 1) if total else None,
+        "mean_us": round(statistics.fmean(samples) / 1e3, 2),
+        "p50_us": round(samples[len(samples) // 2] / 1e3, 2),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1e3, 2),
+    }
+
+
+def stage_inputs(corpus: list[str]) -> dict[str, tuple]:
+    """Этап -> (функция одного аргумента, входы). Входы каждого этапа готовятся заранее."""
+    cleaned = [preprocess_text(t) for t in corpus]
+    prepared = [
+        (classify_letter(t), estimate_urgency(t), extract_info(t)) for t in cleaned
+    ]
+    # сжатие для промпта — на исходном тексте, с сущностями по очищенному, как в пайплайне;
+    # письма короче бюджета там не сжимаются, здесь — сжимаются все (цена самого прохода)
+    budget = PROMPT_TOKEN_BUDGET if PROMPT_TOKEN_BUDGET > 0 else 2000
+    with_entities = [(t, extract_entities(c)) for t, c in zip(corpus, cleaned)]
+    return {
+        "preprocess_text": (preprocess_text, corpus),
+        "classify_letter": (classify_letter, cleaned),
+        "extract_info": (extract_info, cleaned),
+        "estimate_urgency": (estimate_urgency, cleaned),
+        "calculate_priority": (
+            lambda args: calculate_priority(args[0], args[1], args[2], args[2].get("sender_company")),
+            prepared,
+        ),
+        "compress_letter": (lambda args: compress_letter(args[0], args[1], budget), with_entities),
+        "analyze_letter": (lambda t: analyze_letter(t, draft=True), corpus),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> tuple[list[str], list[str]]:
+    """(строки отчёта о сравнении с прошлым прогоном, строки регрессий); регрессии помечены «!»."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["stage"], r["size"]): r for r in json.load(f)["results"]}
+
+    lines, regressions = [], []
+    for r in results:
+        old = baseline.get((r["stage"], r["size"]))
+        if old is None:
+            continue
+        change = r["p50_us"] / old["p50_us"] - 1 if old["p50_us"] else 0.0
+        mark = "!" if change > threshold else " "
+        lines.append(
+            f"{mark} {r['stage']:<20} {r['size']:<11} p50 {old['p50_us']:>10.1f} → {r['p50_us']:>10.1f} мкс"
+            f" ({change:+.1%})"
+        )
+        if change > threshold:
+            regressions.append(lines[-1])
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк правил пайплайна (без модели)")
+    parser.add_argument("--sizes", default=",".join(SIZES), help=f"через запятую из {', '.join(SIZES)}")
+    parser.add_argument("--stages", default=None, help="через запятую (по умолчанию все)")
+    parser.add_argument("--letters", type=int, default=50, help="писем каждого размера в корпусе")
+    parser.add_argument("--min-time", type=float, default=1.0, help="минимум секунд на этап")
+    parser.add_argument("--min-iters", type=int, default=50)
+    parser.add_argument("--max-iters", type=int, default=200_000)
+    parser.add_argument("-o", "--output", default="bench_pipeline.json", help="куда сохранить JSON")
+    parser.add_argument("--compare", default=None, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.20,
+                        help="рост p50, считающийся регрессией (шум между прогонами — около 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="код выхода 1 при регрессии")
+    args = parser.parse_args()
+
+    sizes = [s for s in args.sizes.split(",") if s]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"неизвестные размеры: {', '.join(unknown)}")
+
+    results = []
+    print(f"{'этап':<20} {'размер':<11} {'символов':>9} {'ops/s':>11} {'p50, мкс':>10} {'p99, мкс':>10}")
+    for size in sizes:
+        corpus = generate_corpus(SIZES[size], args.letters)
+        chars = round(statistics.fmean(len(t) for t in corpus))
+        for stage, (fn, inputs) in stage_inputs(corpus).items():
+            if args.stages and stage not in args.stages.split(","):
+                continue
+            r = bench(fn, inputs, args.min_time, args.min_iters, args.max_iters)
+            results.append({"stage": stage, "size": size, "chars": chars, **r})
+            print(f"{stage:<20} {size:<11} {chars:>9} {r['ops_per_sec']:>11.1f} "
+                  f"{r['p50_us']:>10.1f} {r['p99_us']:>10.1f}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "letters": args.letters,
+            "min_time": args.min_time,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты: {args.output}")
+
+    if args.compare:
+        lines, regressions = compare(results, args.compare, args.threshold)
+        print(f"\nСравнение с {args.compare}:")
+        print("\n".join(lines))
+        if regressions:
+            print(f"\nРегрессий (p50 хуже более чем на {args.threshold:.0%}): {len(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
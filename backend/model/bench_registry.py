@@ -0,0 +1,90 @@
+import argparse
+import csv
+import os
+import random
+import tempfile
+from time import perf_counter
+
+from company_registry import CompanyRegistry, normalize_company_name
+
+FORMS = ["ООО", "АО", "ПАО", "ЗАО", "ИП", "Общество с ограниченной ответственностью"]
+WORDS = [
+    "Ромашка", "Вектор", "Альфа", "Север", "Гранит", "Меридиан", "Импульс", "Каскад",
+    "Орион", "Весна", "Техно", "Строй", "Торг", "Инвест", "Логистик", "Агро", "Финанс",
+    "Ёлка", "Бизнес", "Системы", "Сервис", "Капитал", "Ресурс", "Холдинг", "Групп",
+]
+SEGMENTS = ["VIP-клиент", "Корпоративный", "МСБ", "Регулятор", "Партнёр"]
+RISKS = ["low", "medium", "high"]
+
+
+def generate_registry(path: str, size: int, seed: int = 42) -> list[str]:
+    """Синтетический реестр в CSV; возвращает имена компаний для запросов."""
+    rng = random.Random(seed)
+    names = []
+    seen = set()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "base_priority", "segment", "risk_level"])
+        while len(names) < size:
+            title = " ".join(rng.sample(WORDS, rng.randint(1, 3))) + f" {rng.randint(1, 99999)}"
+            name = f"{rng.choice(FORMS)} «{title}»"
+            if normalize_company_name(name) in seen:
+                continue
+            seen.add(normalize_company_name(name))
+            names.append(name)
+            writer.writerow([name, rng.randint(1, 9), rng.choice(SEGMENTS), rng.choice(RISKS)])
+    return names
+
+
+def bench(fn, queries: list[str]) -> float:
+    """Среднее время одного вызова в микросекундах."""
+    start = perf_counter()
+    for q in queries:
+        fn(q)
+    return (perf_counter() - start) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска в реестре компаний")
+    parser.add_argument("--size", type=int, default=300_000)
+    parser.add_argument("--queries", type=int, default=100_000)
+    parser.add_argument("--cache-size", type=int, default=50_000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "registry.csv")
+
+        t = perf_counter()
+        names = generate_registry(source, args.size)
+        print(f"Сгенерировано {args.size} компаний за {perf_counter() - t:.1f} с")
+
+        registry = CompanyRegistry(source, cache_size=args.cache_size)
+        t = perf_counter()
+        registry.load()
+        print(f"Индекс построен за {perf_counter() - t:.1f} с, "
+              f"{os.path.getsize(registry.stats()['index']) / 2**20:.1f} МБ на диске")
+
+        # другое написание тех же имён: кавычки, регистр, ё, полная форма
+        variants = [
+            n.replace("«", '"').replace("»", '"').upper().replace("Ё", "Е")
+            for n in rng.sample(names, min(args.queries, len(names)))
+        ]
+        misses = [f"ООО «Нет такой {i}»" for i in range(args.queries)]
+        prefixes = [n[: max(6, len(n) - 4)] for n in rng.sample(names, min(args.queries, len(names)))]
+
+        cold = bench(registry.get, variants)
+        warm = bench(registry.get, variants[-(args.cache_size // 2):])
+        miss = bench(registry.get, misses)
+        prefix = bench(lambda q: registry.find_prefix(q, limit=2), prefixes)
+
+        print(f"get, точное совпадение (SQLite):  {cold:7.1f} мкс")
+        print(f"get, повтор (LRU):                 {warm:7.1f} мкс")
+        print(f"get, промах:                       {miss:7.1f} мкс")
+        print(f"find_prefix:                       {prefix:7.1f} мкс")
+        print(f"Записей в LRU: {len(registry._cache)} из {args.cache_size}")
+        print(registry.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from model_logic import BATCH_MAX_CONCURRENCY, process_letter
+
+# Пакетная обработка архива писем: JSONL на входе (файл или stdin), JSONL на выходе.
+#
+#   python bulk_process.py letters.jsonl -o results.jsonl --workers 16
+#   cat letters.jsonl | python bulk_process.py - -o results.jsonl
+#
+# Строка входа — {"id"?, "text", "tone"?, "length"?, "sender_company"?, "mode"?, "route"?};
+# строка выхода — {"id", "line", ...результат process_letter} или {"id", "line", "error"}.
+# Результаты пишутся по мере готовности (не в порядке входа). В памяти — только окно
+# из in-flight писем, поэтому размер входа не важен.
+#
+# Чекпоинт (по умолчанию <output>.ckpt) атомарно сохраняет, сколько байт выхода записано
+# и какие строки входа обработаны. После падения тот же запуск продолжит с места
+# остановки: выход обрезается до зафиксированного размера, готовые строки пропускаются —
+# каждое письмо попадает в выход ровно один раз.
+
+
+class Checkpoint:
+    """
+    Прогресс в объёме O(окна), а не O(входа): next_line — все строки до неё готовы
+    (input_offset — её смещение в файле входа), done — готовые строки после неё.
+    """
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.next_line = 0
+        self.input_offset = 0
+        self.output_offset = 0
+        self.done: set[int] = set()
+        self.processed = 0
+        self.failed = 0
+
+    def load(self, input_name: str) -> bool:
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("input") != input_name:
+            raise SystemExit(
+                f"Чекпоинт {self.path} относится к входу {state.get('input')!r}, а не {input_name!r}"
+            )
+        self.next_line = state["next_line"]
+        self.input_offset = state["input_offset"]
+        self.output_offset = state["output_offset"]
+        self.done = set(state["done"])
+        self.processed = state["processed"]
+        self.failed = state["failed"]
+        return True
+
+    def save(self, input_name: str) -> None:
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "input": input_name,
+                "next_line": self.next_line,
+                "input_offset": self.input_offset,
+                "output_offset": self.output_offset,
+                "done": sorted(self.done),
+                "processed": self.processed,
+                "failed": self.failed,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class Progress:
+    """Живая скорость в stderr: всего, писем/с за последние window секунд, ошибки, в работе."""
+
+    def __init__(self, every: float, window: float = 10.0):
+        self.every = every
+        self.window = window
+        self.started = time.monotonic()
+        self.last_report = 0.0
+        self._marks: deque[tuple[float, int]] = deque()
+        self.tty = sys.stderr.isatty()
+
+    def report(self, processed: int, failed: int, in_flight: int, force: bool = False) -> None:
+        now = time.monotonic()
+        self._marks.append((now, processed))
+        while now - self._marks[0][0] > self.window:
+            self._marks.popleft()
+        if not force and now - self.last_report < self.every:
+            return
+        self.last_report = now
+
+        first_at, first_count = self._marks[0]
+        rate = (processed - first_count) / (now - first_at) if now > first_at else 0.0
+        line = (
+            f"обработано {processed} | {rate:.1f} писем/с | ошибок {failed} | "
+            f"в работе {in_flight} | {now - self.started:.0f} с"
+        )
+        if self.tty:
+            sys.stderr.write("\r" + line.ljust(80))
+            if force:
+                sys.stderr.write("\n")
+        else:
+            sys.stderr.write(line + "\n")
+        sys.stderr.flush()
+
+
+def read_lines(stream, checkpoint: Checkpoint, seekable: bool):
+    """(номер строки, смещение, байты) для ещё не обработанных строк входа."""
+    line_no = 0
+    offset = 0
+    if seekable and checkpoint.input_offset:
+        stream.seek(checkpoint.input_offset)
+        line_no, offset = checkpoint.next_line, checkpoint.input_offset
+    for raw in stream:
+        current, line_no, start = line_no, line_no + 1, offset
+        offset += len(raw)
+        if current < checkpoint.next_line or current in checkpoint.done:
+            continue
+        if raw.strip():
+            yield current, start, raw
+
+
+def process_line(raw: bytes, args) -> dict:
+    letter = json.loads(raw)
+    text = (letter.get("text") or "").strip()
+    if not text:
+        raise ValueError("Поле 'text' обязательно")
+    return process_letter(
+        text,
+        tone=letter.get("tone", args.tone),
+        sender_company=letter.get("sender_company"),
+        answer_length=letter.get("length", args.length),
+        timeout=args.timeout,
+        use_cache=not args.no_cache,
+        llm_mode=letter.get("mode", args.mode),
+        route=letter.get("route", args.route),
+    )
+
+
+def letter_id(raw: bytes, line_no: int):
+    try:
+        return json.loads(raw).get("id", line_no)
+    except (ValueError, AttributeError):
+        return line_no
+
+
+def run(args) -> int:
+    from_stdin = args.input == "-"
+    input_name = "<stdin>" if from_stdin else os.path.abspath(args.input)
+    checkpoint_path = None if args.no_checkpoint else (args.checkpoint or f"{args.output}.ckpt")
+    checkpoint = Checkpoint(checkpoint_path)
+    resumed = checkpoint.load(input_name)
+
+    # всё, что записано после последнего чекпоинта, будет посчитано заново
+    output = open(args.output, "ab")
+    output.truncate(checkpoint.output_offset if resumed else 0)
+    output.seek(0, os.SEEK_END)
+    if resumed:
+        sys.stderr.write(
+            f"Продолжение с чекпоинта: готово {checkpoint.processed}, строка {checkpoint.next_line}\n"
+        )
+
+    stream = sys.stdin.buffer if from_stdin else open(args.input, "rb")
+    progress = Progress(args.progress_every)
+    max_in_flight = args.workers * 2
+    # номер строки -> смещение, для строк, прочитанных, но ещё не записанных в выход
+    pending: dict[int, int] = {}
+    in_flight: dict = {}
+    read_head = (checkpoint.next_line, checkpoint.input_offset)
+    last_checkpoint = time.monotonic()
+    lines = read_lines(stream, checkpoint, seekable=not from_stdin)
+    exhausted = False
+
+    def advance_watermark() -> None:
+        # next_line — первая незаписанная строка; готовые строки до неё больше не нужны
+        line_no, offset = min(pending.items()) if pending else read_head
+        checkpoint.next_line, checkpoint.input_offset = line_no, offset
+        checkpoint.done = {n for n in checkpoint.done if n >= line_no}
+
+    def save_checkpoint() -> None:
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint.output_offset = output.tell()
+        advance_watermark()
+        checkpoint.save(input_name)
+
+    pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="bulk")
+    try:
+        while True:
+            while not exhausted and len(in_flight) < max_in_flight:
+                item = next(lines, None)
+                if item is None:
+                    exhausted = True
+                    break
+                line_no, offset, raw = item
+                pending[line_no] = offset
+                read_head = (line_no + 1, offset + len(raw))
+                in_flight[pool.submit(process_line, raw, args)] = (line_no, raw)
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, timeout=args.progress_every, return_when=FIRST_COMPLETED)
+            for future in done:
+                line_no, raw = in_flight.pop(future)
+                record = {"id": letter_id(raw, line_no), "line": line_no}
+                try:
+                    record.update(future.result())
+                    if record.get("errors"):
+                        checkpoint.failed += 1
+                except Exception as e:
+                    record["error"] = f"{type(e).__name__}: {e}"
+                    checkpoint.failed += 1
+                output.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+                del pending[line_no]
+                checkpoint.done.add(line_no)
+                checkpoint.processed += 1
+
+            progress.report(checkpoint.processed, checkpoint.failed, len(in_flight))
+            if time.monotonic() - last_checkpoint >= args.checkpoint_every:
+                save_checkpoint()
+                last_checkpoint = time.monotonic()
+    except KeyboardInterrupt:
+        sys.stderr.write("\nОстановлено: незаконченные письма будут обработаны при следующем запуске\n")
+        for future in in_flight:
+            future.cancel()
+        return 130
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        save_checkpoint()
+        output.close()
+        if not from_stdin:
+            stream.close()
+        progress.report(checkpoint.processed, checkpoint.failed, 0, force=True)
+
+    if checkpoint_path and not args.keep_checkpoint:
+        os.remove(checkpoint_path)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная обработка писем из JSONL с чекпоинтами")
+    parser.add_argument("input", help="JSONL с письмами или - для stdin")
+    parser.add_argument("-o", "--output", required=True, help="JSONL с результатами (при продолжении с чекпоинта — дописывается)")
+    parser.add_argument("--workers", type=int, default=BATCH_MAX_CONCURRENCY,
+                        help="сколько писем обрабатывается одновременно")
+    parser.add_argument("--timeout", type=float, default=None, help="дедлайн на письмо, с")
+    parser.add_argument("--tone", default=None, help="тон по умолчанию")
+    parser.add_argument("--length", default="medium", help="длина ответа по умолчанию")
+    parser.add_argument("--mode", default=None, help="режим LLM по умолчанию: separate / combined")
+    parser.add_argument("--route", default=None, help="маршрут по умолчанию: llm / template / auto")
+    parser.add_argument("--no-cache", action="store_true", help="не брать ответы из llm_cache")
+    parser.add_argument("--checkpoint", default=None, help="файл чекпоинта (по умолчанию <output>.ckpt)")
+    parser.add_argument("--checkpoint-every", type=float, default=5.0, help="раз в столько секунд")
+    parser.add_argument("--keep-checkpoint", action="store_true", help="не удалять чекпоинт в конце")
+    parser.add_argument("--no-checkpoint", action="store_true", help="без чекпоинта и продолжения")
+    parser.add_argument("--progress-every", type=float, default=1.0, help="частота вывода скорости, с")
+    args = parser.parse_args()
+    if args.workers <= 0:
+        parser.error("--workers должен быть положительным")
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
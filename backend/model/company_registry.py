@@ -0,0 +1,291 @@
+import csv
+import glob
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# полные формы → сокращения, чтобы «Общество с ограниченной ответственностью «Ромашка»»
+# и «ООО "Ромашка"» давали один ключ
+_LEGAL_FORMS = [
+    ("публичное акционерное общество", "пао"),
+    ("непубличное акционерное общество", "ао"),
+    ("закрытое акционерное общество", "зао"),
+    ("открытое акционерное общество", "оао"),
+    ("акционерное общество", "ао"),
+    ("общество с ограниченной ответственностью", "ооо"),
+    ("индивидуальный предприниматель", "ип"),
+]
+_LEGAL_FORMS_RE = re.compile("|".join(re.escape(full) for full, _ in _LEGAL_FORMS))
+_LEGAL_FORMS_MAP = dict(_LEGAL_FORMS)
+_QUOTES_RE = re.compile(r"[«»\"'“”„‘’`]")
+_SPACES_RE = re.compile(r"\s+")
+
+PROFILE_FIELDS = ("base_priority", "segment", "risk_level")
+
+
+def normalize_company_name(name: str) -> str:
+    """
+    Ключ компании в реестре: нижний регистр, ё → е, без кавычек любого вида,
+    организационно-правовая форма сокращена (ООО/АО/ПАО/...), пробелы схлопнуты.
+    """
+    if not name:
+        return ""
+    key = name.lower().replace("ё", "е")
+    key = _QUOTES_RE.sub(" ", key)
+    key = _SPACES_RE.sub(" ", key).strip()
+    key = _LEGAL_FORMS_RE.sub(lambda m: _LEGAL_FORMS_MAP[m.group(0)], key)
+    return key
+
+
+def _iter_source_rows(source_path: str):
+    """Строки исходного файла реестра: CSV с заголовком или JSONL, поля name + PROFILE_FIELDS."""
+    if source_path.endswith(".jsonl"):
+        with open(source_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        with open(source_path, "r", encoding="utf-8", newline="") as f:
+            yield from csv.DictReader(f)
+
+
+def build_index(source_path: str, index_path: str, chunk_size: int = 10_000) -> int:
+    """
+    Строит SQLite-индекс реестра из CSV/JSONL. Ключ — нормализованное имя (PRIMARY KEY,
+    B-дерево: точный поиск и поиск по префиксу диапазоном). Возвращает число записей.
+    """
+    tmp_path = index_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = sqlite3.connect(tmp_path)
+    db.execute("PRAGMA journal_mode=OFF")
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute(
+        "CREATE TABLE companies ("
+        " norm TEXT PRIMARY KEY,"
+        " name TEXT NOT NULL,"
+        " base_priority INTEGER,"
+        " segment TEXT,"
+        " risk_level TEXT"
+        ") WITHOUT ROWID"
+    )
+
+    count = 0
+    chunk = []
+    for row in _iter_source_rows(source_path):
+        norm = normalize_company_name(row.get("name", ""))
+        if not norm:
+            continue
+        base = row.get("base_priority")
+        chunk.append((
+            norm,
+            row["name"],
+            int(base) if base not in (None, "") else None,
+            row.get("segment") or None,
+            row.get("risk_level") or None,
+        ))
+        if len(chunk) >= chunk_size:
+            db.executemany("INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?, ?)", chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        db.executemany("INSERT OR REPLACE INTO companies VALUES (?, ?, ?, ?, ?)", chunk)
+        count += len(chunk)
+
+    db.commit()
+    db.close()
+    os.replace(tmp_path, index_path)
+    return count
+
+
+class CompanyRegistry:
+    """
+    Реестр клиентов для расчёта приоритета.
+
+    Данные лежат в SQLite-индексе на диске (в памяти процесса только LRU последних
+    запросов на cache_size записей), поэтому память не растёт с размером реестра.
+    Если задан CSV/JSONL, индекс строится рядом с ним (<файл>.<mtime>.sqlite) и
+    переиспользуется между перезапусками. Готовый .sqlite/.db можно указать напрямую.
+
+    reload() перестраивает индекс в фоне: пока идёт сборка, запросы обслуживает
+    старый индекс (или seed-таблица при первом запуске), затем ссылка подменяется.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        seed: dict[str, dict] | None = None,
+        cache_size: int = 50_000,
+    ):
+        self.path = path
+        self.cache_size = cache_size
+        # небольшая таблица «по умолчанию» (COMPANY_PRIORITY_TABLE) — хэш-индекс в памяти
+        self._seed = {normalize_company_name(k): dict(v) for k, v in (seed or {}).items()}
+        self._seed_names = {normalize_company_name(k): k for k in (seed or {})}
+
+        # (путь к индексу, поколение) — одна ссылка, чтобы читатели видели согласованную пару
+        self._current: tuple[str | None, int] = (None, 0)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reload_thread: threading.Thread | None = None
+        self._cache: OrderedDict[str, dict | None] = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "cache_hits": 0, "size": len(self._seed)}
+
+    # ---------- загрузка ----------
+
+    def _index_path_for(self, source_path: str) -> str:
+        if source_path.endswith((".sqlite", ".db")):
+            return source_path
+        mtime = os.stat(source_path).st_mtime_ns
+        return f"{source_path}.{mtime}.sqlite"
+
+    def load(self) -> None:
+        """Синхронно открывает (при необходимости строит) индекс. Для warm_up и скриптов."""
+        if not self.path:
+            return
+        index_path = self._index_path_for(self.path)
+        if not os.path.exists(index_path):
+            build_index(self.path, index_path)
+        self._swap(index_path)
+
+    def reload(self, background: bool = True) -> bool:
+        """Перечитать исходный файл. False — перезагрузка уже идёт (или реестр без файла)."""
+        if not self.path:
+            return False
+        if not background:
+            self.load()
+            return True
+        with self._lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return False
+            self._reload_thread = threading.Thread(
+                target=self._reload_safe, name="company-registry-reload", daemon=True
+            )
+            self._reload_thread.start()
+        return True
+
+    def _reload_safe(self) -> None:
+        try:
+            self.load()
+        except Exception as e:
+            print(f"Не удалось перезагрузить реестр компаний {self.path}: {e}")
+
+    def _swap(self, index_path: str) -> None:
+        db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+        (size,) = db.execute("SELECT COUNT(*) FROM companies").fetchone()
+        db.close()
+
+        with self._lock:
+            self._current = (index_path, self._current[1] + 1)
+            self._cache.clear()
+            self._stats["size"] = size
+
+        # старые версии индекса больше не нужны (открытые соединения дочитают их сами)
+        if index_path != self.path:
+            for stale in glob.glob(f"{glob.escape(self.path)}.*.sqlite"):
+                if stale != index_path:
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+
+    def _connection(self) -> sqlite3.Connection | None:
+        # у каждого потока своё read-only соединение; после reload — переподключение
+        index_path, generation = self._current
+        if index_path is None:
+            return None
+        local = self._local
+        if getattr(local, "generation", None) != generation:
+            if getattr(local, "db", None) is not None:
+                local.db.close()
+            local.db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True, check_same_thread=False)
+            local.generation = generation
+        return local.db
+
+    # ---------- поиск ----------
+
+    @staticmethod
+    def _row_to_profile(row, with_name: bool = False) -> dict:
+        # профиль для приоритета — те же поля, что в COMPANY_PRIORITY_TABLE; имя — только в поиске
+        name, base_priority, segment, risk_level = row
+        profile = {"name": name} if with_name else {}
+        if base_priority is not None:
+            profile["base_priority"] = base_priority
+        if segment is not None:
+            profile["segment"] = segment
+        if risk_level is not None:
+            profile["risk_level"] = risk_level
+        return profile
+
+    def get(self, name: str | None) -> dict | None:
+        """Профиль компании по точному (после нормализации) совпадению имени."""
+        if not name:
+            return None
+        key = normalize_company_name(name)
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return self._cache[key]
+
+        profile = None
+        db = self._connection()
+        if db is not None:
+            row = db.execute(
+                "SELECT name, base_priority, segment, risk_level FROM companies WHERE norm = ?",
+                (key,),
+            ).fetchone()
+            if row:
+                profile = self._row_to_profile(row)
+        if profile is None:
+            # seed-таблица действует и поверх файла: её записи нельзя потерять из-за неполной выгрузки
+            profile = self._seed.get(key)
+
+        with self._lock:
+            self._stats["hits" if profile else "misses"] += 1
+            self._cache[key] = profile
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return profile
+
+    def find_prefix(self, prefix: str, limit: int = 10) -> list[dict]:
+        """
+        Поиск (подсказки по имени): компании, нормализованное имя которых начинается
+        с prefix, по алфавиту, с полем "name". Для приоритета не используется —
+        обрезанное или незнакомое имя не должно получать чужой профиль.
+        """
+        key = normalize_company_name(prefix)
+        if not key:
+            return []
+
+        db = self._connection()
+        if db is None:
+            return [
+                dict(p, name=self._seed_names[k]) for k, p in sorted(self._seed.items()) if k.startswith(key)
+            ][:limit]
+
+        # диапазон [key, key + максимальный символ) по B-дереву первичного ключа
+        rows = db.execute(
+            "SELECT name, base_priority, segment, risk_level FROM companies "
+            "WHERE norm >= ? AND norm < ? ORDER BY norm LIMIT ?",
+            (key, key + "\U0010ffff", limit),
+        ).fetchall()
+        return [self._row_to_profile(row, with_name=True) for row in rows]
+
+    @property
+    def generation(self) -> int:
+        """Номер версии индекса: растёт при каждой перезагрузке (для кэшей поверх реестра)."""
+        return self._current[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["index"] = self._current[0]
+        stats["reloading"] = bool(self._reload_thread and self._reload_thread.is_alive())
+        return stats
@@ -0,0 +1,128 @@
+import re
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+
+class Entity(NamedTuple):
+    kind: str    # "dates" / "relative_deadlines" / "document_numbers" / "amounts" / "companies"
+    value: str   # нормализованное значение
+    start: int
+    end: int
+
+
+ENTITY_KINDS = (
+    "dates",
+    "relative_deadlines",
+    "document_numbers",
+    "amounts",
+    "companies",
+)
+
+# Прежние регулярки extract_info, по одной на тип. В группе value — значение сущности.
+# Дата начинается с цифры, а граница слова перед ней проверяется lookbehind'ом
+# (то же, что \b\d): с литералом или классом символов в начале re пропускает
+# текст до подходящего символа, а не пробует шаблон на каждой позиции.
+ENTITY_PATTERNS: dict[str, re.Pattern] = {
+    "dates": re.compile(r"(?P<value>\d(?<!\w\d)\d?\.\d{1,2}\.\d{4})\b"),
+    "relative_deadlines": re.compile(r"в течение\s+(?P<value>\d+)\s+дн"),
+    "document_numbers": re.compile(r"№\s*(?P<value>[\w\-\/]+)"),
+    "amounts": re.compile(r"(?P<value>\d[\d\s]{2,})\s*(?:(?i:руб)\.?|₽)"),
+    "companies": re.compile(r"(?P<form>ООО|АО|ПАО)\s+\"?«?(?P<value>[^»\"]+)\"?»?"),
+}
+
+# Типы, которые ищутся по text.lower(), как в прежнем extract_info: шаблон без (?i:...)
+# начинается с литерала, а регистронезависимый проверялся бы на каждой позиции.
+LOWERCASE_KINDS = frozenset({"relative_deadlines"})
+
+
+class EntityExtractor:
+    """
+    Извлечение дат, относительных сроков, номеров документов, сумм и компаний.
+    Каждый тип ищется своей скомпилированной регуляркой: весь проход по тексту
+    идёт внутри re, без цикла по позициям в Python. Типы друг другу не мешают —
+    сущность одного типа может лежать внутри спана другого, поэтому общая регулярка
+    на все типы (одно совпадение на позицию) дала бы другой результат.
+
+    extract — все вхождения каждого типа (без перекрытий внутри типа), со спанами;
+    first — только первое вхождение, поиск останавливается на нём (для extract_info).
+    lowered — text.lower(), если он уже есть у вызывающего (например, после KeywordMatcher):
+    иначе копия в нижнем регистре делается здесь.
+    """
+
+    def __init__(
+        self,
+        patterns: dict[str, re.Pattern] = ENTITY_PATTERNS,
+        lowercase_kinds: frozenset[str] = LOWERCASE_KINDS,
+    ):
+        self._patterns = [(kind, patterns[kind], kind in lowercase_kinds) for kind in ENTITY_KINDS]
+        # для текстов, у которых lower() меняет длину («İ»): спаны по lowered съехали бы
+        self._ignorecase = {
+            kind: re.compile(patterns[kind].pattern, patterns[kind].flags | re.IGNORECASE)
+            for kind in lowercase_kinds
+        }
+
+    def _searches(self, text: str, lowered: str | None) -> Iterator[tuple[str, re.Pattern, str]]:
+        """(тип, регулярка, текст, по которому её искать)."""
+        if lowered is None:
+            lowered = text.lower()
+        same_length = len(lowered) == len(text)
+        for kind, pattern, lowercase in self._patterns:
+            if not lowercase:
+                yield kind, pattern, text
+            elif same_length:
+                yield kind, pattern, lowered
+            else:
+                yield kind, self._ignorecase[kind], text
+
+    def extract(self, text: str, lowered: str | None = None) -> dict[str, list[Entity]]:
+        value = self._value
+        return {
+            kind: [Entity(kind, value(kind, m), m.start(), m.end()) for m in pattern.finditer(haystack)]
+            for kind, pattern, haystack in self._searches(text, lowered)
+        }
+
+    def first(self, text: str, lowered: str | None = None) -> dict[str, list[Entity]]:
+        """Как extract, но в каждом списке не больше одной (первой) сущности."""
+        entities: dict[str, list[Entity]] = {}
+        for kind, pattern, haystack in self._searches(text, lowered):
+            m = pattern.search(haystack)
+            entities[kind] = [Entity(kind, self._value(kind, m), m.start(), m.end())] if m else []
+        return entities
+
+    @staticmethod
+    def _value(kind: str, m: re.Match) -> str:
+        if kind == "amounts":
+            return m.group("value").strip().replace(" ", "")
+        if kind == "companies":
+            return f'{m.group("form")} "{m.group("value").strip()}"'
+        return m.group("value")
+
+
+def entities_to_info(entities: dict[str, list[Entity]], today: datetime | None = None) -> dict:
+    """
+    Прежний формат extract_info: по первому вхождению каждого типа.
+    today — дата отсчёта для deadline_date_estimated (чтобы в батче не звать now() на каждое письмо).
+    """
+    info: dict = {}
+
+    if entities["dates"]:
+        info["deadline_date"] = entities["dates"][0].value
+
+    if entities["relative_deadlines"]:
+        days = int(entities["relative_deadlines"][0].value)
+        if today is None:
+            today = datetime.now()
+        info["deadline_relative"] = f"{days} дней"
+        info["deadline_date_estimated"] = (today + timedelta(days=days)).strftime("%d.%m.%Y")
+
+    if entities["document_numbers"]:
+        info["document_number"] = entities["document_numbers"][0].value
+
+    if entities["amounts"]:
+        info["amount"] = entities["amounts"][0].value
+
+    if entities["companies"]:
+        info["sender_company"] = entities["companies"][0].value
+
+    return info
@@ -0,0 +1,256 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+from prompt_budget import CHARS_PER_TOKEN, estimate_tokens
+
+# Локальная замена Responses API (POST /v1/responses) для нагрузочных тестов без квоты.
+#
+#   python fake_llm_server.py --port 8900 --latency 1.5 --rate-429 0.02
+#   LLM_BASE_URL=http://127.0.0.1:8900/v1 folder_id=fake api_key=fake python ../api.py
+#
+# Время ответа — логнормальное с медианой --latency и разбросом --latency-sigma; в потоке
+# (stream=true) первый кусок приходит через --first-token, дальше --tokens-per-sec.
+# Ошибки 429 (с Retry-After) / 500 / 503 — с заданной долей, плюс 429 сверх --max-concurrency
+# одновременных запросов (как квота провайдера). Настройки меняются на лету:
+#   curl -X POST localhost:8900/_fake/config -d '{"rate_429": 0.2}'
+# Счётчики — GET /_fake/stats.
+
+app = Flask(__name__)
+
+config = {
+    "latency": 1.0,  # медиана времени ответа, с
+    "latency_sigma": 0.3,  # разброс логнормального распределения (0 — всегда latency)
+    "first_token": 0.3,  # задержка первого куска в потоке, с
+    "tokens_per_sec": 80.0,  # скорость выдачи токенов в потоке
+    "output_tokens": 200,  # средний размер ответа в токенах (±25%)
+    "rate_429": 0.0,  # доля ответов 429
+    "rate_500": 0.0,
+    "rate_503": 0.0,
+    "retry_after": 1.0,  # Retry-After у ответов 429, с
+    "max_concurrency": 0,  # больше одновременных запросов — 429 (0 — без ограничения)
+}
+
+_lock = threading.Lock()
+_in_flight = 0
+stats = {"requests": 0, "streams": 0, "ok": 0, "429": 0, "500": 0, "503": 0, "max_in_flight": 0}
+
+WORDS = (
+    "Благодарим за обращение. Ваше письмо рассмотрено, информация по договору будет "
+    "направлена в установленный срок. Сообщаем, что операции по счёту проведены "
+    "в соответствии с условиями обслуживания и действующими тарифами Банка. "
+    "По всем вопросам просим обращаться к вашему персональному менеджеру."
+).split()
+
+
+def _count(key: str) -> None:
+    with _lock:
+        stats[key] += 1
+
+
+def _sample_latency() -> float:
+    sigma = config["latency_sigma"]
+    if sigma <= 0:
+        return config["latency"]
+    return config["latency"] * math.exp(random.gauss(0, sigma))
+
+
+def _output_text(instructions: str) -> str:
+    size = max(1, round(config["output_tokens"] * random.uniform(0.75, 1.25)))
+    # токены считаются так же, как в лимитере (estimate_tokens): по длине текста
+    words, chars = [], 0
+    while chars < size * CHARS_PER_TOKEN:
+        words.append(WORDS[len(words) % len(WORDS)])
+        chars += len(words[-1]) + 1
+    text = " ".join(words)
+    if "JSON" in instructions:
+        # режим "combined": модель возвращает резюме и ответ одним JSON-объектом
+        return json.dumps({"summary": " ".join(words[:12]), "response": text}, ensure_ascii=False)
+    return text
+
+
+def _usage(instructions: str, prompt: str, text: str) -> dict:
+    input_tokens = estimate_tokens(instructions) + estimate_tokens(prompt)
+    output_tokens = estimate_tokens(text)
+    return {
+        "input_tokens": input_tokens,
+        "input_tokens_details": {"cached_tokens": 0},
+        "output_tokens": output_tokens,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": input_tokens + output_tokens,
+    }
+
+
+def _response_object(response_id: str, model: str, text: str, usage: dict | None, status: str) -> dict:
+    message = {
+        "id": f"msg_{response_id}",
+        "type": "message",
+        "role": "assistant",
+        "status": status,
+        "content": [{"type": "output_text", "text": text, "annotations": []}] if status == "completed" else [],
+    }
+    return {
+        "id": response_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": status,
+        "output": [message] if status == "completed" else [],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": usage,
+    }
+
+
+def _error(status: int, message: str, headers: dict | None = None):
+    body = {"error": {"message": message, "type": "fake_error", "code": str(status)}}
+    return jsonify(body), status, headers or {}
+
+
+def _injected_error():
+    """Ответ-ошибка по долям из config или None."""
+    roll = random.random()
+    for status in (429, 500, 503):
+        rate = config[f"rate_{status}"]
+        if roll < rate:
+            _count(str(status))
+            headers = {"Retry-After": str(config["retry_after"])} if status == 429 else None
+            return _error(status, f"Искусственная ошибка {status}", headers)
+        roll -= rate
+    return None
+
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _stream(response_id: str, model: str, instructions: str, prompt: str, text: str):
+    global _in_flight
+    try:
+        yield _sse("response.created", {
+            "type": "response.created",
+            "sequence_number": 0,
+            "response": _response_object(response_id, model, "", None, "in_progress"),
+        })
+        time.sleep(config["first_token"])
+        # куски по несколько слов — как у настоящей модели, которая отдаёт по токену-два
+        words = text.split(" ")
+        seq = 1
+        for i in range(0, len(words), 3):
+            delta = " ".join(words[i:i + 3]) + (" " if i + 3 < len(words) else "")
+            yield _sse("response.output_text.delta", {
+                "type": "response.output_text.delta",
+                "sequence_number": seq,
+                "item_id": f"msg_{response_id}",
+                "output_index": 0,
+                "content_index": 0,
+                "delta": delta,
+            })
+            seq += 1
+            time.sleep(estimate_tokens(delta) / config["tokens_per_sec"])
+        yield _sse("response.completed", {
+            "type": "response.completed",
+            "sequence_number": seq,
+            "response": _response_object(
+                response_id, model, text, _usage(instructions, prompt, text), "completed"
+            ),
+        })
+        _count("ok")
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+
+@app.route("/v1/responses", methods=["POST"])
+def responses():
+    global _in_flight
+    data = request.get_json(silent=True) or {}
+    instructions = data.get("instructions") or ""
+    prompt = data.get("input") or ""
+    if not isinstance(prompt, str):
+        prompt = json.dumps(prompt, ensure_ascii=False)
+    model = data.get("model", "fake")
+    stream = bool(data.get("stream"))
+
+    with _lock:
+        stats["requests"] += 1
+        stats["streams"] += stream
+        over_limit = 0 < config["max_concurrency"] <= _in_flight
+        if not over_limit:
+            _in_flight += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], _in_flight)
+    if over_limit:
+        _count("429")
+        return _error(429, "Превышен лимит одновременных запросов", {"Retry-After": str(config["retry_after"])})
+
+    error = _injected_error()
+    if error is not None:
+        with _lock:
+            _in_flight -= 1
+        return error
+
+    response_id = f"resp_{uuid.uuid4().hex}"
+    text = _output_text(instructions)
+    if stream:
+        # слот освобождает генератор, когда поток закончится или оборвётся
+        return Response(
+            _stream(response_id, model, instructions, prompt, text),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    try:
+        time.sleep(_sample_latency())
+        _count("ok")
+        return jsonify(_response_object(
+            response_id, model, text, _usage(instructions, prompt, text), "completed"
+        ))
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+
+@app.route("/_fake/config", methods=["GET", "POST"])
+def fake_config():
+    if request.method == "POST":
+        updates = request.get_json(silent=True) or {}
+        unknown = [k for k in updates if k not in config]
+        if unknown:
+            return jsonify({"error": f"Неизвестные параметры: {', '.join(unknown)}"}), 400
+        for key, value in updates.items():
+            config[key] = type(config[key])(value)
+    return jsonify(config)
+
+
+@app.route("/_fake/stats", methods=["GET", "DELETE"])
+def fake_stats():
+    with _lock:
+        if request.method == "DELETE":
+            for key in stats:
+                stats[key] = 0
+        return jsonify({**stats, "in_flight": _in_flight})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный фейковый Responses API для нагрузочных тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    for key, value in config.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    for key in config:
+        config[key] = getattr(args, key)
+
+    print(f"Фейковая модель: http://{args.host}:{args.port}/v1  {json.dumps(config)}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+from collections import OrderedDict, deque
+from collections.abc import Callable
+
+MAX_PRIORITY = 9
+
+
+class Job:
+    __slots__ = (
+        "id", "priority", "payload", "callback_url", "status",
+        "created", "started", "finished", "result", "error",
+    )
+
+    def __init__(self, priority: int, payload, callback_url: str | None = None):
+        self.id = uuid.uuid4().hex
+        self.priority = max(0, min(MAX_PRIORITY, int(priority)))
+        self.payload = payload
+        self.callback_url = callback_url
+        self.status = "queued"  # queued → running → done / failed
+        self.created = time.monotonic()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.result = None
+        self.error: str | None = None
+
+    def snapshot(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+        }
+        now = time.monotonic()
+        if self.started is not None:
+            data["queue_seconds"] = round(self.started - self.created, 3)
+        else:
+            data["queue_seconds"] = round(now - self.created, 3)
+        if self.finished is not None:
+            data["run_seconds"] = round(self.finished - self.started, 3)
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JobStore:
+    """
+    Состояние задач в SQLite-файле, общем для процессов одного сервера.
+
+    Под gunicorn с несколькими воркерами задачу выполняет процесс, который её принял,
+    а опрос GET /jobs/<id> приходит в любой: без общего хранилища он почти всегда
+    отвечал бы 404. Очередь пишет сюда снимок при каждой смене статуса, остальные
+    процессы читают его по id. Сама очередь (порядок, приоритеты) остаётся в процессе.
+
+    Времена — time.monotonic(): на Linux это общие часы для всех процессов машины.
+    Соединение открывается в каждом процессе при первом обращении (после fork).
+    """
+
+    def __init__(self, path: str, max_items: int = 10_000, ttl: float = 3600.0):
+        self.path = path
+        self.max_items = max_items
+        self.ttl = ttl
+        self._db: sqlite3.Connection | None = None
+        self._db_pid: int | None = None
+        # унаследованные через fork соединения не закрываем (см. LLMCache._connection)
+        self._inherited: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._writes_since_trim = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """SQLite-соединение текущего процесса; вызывается под _lock."""
+        pid = os.getpid()
+        if self._db is not None and self._db_pid == pid:
+            return self._db
+        if self._db is not None:
+            self._inherited.append(self._db)
+        db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " priority INTEGER NOT NULL,"
+            " status TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " started REAL,"
+            " finished REAL,"
+            " error TEXT,"
+            " result TEXT)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs(finished)")
+        db.commit()
+        self._db, self._db_pid = db, pid
+        return db
+
+    def save(self, job: Job) -> None:
+        result = json.dumps(job.result, ensure_ascii=False) if job.status == "done" else None
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO jobs"
+                " (id, priority, status, created, started, finished, error, result)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.priority, job.status, job.created,
+                 job.started, job.finished, job.error, result),
+            )
+            if job.finished is not None:
+                self._writes_since_trim += 1
+                # как у дискового кэша: чистим пачками, а не на каждой записи
+                if self._writes_since_trim >= 100:
+                    self._trim(db, job.finished)
+            db.commit()
+
+    def load(self, job_id: str) -> Job | None:
+        """Снимок задачи (без payload) или None."""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT priority, status, created, started, finished, error, result"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        priority, status, created, started, finished, error, result = row
+        job = Job(priority, None)
+        job.id = job_id
+        job.status = status
+        job.created, job.started, job.finished = created, started, finished
+        job.error = error
+        job.result = json.loads(result) if result is not None else None
+        return job
+
+    def _trim(self, db: sqlite3.Connection, now: float) -> None:
+        self._writes_since_trim = 0
+        db.execute("DELETE FROM jobs WHERE finished < ?", (now - self.ttl,))
+        (count,) = db.execute("SELECT COUNT(*) FROM jobs WHERE finished IS NOT NULL").fetchone()
+        extra = count - self.max_items
+        if extra > 0:
+            db.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs"
+                " WHERE finished IS NOT NULL ORDER BY finished LIMIT ?)",
+                (extra,),
+            )
+
+
+class PriorityJobQueue:
+    """
+    Очередь задач с приоритетом 0–9 и пулом воркеров.
+
+    Для каждого приоритета своя FIFO-очередь. Воркер берёт задачу с максимальным
+    эффективным приоритетом: priority + (время ожидания / aging_seconds), поэтому
+    срочные письма обгоняют массовые, но массовые не голодают бесконечно.
+    Готовые задачи хранятся до max_finished штук / finished_ttl секунд.
+
+    store — общее для процессов хранилище снимков (JobStore): get находит и задачи,
+    принятые другим процессом. Без него задачи видны только в своём процессе.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Job], object],
+        workers: int = 8,
+        aging_seconds: float = 30.0,
+        max_finished: int = 10_000,
+        finished_ttl: float = 3600.0,
+        on_wait: Callable[[Job, float], None] | None = None,
+        store: JobStore | None = None,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.aging_seconds = aging_seconds
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        self.on_wait = on_wait
+        self.store = store
+
+        self._buckets = [deque() for _ in range(MAX_PRIORITY + 1)]
+        self._jobs: dict[str, Job] = {}
+        self._finished: OrderedDict[str, float] = OrderedDict()
+        self._cond = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._queued = 0
+        self._running = 0
+        self._closed = False
+
+    def _ensure_workers(self) -> None:
+        # потоки стартуют при первой задаче, а не при импорте
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, priority: int, payload, callback_url: str | None = None) -> Job:
+        job = Job(priority, payload, callback_url)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Очередь закрыта: сервис останавливается")
+            self._ensure_workers()
+            # до постановки в очередь: иначе воркер мог бы записать «running» раньше «queued»
+            self._save(job)
+            self._jobs[job.id] = job
+            self._buckets[job.priority].append(job)
+            self._queued += 1
+            self._cond.notify()
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.load(job_id)
+        return job
+
+    def _save(self, job: Job) -> None:
+        if self.store is None:
+            return
+        try:
+            self.store.save(job)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            # задача всё равно выполнится и будет видна в своём процессе
+            print(f"Не удалось сохранить задачу {job.id}: {e}")
+
+    def depth(self) -> int:
+        """Сколько задач ждёт воркера (без выполняющихся)."""
+        return self._queued
+
+    def running(self) -> int:
+        return self._running
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """
+        Перестаёт принимать задачи и ждёт, пока воркеры доделают очередь и текущие задачи
+        (остановка сервиса без потери принятых писем). False — не успели за timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            while self._queued or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _pop_next(self) -> Job | None:
+        # вызывается под self._cond
+        now = time.monotonic()
+        best_bucket = None
+        best_score = None
+        for bucket in self._buckets:
+            if not bucket:
+                continue
+            head = bucket[0]  # в своей очереди голова ждёт дольше всех
+            score = head.priority
+            if self.aging_seconds > 0:
+                score += (now - head.created) / self.aging_seconds
+            if best_score is None or score > best_score:
+                best_bucket, best_score = bucket, score
+        if best_bucket is None:
+            return None
+        self._queued -= 1
+        return best_bucket.popleft()
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                job = self._pop_next()
+                while job is None:
+                    self._cond.wait()
+                    job = self._pop_next()
+                job.status = "running"
+                job.started = time.monotonic()
+                self._running += 1
+
+            self._save(job)
+            if self.on_wait is not None:
+                self.on_wait(job, job.started - job.created)
+
+            try:
+                job.result = self.handler(job)
+                job.status = "done"
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            job.finished = time.monotonic()
+            self._save(job)
+
+            with self._cond:
+                self._running -= 1
+                self._finished[job.id] = job.finished
+                self._evict_finished(job.finished)
+                # будит drain (и заодно воркеры — они перепроверят очередь)
+                self._cond.notify_all()
+
+            if job.callback_url:
+                self._send_callback(job)
+
+    def _evict_finished(self, now: float) -> None:
+        while self._finished:
+            job_id, finished = next(iter(self._finished.items()))
+            if len(self._finished) <= self.max_finished and now - finished <= self.finished_ttl:
+                break
+            self._finished.popitem(last=False)
+            self._jobs.pop(job_id, None)
+
+    @staticmethod
+    def _send_callback(job: Job) -> None:
+        body = job.snapshot()
+        if job.status == "done":
+            body["result"] = job.result
+        req = urllib.request.Request(
+            job.callback_url,
+            data=json.dumps(body, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            urllib.request.urlopen(req, timeout=5).close()
+        except Exception as e:
+            print(f"Не удалось отправить callback задачи {job.id}: {e}")
@@ -0,0 +1,261 @@
+import itertools
+import re
+from collections.abc import Callable
+
+_TERMINAL = ""  # ключ в узле дерева: список (keyword, group, label, rank)
+
+# До стольких слов автомат ищет их str.find (C-поиск подстроки быстрее регулярки,
+# которая проверяет каждую позицию), дальше — регуляркой по дереву: её цена не растёт
+# с числом слов.
+LITERAL_SEARCH_MAX_WORDS = 16
+
+# Если сужений (сочетаний пределов rank по группам) не больше стольких, compile строит
+# их все заранее, и в запросе автомат не компилируется; иначе — при первой надобности.
+PRECOMPILE_MAX_AUTOMATA = 64
+
+
+class _Automaton:
+    """
+    Поиск набора слов (регулярка по префиксному дереву или, для немногих слов, str.find)
+    и таблица совпадений для него.
+
+    Поиск на каждой позиции берёт самое длинное слово. Для каждого слова заранее
+    известно, какие ещё слова лежат внутри него («требуем немедленного» содержит
+    «немедленно») и с какого сдвига внутри него может начаться слово, выходящее за
+    его конец, — поиск продолжается с этого сдвига, а не со следующего символа.
+    """
+
+    def __init__(self, terminals: list[tuple[str, str, str, int]], matches: dict | None = None):
+        self.trie: dict = {}
+        for keyword, group, label, rank in terminals:
+            node = self.trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node.setdefault(_TERMINAL, []).append((keyword, group, label, rank))
+
+        words = {t[0] for t in terminals}
+        # совпавшее слово -> (лучшие (group, rank, label) среди слов внутри него, сдвиг).
+        # Суженный автомат берёт таблицу полного: в ней лишние группы и rank (их отсекает
+        # сравнение с найденным), а сдвиг не больше нужного — продолжать с него безопасно.
+        if matches is None:
+            matches = {
+                keyword: (self._contained(keyword), self._skip(keyword))
+                for keyword in words
+            }
+        self.matches = matches
+        # длинные первыми: на одной позиции побеждает самое длинное слово, как в регулярке
+        self._words = sorted(words, key=len, reverse=True)
+        self._pattern = None
+        if len(self._words) > LITERAL_SEARCH_MAX_WORDS:
+            self._pattern = re.compile(self._node_regex(self.trie))
+
+    def finder(self, text: str, positions: dict[str, int]) -> Callable[[int], tuple[int, str] | None]:
+        """
+        find(pos) -> (позиция, слово) первого вхождения не раньше pos (самого длинного
+        слова на этой позиции) или None. pos между вызовами не убывает.
+
+        positions — найденные вхождения слов в text, общие для автоматов одного прохода:
+        суженный автомат не ищет заново то, что уже нашёл широкий.
+        """
+        if self._pattern is not None:
+            search = self._pattern.search
+
+            def find(pos: int) -> tuple[int, str] | None:
+                m = search(text, pos)
+                return None if m is None else (m.start(), m.group())
+
+            return find
+
+        words = self._words
+        end = len(text) + 1
+
+        def find(pos: int) -> tuple[int, str] | None:
+            best_at, best_word = end, None
+            for word in words:
+                # следующее известное вхождение: заново ищем, только когда pos его обогнал
+                at = positions.get(word, -1)
+                if at < pos:
+                    at = text.find(word, pos)
+                    positions[word] = at = end if at < 0 else at
+                if at < best_at:
+                    best_at, best_word = at, word
+            return None if best_word is None else (best_at, best_word)
+
+        return find
+
+    def _contained(self, keyword: str) -> tuple[tuple[str, int, str], ...]:
+        """Лучший (group, rank, label) в каждой группе среди слов внутри keyword (включая его само)."""
+        best: dict[str, tuple[int, str]] = {}
+        for start in range(len(keyword)):
+            node = self.trie
+            for ch in keyword[start:]:
+                node = node.get(ch)
+                if node is None:
+                    break
+                for _, group, label, rank in node.get(_TERMINAL, ()):
+                    if group not in best or rank < best[group][0]:
+                        best[group] = (rank, label)
+        return tuple((group, rank, label) for group, (rank, label) in best.items())
+
+    def _skip(self, keyword: str) -> int:
+        """
+        Наименьший сдвиг внутри keyword, с которого может начаться слово, выходящее за его
+        конец (остаток keyword — путь в дереве); иначе len(keyword). Слова, целиком лежащие
+        внутри keyword, уже учтены в _contained.
+        """
+        for start in range(1, len(keyword)):
+            node = self.trie
+            for ch in keyword[start:]:
+                node = node.get(ch)
+                if node is None:
+                    break
+            else:
+                if any(ch != _TERMINAL for ch in node):
+                    return start
+        return len(keyword)
+
+    def _node_regex(self, node: dict) -> str:
+        branches = []
+        single_chars = []
+        for ch, child in sorted((k, v) for k, v in node.items() if k != _TERMINAL):
+            if len(child) == 1 and _TERMINAL in child:
+                single_chars.append(re.escape(ch))
+            else:
+                branches.append(re.escape(ch) + self._node_regex(child))
+
+        if single_chars:
+            if len(single_chars) == 1:
+                branches.append(single_chars[0])
+            else:
+                branches.append(f"[{''.join(single_chars)}]")
+
+        if not branches:
+            return ""
+
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if _TERMINAL in node:
+            # слово может закончиться здесь; жадный ? сначала пробует более длинное
+            return f"(?:{body})?"
+        return body
+
+
+class KeywordMatcher:
+    """
+    Все таблицы ключевых слов, собранные в один автомат (_Automaton):
+    labels просматривает текст за один проход независимо от числа слов,
+    а цикл в Python идёт только по совпадениям, а не по символам.
+
+    Когда у группы уже найден label с rank r, слова этой группы с rank ≥ r ответ
+    не изменят: проход продолжается автоматом только по словам, которые ещё могут
+    его улучшить (частые слабые маркеры вроде «до » больше не останавливают цикл),
+    и заканчивается, когда у всех нужных групп найден rank 0.
+    Суженные автоматы кэшируются; при небольших таблицах compile строит их все заранее.
+    """
+
+    def __init__(self):
+        self._terminals: list[tuple[str, str, str, int]] = []
+        self._groups: frozenset[str] = frozenset()
+        # ((group, предел rank или None), ...) -> автомат по словам с rank < предела
+        self._automata: dict[tuple, _Automaton] = {}
+        self._matches: dict | None = None
+
+    def add_table(self, group: str, table: list[tuple[str, list[str]]]) -> None:
+        """
+        table — упорядоченный список (label, [keywords]); порядок задаёт
+        приоритет «первое совпадение побеждает», как в цепочке if-ов.
+        """
+        for rank, (label, keywords) in enumerate(table):
+            for keyword in keywords:
+                self.add(keyword, group, label, rank)
+
+    def add(self, keyword: str, group: str, label: str, rank: int = 0) -> None:
+        keyword = keyword.lower()
+        if not keyword:
+            return
+        self._terminals.append((keyword, group, label, rank))
+        self._automata = {}
+        self._matches = None
+
+    def compile(self) -> "KeywordMatcher":
+        """
+        Строит полный автомат и автоматы для отдельных групп заранее (иначе — при
+        первом labels), а если сужений не больше PRECOMPILE_MAX_AUTOMATA — и их все.
+        """
+        self._groups = frozenset(group for _, group, _, _ in self._terminals)
+        self._automata = {}
+        self._matches = None
+        everything = tuple(sorted((g, None) for g in self._groups))
+        self._matches = self._automaton(everything).matches
+
+        group_sets = [sorted(self._groups)]
+        if len(self._groups) > 1:
+            group_sets += [[g] for g in sorted(self._groups)]
+        states = [self._narrowings(groups) for groups in group_sets]
+        if sum(map(len, states)) > PRECOMPILE_MAX_AUTOMATA:
+            states = [[tuple((g, None) for g in groups)] for groups in group_sets]
+        for limits in itertools.chain.from_iterable(states):
+            self._automaton(limits)
+        return self
+
+    def _narrowings(self, groups: list[str]) -> list[tuple[tuple[str, int | None], ...]]:
+        """Все пределы, до которых labels может сузить проход по groups."""
+        options = []
+        for group in groups:
+            ranks = sorted({t[3] for t in self._terminals if t[1] == group and t[3] > 0})
+            # None — ничего не найдено; rank — предел; () — найден rank 0, группа выбывает
+            options.append([((group, None),), *(((group, r),) for r in ranks), ()])
+        return [
+            sum(choice, ())
+            for choice in itertools.product(*options)
+            if any(choice)
+        ]
+
+    def _automaton(self, limits: tuple[tuple[str, int | None], ...]) -> _Automaton:
+        automaton = self._automata.get(limits)
+        if automaton is None:
+            allowed = dict(limits)
+            automaton = self._automata[limits] = _Automaton([
+                t for t in self._terminals
+                if t[1] in allowed and (allowed[t[1]] is None or t[3] < allowed[t[1]])
+            ], self._matches)
+        return automaton
+
+    def labels(self, lowered: str, groups: tuple[str, ...] | None = None) -> dict[str, str]:
+        """
+        group -> label с наименьшим rank среди слов группы, найденных в уже приведённом
+        к нижнему регистру тексте (группы без попаданий в ответ не входят).
+        groups — какие группы нужны (по умолчанию все).
+        """
+        if not self._automata:
+            self.compile()
+        wanted = sorted(self._groups if groups is None else groups)
+
+        best: dict[str, tuple[int, str]] = {}
+        automaton = self._automaton(tuple((g, None) for g in wanted))
+        positions: dict[str, int] = {}
+        find = automaton.finder(lowered, positions)
+        found = find(0)
+        while found is not None:
+            start, keyword = found
+            contained, skip = automaton.matches[keyword]
+            pos = start + skip
+            improved = False
+            for group, rank, label in contained:
+                if group not in wanted:
+                    continue
+                current = best.get(group)
+                if current is None or rank < current[0]:
+                    best[group] = (rank, label)
+                    improved = True
+            if improved:
+                limits = tuple(
+                    (g, best[g][0] if g in best else None)
+                    for g in wanted
+                    if g not in best or best[g][0] > 0
+                )
+                if not limits:
+                    break
+                automaton = self._automaton(limits)
+                find = automaton.finder(lowered, positions)
+            found = find(pos)
+        return {g: label for g, (_, label) in best.items()}
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LLMCache:
+    """
+    Кэш ответов модели в два уровня:
+    - LRU в памяти процесса (max_items записей);
+    - опционально SQLite-файл (path), который переживает перезапуск сервера.
+      Соединение открывается при первом обращении в каждом процессе: под gunicorn
+      с preload_app объект создаётся в мастере, а SQLite-соединение нельзя делить
+      между процессами после fork.
+
+    Записи старше ttl секунд считаются устаревшими на обоих уровнях.
+    Потокобезопасен: им пользуются потоки llm_executor и воркеры Flask.
+    """
+
+    def __init__(
+        self,
+        max_items: int = 1024,
+        ttl: float | None = 24 * 3600,
+        path: str | None = None,
+        max_disk_items: int = 100_000,
+    ):
+        self.max_items = max_items
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self.path = path
+        self.max_disk_items = max_disk_items
+
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+        self._db: sqlite3.Connection | None = None
+        self._db_pid: int | None = None
+        # соединения, унаследованные через fork: держим ссылки, чтобы сборщик мусора
+        # не закрыл их в дочернем процессе (закрытие сняло бы блокировки файла у родителя)
+        self._inherited: list[sqlite3.Connection] = []
+        self._db_lock = threading.Lock()
+        self._writes_since_trim = 0
+
+    def open(self) -> None:
+        """Открыть дисковый уровень заранее (warm_up), чтобы первый запрос не платил за это."""
+        if self.path:
+            with self._db_lock:
+                self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        """SQLite-соединение текущего процесса; вызывается под _db_lock."""
+        pid = os.getpid()
+        if self._db is not None and self._db_pid == pid:
+            return self._db
+        if self._db is not None:
+            self._inherited.append(self._db)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed)"
+        )
+        db.commit()
+        self._db, self._db_pid = db, pid
+        self._writes_since_trim = 0
+        return db
+
+    @staticmethod
+    def make_key(kind: str, model: str, text: str, **params) -> str:
+        """
+        Ключ кэша: тип промпта (summary/response/...), id модели,
+        нормализованный текст письма и параметры вроде тона и длины ответа.
+        """
+        raw = json.dumps(
+            [kind, model, text, sorted(params.items())],
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                created, value = item
+                if not self._is_expired(created, now):
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+        if self.path:
+            with self._db_lock:
+                db = self._connection()
+                row = db.execute(
+                    "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created = row
+                    if self._is_expired(created, now):
+                        db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                        db.commit()
+                        row = None
+                        with self._lock:
+                            self._stats["expired"] += 1
+                    else:
+                        db.execute(
+                            "UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key)
+                        )
+                        db.commit()
+            if row is not None:
+                # поднимаем запись в память, чтобы следующие попадания не ходили на диск
+                self._put_memory(key, created, value)
+                with self._lock:
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                return value
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        self._put_memory(key, now, value)
+        with self._lock:
+            self._stats["sets"] += 1
+
+        if self.path:
+            with self._db_lock:
+                db = self._connection()
+                db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created, accessed) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._writes_since_trim += 1
+                # COUNT(*) по всей таблице недёшев, поэтому чистим диск пачками
+                if self._writes_since_trim >= 100:
+                    self._trim_disk(db, now)
+                db.commit()
+
+    def _put_memory(self, key: str, created: float, value: str) -> None:
+        with self._lock:
+            self._memory[key] = (created, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _trim_disk(self, db: sqlite3.Connection, now: float) -> None:
+        self._writes_since_trim = 0
+        if self.ttl is not None:
+            db.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,))
+        (count,) = db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        extra = count - self.max_disk_items
+        if extra > 0:
+            db.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY accessed LIMIT ?)",
+                (extra,),
+            )
+            with self._lock:
+                self._stats["evictions"] += extra
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            with self._db_lock:
+                db = self._connection()
+                db.execute("DELETE FROM llm_cache")
+                db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["disk"] = self.path
+        return stats
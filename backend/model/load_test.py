@@ -0,0 +1,240 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_pipeline import SIZES, generate_corpus
+
+# Нагрузочный тест сервиса целиком: бэкенд (/process, /process/stream) или фронтенд
+# (/api/generate, /api/generate/stream) под заданным RPS или числом параллельных клиентов.
+# Без квоты — вместе с fake_llm_server.py (бэкенд запущен с LLM_BASE_URL на него).
+#
+#   python load_test.py --target backend --rps 20 --duration 60
+#   python load_test.py --target frontend-stream --concurrency 50 --duration 30 -o run.json
+#
+# --rps — открытая модель: запросы уходят по расписанию, независимо от ответов, и время
+# считается от запланированного момента отправки (медленный сервис не «прячет» очередь).
+# --concurrency — закрытая: N клиентов, каждый шлёт следующий запрос после ответа.
+# Отчёт: пропускная способность, p50/p95/p99 времени ответа (и первого куска для потоков),
+# разбивка исходов по кодам ответа и типам ошибок.
+
+TARGETS = {
+    "backend": ("http://127.0.0.1:5001", "/process", False),
+    "backend-stream": ("http://127.0.0.1:5001", "/process/stream", True),
+    "frontend": ("http://127.0.0.1:5000", "/api/generate", False),
+    "frontend-stream": ("http://127.0.0.1:5000", "/api/generate/stream", True),
+}
+
+_sessions = threading.local()
+
+
+def session() -> requests.Session:
+    # своя сессия на поток: keep-alive соединения, как у фронтенда к бэкенду
+    if not hasattr(_sessions, "value"):
+        _sessions.value = requests.Session()
+    return _sessions.value
+
+
+def load_letters(args) -> list[str]:
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            letters = [json.loads(line)["text"] for line in f if line.strip()]
+        if not letters:
+            raise SystemExit(f"В {args.input} нет писем")
+        return letters
+    return generate_corpus(SIZES[args.size], args.letters)
+
+
+def request_body(target: str, text: str, args) -> dict:
+    if target.startswith("frontend"):
+        return {
+            "incomingText": text,
+            "emailStyle": args.style,
+            "emailLength": args.length,
+            "regenerate": not args.cache,
+        }
+    return {"text": text, "tone": args.tone, "length": args.length, "no_cache": not args.cache}
+
+
+def send(url: str, body: dict, stream: bool, timeout: float, scheduled: float) -> dict:
+    """Один запрос; время — от scheduled (time.monotonic()), исход — код ответа или тип ошибки."""
+    result = {"scheduled": scheduled, "ttfb": None}
+    try:
+        resp = session().post(url, json=body, timeout=timeout, stream=stream)
+        if not stream:
+            payload = resp.json() if resp.headers.get("Content-Type", "").startswith("application/json") else {}
+            # 200, но часть пайплайна не удалась (например, резюме) — отдельный исход
+            result["outcome"] = "partial" if resp.status_code == 200 and payload.get("errors") else str(resp.status_code)
+        else:
+            outcome = str(resp.status_code)
+            event = None
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                    if event == "delta" and result["ttfb"] is None:
+                        result["ttfb"] = time.monotonic() - scheduled
+                    elif event == "error":
+                        outcome = "stream_error"
+                elif line.startswith("data: ") and event == "done" and outcome == "200":
+                    if json.loads(line[len("data: "):]).get("errors"):
+                        outcome = "partial"
+            resp.close()
+            result["outcome"] = outcome
+    except requests.Timeout:
+        result["outcome"] = "client_timeout"
+    except requests.RequestException as e:
+        result["outcome"] = type(e).__name__
+    result["latency"] = time.monotonic() - scheduled
+    return result
+
+
+def run_open(url, bodies, stream, args, results: list) -> None:
+    """Открытая модель: запросы по расписанию с интенсивностью args.rps."""
+    pool = ThreadPoolExecutor(max_workers=args.max_in_flight, thread_name_prefix="load")
+    rng = random.Random(0)
+    start = time.monotonic()
+    end = start + args.duration
+    next_at = start
+    i = 0
+    futures = []
+    while next_at < end:
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(pool.submit(send, url, bodies[i % len(bodies)], stream, args.timeout, next_at))
+        i += 1
+        # пуассоновский поток — как независимые пользователи; uniform — ровный шаг
+        gap = rng.expovariate(args.rps) if args.arrivals == "poisson" else 1 / args.rps
+        next_at += gap
+    pool.shutdown(wait=True)
+    results.extend(f.result() for f in futures)
+
+
+def run_closed(url, bodies, stream, args, results: list) -> None:
+    """Закрытая модель: args.concurrency клиентов шлют запросы один за другим."""
+    end = time.monotonic() + args.duration
+    counter = iter(range(sys.maxsize))
+    lock = threading.Lock()
+
+    def client():
+        while time.monotonic() < end:
+            with lock:
+                i = next(counter)
+            result = send(url, bodies[i % len(bodies)], stream, args.timeout, time.monotonic())
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(results: list[dict], started: float, warmup: float) -> dict:
+    # запросы, запланированные в прогреве, в статистику не входят
+    measured = [r for r in results if r["scheduled"] >= started + warmup]
+    ok = [r for r in measured if r["outcome"] in ("200", "partial")]
+    finished = max((r["scheduled"] + r["latency"] for r in measured), default=started)
+    elapsed = max(1e-9, finished - (started + warmup))
+
+    def stats(values: list[float]) -> dict:
+        return {
+            "p50_ms": _ms(percentile(values, 0.50)),
+            "p95_ms": _ms(percentile(values, 0.95)),
+            "p99_ms": _ms(percentile(values, 0.99)),
+            "max_ms": _ms(max(values, default=None)),
+        }
+
+    report = {
+        "requests": len(measured),
+        "ok": len(ok),
+        "throughput_rps": round(len(ok) / elapsed, 2),
+        "error_rate": round(1 - len(ok) / len(measured), 4) if measured else None,
+        "outcomes": dict(Counter(r["outcome"] for r in measured).most_common()),
+        "latency": stats([r["latency"] for r in ok]),
+    }
+    ttfb = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    if ttfb:
+        report["ttfb"] = stats(ttfb)
+    return report
+
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def print_report(report: dict) -> None:
+    print(f"\nзапросов {report['requests']}, успешных {report['ok']}, "
+          f"{report['throughput_rps']} ответов/с, ошибок {report['error_rate']:.1%}"
+          if report["requests"] else "\nзапросов нет")
+    for name in ("latency", "ttfb"):
+        if name in report:
+            s = report[name]
+            label = "время ответа" if name == "latency" else "первый кусок"
+            print(f"{label:<14} p50 {s['p50_ms']} мс | p95 {s['p95_ms']} мс | p99 {s['p99_ms']} мс | max {s['max_ms']} мс")
+    print("исходы:", ", ".join(f"{k}: {v}" for k, v in report["outcomes"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бэкенда или фронтенда")
+    parser.add_argument("--target", choices=list(TARGETS), default="backend")
+    parser.add_argument("--url", default=None, help="базовый адрес сервиса (по умолчанию — для --target)")
+    load = parser.add_mutually_exclusive_group(required=True)
+    load.add_argument("--rps", type=float, help="запросов в секунду (открытая модель)")
+    load.add_argument("--concurrency", type=int, help="параллельных клиентов (закрытая модель)")
+    parser.add_argument("--arrivals", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=512,
+                        help="потолок одновременных запросов при --rps")
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность, с")
+    parser.add_argument("--warmup", type=float, default=5.0, help="первые секунды не входят в отчёт")
+    parser.add_argument("--timeout", type=float, default=30.0, help="таймаут запроса на клиенте, с")
+    parser.add_argument("--input", default=None, help="JSONL с письмами ({\"text\": ...} в строке)")
+    parser.add_argument("--size", choices=list(SIZES), default="letter", help="размер синтетических писем")
+    parser.add_argument("--letters", type=int, default=200, help="сколько синтетических писем")
+    parser.add_argument("--tone", default="Клиентоориентированный", help="тон для бэкенда")
+    parser.add_argument("--style", default="business", help="emailStyle для фронтенда")
+    parser.add_argument("--length", default="medium")
+    parser.add_argument("--cache", action="store_true", help="разрешить ответы из кэша (по умолчанию — всегда модель)")
+    parser.add_argument("-o", "--output", default=None, help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+    if args.warmup >= args.duration:
+        parser.error("--warmup должен быть меньше --duration")
+
+    base, path, stream = TARGETS[args.target]
+    url = (args.url or base).rstrip("/") + path
+    bodies = [request_body(args.target, text, args) for text in load_letters(args)]
+
+    mode = f"{args.rps} RPS" if args.rps else f"{args.concurrency} клиентов"
+    print(f"{url}: {mode}, {args.duration:.0f} с (прогрев {args.warmup:.0f} с), писем {len(bodies)}")
+    results: list[dict] = []
+    started = time.monotonic()
+    if args.rps:
+        run_open(url, bodies, stream, args, results)
+    else:
+        run_closed(url, bodies, stream, args, results)
+
+    report = summarize(results, started, args.warmup)
+    print_report(report)
+    if args.output:
+        report["meta"] = {k: v for k, v in vars(args).items() if k != "output"} | {"url": url}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
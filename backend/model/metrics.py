@@ -0,0 +1,145 @@
+import threading
+from bisect import bisect_left
+from collections.abc import Callable
+from contextlib import contextmanager
+from time import perf_counter
+
+# границы бакетов гистограмм в секундах: от правил (микросекунды) до LLM (десятки секунд)
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # последний элемент — бакет +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> tuple[list[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class MetricsRegistry:
+    """
+    Счётчики и гистограммы в памяти процесса + вывод в текстовом формате Prometheus.
+    Запись — это bisect и пара сложений под локом; вся работа по форматированию
+    происходит только при запросе /metrics.
+    """
+
+    def __init__(self):
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+        self._help: dict[str, str] = {}
+        self._collectors: list[Callable[[], list[tuple[str, str, dict, float]]]] = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, Histogram())
+        hist.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def register_collector(self, collector: Callable[[], list[tuple[str, str, dict, float]]]) -> None:
+        """collector() -> [(имя, тип gauge/counter, метки, значение)] — вызывается при каждом /metrics."""
+        self._collectors.append(collector)
+
+    @staticmethod
+    def _format_labels(labels) -> str:
+        if not labels:
+            return ""
+        parts = []
+        for k, v in labels:
+            v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            parts.append(f'{k}="{v}"')
+        return "{" + ",".join(parts) + "}"
+
+    def _header(self, lines: list[str], seen: set, name: str, kind: str) -> None:
+        if name in seen:
+            return
+        seen.add(name)
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def render_prometheus(self) -> str:
+        lines: list[str] = []
+        seen: set = set()
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda kv: kv[0])
+
+        for (name, labels), value in counters:
+            self._header(lines, seen, name, "counter")
+            lines.append(f"{name}{self._format_labels(labels)} {value:g}")
+
+        for (name, labels), hist in histograms:
+            self._header(lines, seen, name, "histogram")
+            counts, total, count = hist.snapshot()
+            cumulative = 0
+            for bound, c in zip(hist.buckets, counts):
+                cumulative += c
+                le = labels + (("le", f"{bound:g}"),)
+                lines.append(f"{name}_bucket{self._format_labels(le)} {cumulative}")
+            le = labels + (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{self._format_labels(le)} {count}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+
+        for collector in self._collectors:
+            for name, kind, labels, value in collector():
+                self._header(lines, seen, name, kind)
+                lines.append(f"{name}{self._format_labels(sorted(labels.items()))} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+metrics.describe("letter_stage_seconds", "Время этапов обработки письма")
+metrics.describe("letters_total", "Обработанные письма по категориям")
+metrics.describe("letters_urgency_total", "Обработанные письма по срочности")
+metrics.describe("llm_requests_total", "Вызовы модели по типу промпта и исходу")
+metrics.describe("llm_tokens_total", "Токены модели по типу промпта (input/output; cached — входные из кэша префиксов провайдера)")
+metrics.describe("llm_combined_fallback_total", "Откаты режима combined на два вызова из-за невалидного JSON")
+metrics.describe("prompt_letters_compressed_total", "Письма, сжатые под PROMPT_TOKEN_BUDGET")
+metrics.describe("prompt_tokens_cut_total", "Оценка токенов, вырезанных из писем при сжатии")
+metrics.describe("letters_route_total", "Маршрут письма (llm/template) и причина выбора")
+metrics.describe("near_duplicate_lookups_total", "Поиски почти-дубликатов письма")
+metrics.describe("near_duplicate_hits_total", "Письма, получившие ответ почти-дубликата")
+metrics.describe("llm_retries_total", "Повторы LLM-вызовов после временных ошибок (по типу вызова и коду)")
+metrics.describe("llm_hedged_total", "Дублирующие (хеджированные) LLM-запросы")
+metrics.describe("llm_coalesced_total", "Запросы к модели, присоединившиеся к такому же идущему вызову")
+metrics.describe("analyze_memo_total", "Запросы /analyze: из памяти (hit) или с разбором письма (miss)")
+metrics.describe("errors_total", "Ошибки по этапу и типу исключения")
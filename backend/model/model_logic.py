@@ -1,36 +1,348 @@
+import asyncio
+import json
 import os
 import re
+import threading
+import time
 import urllib.request
-from datetime import datetime, timedelta
-
-from dotenv import load_dotenv
-from openai import OpenAI
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime
+from time import perf_counter
+from typing import NamedTuple
+
+try:  # импорт как пакета model (backend/api.py)
+    from .company_registry import CompanyRegistry
+    from .entity_extractor import Entity, EntityExtractor, entities_to_info
+    from .keyword_matcher import KeywordMatcher
+    from .llm_cache import LLMCache
+    from .metrics import metrics
+    from .near_duplicates import NearDuplicateIndex
+    from .prompt_budget import compress_letter, estimate_tokens
+    from .rate_limit import UpstreamLimiter
+    from .resilience import LLMCallError, ResilientCaller, classify_error, describe_error
+    from .routing import LetterRouter, LoadMonitor, extractive_summary, render_template_reply
+    from .singleflight import SingleFlight
+except ImportError:  # запуск скриптов прямо из backend/model
+    from company_registry import CompanyRegistry
+    from entity_extractor import Entity, EntityExtractor, entities_to_info
+    from keyword_matcher import KeywordMatcher
+    from llm_cache import LLMCache
+    from metrics import metrics
+    from near_duplicates import NearDuplicateIndex
+    from prompt_budget import compress_letter, estimate_tokens
+    from rate_limit import UpstreamLimiter
+    from resilience import LLMCallError, ResilientCaller, classify_error, describe_error
+    from routing import LetterRouter, LoadMonitor, extractive_summary, render_template_reply
+    from singleflight import SingleFlight
 
 ENV_URL = "https://storage.yandexcloud.net/ycpub/maikeys/.env"
 
-if not os.path.exists(".env"):
-    print("Скачиваю .env...")
-    urllib.request.urlretrieve(ENV_URL, ".env")
+# другой адрес — например, локальная фейковая модель для нагрузочных тестов (fake_llm_server.py)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://rest-assistant.api.cloud.yandex.net/v1")
+
+# Конфиг и клиенты создаются лениво, при первом обращении к модели (или в warm_up()).
+# Импорт модуля ради правил (classify_letter, extract_info, ...) не лезет в сеть,
+# не требует ключей и не тянет пакет openai.
+_llm_lock = threading.Lock()
+_llm_config: dict | None = None
+_client = None
+_async_client = None
+
+
+def get_llm_config() -> dict:
+    """
+    folder_id, api_key и id модели. При первом вызове скачивает .env, если его нет
+    и ключи не заданы в окружении.
+    """
+    global _llm_config
+    if _llm_config is None:
+        with _llm_lock:
+            if _llm_config is None:
+                from dotenv import load_dotenv
+
+                if not os.path.exists(".env") and not (os.getenv("folder_id") and os.getenv("api_key")):
+                    print("Скачиваю .env...")
+                    urllib.request.urlretrieve(ENV_URL, ".env")
 
-load_dotenv(".env")
+                load_dotenv(".env")
 
-folder_id = os.getenv("folder_id")
-api_key = os.getenv("api_key")
+                folder_id = os.getenv("folder_id")
+                api_key = os.getenv("api_key")
 
-if not folder_id or not api_key:
-    raise RuntimeError(
-        "Не найдены переменные окружения 'folder_id' или 'api_key'. "
+                if not folder_id or not api_key:
+                    raise RuntimeError(
+                        "Не найдены переменные окружения 'folder_id' или 'api_key'. "
+                    )
+
+                _llm_config = {
+                    "folder_id": folder_id,
+                    "api_key": api_key,
+                    "model": f"gpt://{folder_id}/qwen3-235b-a22b-fp8/latest",
+                }
+    return _llm_config
+
+
+def get_model() -> str:
+    return get_llm_config()["model"]
+
+
+def _http_limits():
+    import httpx
+
+    # соединений с запасом на хеджированные дубликаты; keep-alive — чтобы не платить за TLS на каждый вызов
+    return httpx.Limits(
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS,
+        keepalive_expiry=LLM_HTTP_KEEPALIVE,
     )
 
-model = f"gpt://{folder_id}/qwen3-235b-a22b-fp8/latest"
 
-client = OpenAI(
-    api_key=api_key,
-    base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-    project=folder_id,
+def _http_timeout():
+    import httpx
+
+    # общий потолок; реальный таймаут каждой попытки — остаток дедлайна запроса
+    return httpx.Timeout(LLM_CALL_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def get_client():
+    """Общий синхронный OpenAI-клиент (создаётся один раз, потокобезопасно)."""
+    global _client
+    if _client is None:
+        config = get_llm_config()
+        with _llm_lock:
+            if _client is None:
+                import httpx
+                from openai import OpenAI
+
+                _client = OpenAI(
+                    api_key=config["api_key"],
+                    base_url=LLM_BASE_URL,
+                    project=config["folder_id"],
+                    # повторы и таймауты — в llm_caller, у клиента только общий пул соединений
+                    max_retries=0,
+                    http_client=httpx.Client(limits=_http_limits(), timeout=_http_timeout()),
+                )
+    return _client
+
+
+def get_async_client():
+    """
+    Асинхронный клиент для process_letter_async / async_api.py:
+    пока ждём сеть, поток не занят и может обслуживать другие письма.
+    """
+    global _async_client
+    if _async_client is None:
+        config = get_llm_config()
+        with _llm_lock:
+            if _async_client is None:
+                import httpx
+                from openai import AsyncOpenAI
+
+                _async_client = AsyncOpenAI(
+                    api_key=config["api_key"],
+                    base_url=LLM_BASE_URL,
+                    project=config["folder_id"],
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout()),
+                )
+    return _async_client
+
+
+def preload() -> None:
+    """
+    Подготовка в мастер-процессе gunicorn до fork: конфиг и тяжёлые импорты клиента.
+    Правила (регулярки, словари) собираются уже при импорте модуля. Клиенты, пулы
+    соединений и фоновые потоки здесь не создаются — после fork их нельзя делить
+    между процессами, их поднимает warm_up в каждом воркере.
+    """
+    get_llm_config()
+    # сами модули тяжёлые (сотни миллисекунд на импорт) — воркеры получат их готовыми
+    import httpx
+    import openai
+
+
+def is_warm() -> bool:
+    """Клиенты модели созданы (warm_up выполнен) — процесс готов принимать письма."""
+    return _client is not None and _async_client is not None
+
+
+def warm_up() -> None:
+    """
+    Явный прогрев: читает конфиг, создаёт клиентов, открывает дисковый кэш ответов и
+    реестр компаний заранее, чтобы первый запрос не платил за это. Сервер вызывает
+    один раз при старте (под gunicorn — в каждом воркере, после fork).
+    """
+    get_client()
+    get_async_client()
+    llm_cache.open()
+    # индекс реестра компаний собирается в фоне; до готовности работает seed-таблица
+    company_registry.reload(background=True)
+
+
+# Общий пул потоков для LLM-вызовов: создаётся один раз на процесс,
+# запросы только ставят в него задачи (без новых потоков на каждый запрос).
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "32"))
+# таймаут на один LLM-вызов внутри process_letter, секунды
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))
+# сколько писем батча одновременно ждут модель (по 2 LLM-вызова на письмо)
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+# режим LLM-части по умолчанию (см. LLM_MODES); в запросе можно выбрать другой
+LLM_MODE = os.getenv("LLM_MODE", "separate")
+# Устойчивость LLM-вызовов (resilience.py): повторы временных ошибок с экспоненциальной
+# паузой и джиттером в пределах дедлайна запроса; LLM_HEDGE=1 — дублирующий запрос,
+# если первый идёт дольше LLM_HEDGE_QUANTILE наблюдаемого времени.
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", str(2 * LLM_MAX_WORKERS)))
+LLM_HTTP_KEEPALIVE = float(os.getenv("LLM_HTTP_KEEPALIVE", "60"))
+# Клиентский лимитер перед каждым вызовом модели (rate_limit.py): квоты провайдера
+# LLM_RPM (запросов в минуту) и LLM_TPM (токенов в минуту), 0 — без ограничения;
+# параллельность подбирается по AIMD в пределах LLM_CONCURRENCY_MIN..LLM_CONCURRENCY_MAX.
+# Без квот LLM_CONCURRENCY_MAX по умолчанию 0 — параллельность не ограничивается (её и так
+# держат пул потоков и HTTP-пул, а async-вызовы не должны упираться в размер пула потоков);
+# с квотами — LLM_MAX_WORKERS.
+# LLM_EXPECTED_OUTPUT_TOKENS — резерв на ответ модели, пока не пришёл настоящий usage.
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+LLM_CONCURRENCY_MAX = int(os.getenv(
+    "LLM_CONCURRENCY_MAX", str(LLM_MAX_WORKERS if LLM_RPM > 0 or LLM_TPM > 0 else 0)
+))
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "400"))
+# бюджет на текст письма в промпте (оценка prompt_budget.estimate_tokens); длиннее — сжимается,
+# 0 — не ограничивать
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2000"))
+
+llm_executor = ThreadPoolExecutor(
+    max_workers=LLM_MAX_WORKERS,
+    thread_name_prefix="llm",
+)
+
+llm_caller = ResilientCaller(
+    default_timeout=LLM_CALL_TIMEOUT,
+    max_attempts=LLM_MAX_ATTEMPTS,
+    hedge=LLM_HEDGE,
+    hedge_quantile=LLM_HEDGE_QUANTILE,
+    hedge_workers=LLM_MAX_WORKERS,
+    on_retry=lambda kind, code: metrics.inc("llm_retries_total", kind=kind, code=code),
+    on_hedge=lambda kind: metrics.inc("llm_hedged_total", kind=kind),
+)
+
+# Одинаковые одновременные запросы к модели (двойной клик, повтор фронтенда, одно письмо
+# у нескольких операторов) склеиваются в один вызов — независимо от llm_cache и use_cache.
+# Ключ — ключ кэша: нормализованный текст, тип промпта, тон, длина и т.д.
+llm_flights = SingleFlight(on_join=lambda key: metrics.inc("llm_coalesced_total", kind=key.split(":", 1)[0]))
+
+llm_limiter = UpstreamLimiter(
+    rpm=LLM_RPM,
+    tpm=LLM_TPM,
+    # всплеск сверх ровного темпа: столько секунд работы на квоте можно потратить сразу
+    burst_seconds=float(os.getenv("LLM_RATE_BURST_SECONDS", "2")),
+    initial_limit=int(os.getenv("LLM_CONCURRENCY_INITIAL", str(max(LLM_CONCURRENCY_MIN, LLM_CONCURRENCY_MAX // 4)))),
+    min_limit=LLM_CONCURRENCY_MIN,
+    max_limit=LLM_CONCURRENCY_MAX,
+    latency_tolerance=float(os.getenv("LLM_LATENCY_TOLERANCE", "2.0")),
+)
+
+
+def _limiter_metrics() -> list[tuple[str, str, dict, float]]:
+    snapshot = llm_limiter.snapshot()
+    collected = [
+        ("llm_in_flight", "gauge", {}, snapshot["in_flight"]),
+        ("llm_limiter_throttled_total", "counter", {}, snapshot["throttled"]),
+        ("llm_limiter_timeouts_total", "counter", {}, snapshot["timeouts"]),
+        ("llm_limiter_waited_total", "counter", {}, snapshot["waited"]),
+    ]
+    if snapshot["limit"] is not None:
+        collected.append(("llm_concurrency_limit", "gauge", {}, snapshot["limit"]))
+    return collected
+
+
+metrics.register_collector(_limiter_metrics)
+
+# Кэш ответов модели: LRU в памяти + (если задан LLM_CACHE_PATH) SQLite на диске.
+# Файл открывается в каждом процессе при первом обращении (или в warm_up), не при импорте.
+# Ключ — нормализованный текст, тип промпта, тон, длина ответа и id модели.
+llm_cache = LLMCache(
+    max_items=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("LLM_CACHE_TTL", str(24 * 3600))),
+    path=os.getenv("LLM_CACHE_PATH") or None,
+    max_disk_items=int(os.getenv("LLM_CACHE_DISK_MAX_ITEMS", "100000")),
+)
+
+
+def _cache_metrics() -> list[tuple[str, str, dict, float]]:
+    stats = llm_cache.stats()
+    return [
+        ("llm_cache_hits_total", "counter", {"tier": "memory"}, stats["memory_hits"]),
+        ("llm_cache_hits_total", "counter", {"tier": "disk"}, stats["disk_hits"]),
+        ("llm_cache_misses_total", "counter", {}, stats["misses"]),
+        ("llm_cache_evictions_total", "counter", {}, stats["evictions"]),
+        ("llm_cache_items", "gauge", {}, stats["memory_items"]),
+    ]
+
+
+metrics.register_collector(_cache_metrics)
+
+# Почти-дубликаты недавних писем (волны одинаковых жалоб с разными номерами и датами):
+# резюме и ответ берутся у похожего письма, факты подставляются заново.
+# NEAR_DUP_THRESHOLD — минимальная похожесть (оценка Жаккара по шинглам), 0 — выключено.
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.9"))
+near_duplicates = NearDuplicateIndex(
+    threshold=NEAR_DUP_THRESHOLD or 1.0,
+    max_items=int(os.getenv("NEAR_DUP_MAX_ITEMS", "5000")),
+    ttl=float(os.getenv("NEAR_DUP_TTL", "3600")),
+)
+
+
+def _near_duplicate_metrics() -> list[tuple[str, str, dict, float]]:
+    stats = near_duplicates.stats()
+    return [
+        ("near_duplicate_lookups_total", "counter", {}, stats["lookups"]),
+        ("near_duplicate_hits_total", "counter", {}, stats["hits"]),
+        ("near_duplicate_items", "gauge", {}, stats["items"]),
+    ]
+
+
+metrics.register_collector(_near_duplicate_metrics)
+
+# Маршрутизация: малоценные письма получают шаблонный ответ без LLM (см. routing.py).
+# ROUTE_TEMPLATE_CATEGORIES — категории через запятую, для которых шаблон — норма;
+# при деградации (модель медленная или очередь длинная) шаблон получают все письма
+# с приоритетом не выше ROUTE_DEGRADED_MAX_PRIORITY.
+llm_load = LoadMonitor(
+    latency_limit=float(os.getenv("ROUTE_DEGRADED_LATENCY", "15")),
+    queue_limit=int(os.getenv("ROUTE_DEGRADED_QUEUE", str(2 * LLM_MAX_WORKERS))),
+)
+letter_router = LetterRouter(
+    llm_load,
+    template_categories=[
+        c.strip()
+        for c in os.getenv("ROUTE_TEMPLATE_CATEGORIES", "Уведомление или информирование").split(",")
+        if c.strip()
+    ],
+    template_max_priority=int(os.getenv("ROUTE_TEMPLATE_MAX_PRIORITY", "6")),
+    degraded_max_priority=int(os.getenv("ROUTE_DEGRADED_MAX_PRIORITY", "6")),
 )
 
 
+def _routing_metrics() -> list[tuple[str, str, dict, float]]:
+    load = llm_load.snapshot()
+    return [
+        ("llm_degraded", "gauge", {}, int(load["degraded"])),
+        ("llm_latency_ewma_seconds", "gauge", {}, load["latency_ewma"]),
+        ("llm_queue_depth", "gauge", {}, load["queue_depth"]),
+    ]
+
+
+metrics.register_collector(_routing_metrics)
+
+
 COMPANY_PRIORITY_TABLE: dict[str, dict] = {
     'ооо "ромашка"': {
         "base_priority": 7,
@@ -45,6 +357,14 @@ COMPANY_PRIORITY_TABLE: dict[str, dict] = {
     # если компании нет - base=5
 }
 
+# Реестр клиентов для приоритета. COMPANY_REGISTRY_PATH — CSV/JSONL с полями
+# name, base_priority, segment, risk_level (или готовый .sqlite-индекс).
+# Без него работает только COMPANY_PRIORITY_TABLE.
+company_registry = CompanyRegistry(
+    os.getenv("COMPANY_REGISTRY_PATH") or None,
+    seed=COMPANY_PRIORITY_TABLE,
+    cache_size=int(os.getenv("COMPANY_REGISTRY_CACHE_SIZE", "50000")),
+)
 
 
 def preprocess_text(text: str) -> str:
@@ -55,14 +375,10 @@ def preprocess_text(text: str) -> str:
     text = " ".join(text.split())
     return text
 
-def classify_letter(text: str) -> str:
-    text = preprocess_text(text)
-    if not text:
-        return "Иное обращение"
-
-    lowered = text.lower()
-
-    if any(kw in lowered for kw in [
+# Таблицы ключевых слов. Порядок категорий важен: срабатывает первая найденная,
+# как в прежней цепочке if-ов.
+CATEGORY_KEYWORDS: list[tuple[str, list[str]]] = [
+    ("Регуляторный запрос", [
         "банк россии",           
         "банка россии",          
         "цб рф",
@@ -73,10 +389,8 @@ def classify_letter(text: str) -> str:
         "указание цб",
         "указания цб",
         "формы №",             
-    ]):
-        return "Регуляторный запрос"
-
-    if any(kw in lowered for kw in [
+    ]),
+    ("Официальная жалоба или претензия", [
         "жалоба",
         "претензия",
         "претензионное письмо",
@@ -86,10 +400,8 @@ def classify_letter(text: str) -> str:
         "требуем немедленного",
         "требуем возврата",
         "требуем возместить",
-    ]):
-        return "Официальная жалоба или претензия"
-
-    if any(kw in lowered for kw in [
+    ]),
+    ("Партнёрское предложение", [
         "партнерство",
         "партнёрство",
         "стратегического партнёрства",
@@ -101,19 +413,15 @@ def classify_letter(text: str) -> str:
         "готовы обсудить детали",
         "совместного запуска цифровой платформы",
         "партнёрский проект",
-    ]):
-        return "Партнёрское предложение"
-
-    if any(kw in lowered for kw in [
+    ]),
+    ("Запрос на согласование", [
         "на согласование",
         "просим согласовать",
         "прошу согласовать",
         "согласование проведения мероприятия",
         "направляем на согласование",
-    ]):
-        return "Запрос на согласование"
-
-    if any(kw in lowered for kw in [
+    ]),
+    ("Запрос информации/документов", [
         "просим предоставить",
         "прошу предоставить",
         "просим представить",
@@ -127,87 +435,79 @@ def classify_letter(text: str) -> str:
         "просим предоставить документы",
         "просим представить информацию",
         "просим представить документы",
-    ]):
-        return "Запрос информации/документов"
-    
-    if any(kw in lowered for kw in [
+    ]),
+    ("Уведомление или информирование", [
         "сообщаем",
         "настоящим сообщаем",
         "уведомляем",
         "настоящим уведомляем",
         "информируем",
         "доводим до вашего сведения",
-    ]):
-        return "Уведомление или информирование"
-
-    return "Иное обращение"
-
-def extract_info(text: str) -> dict:
-    info: dict = {}
-
-    # поиск даты в формате 12.03.2025
-    date_match = re.search(r"\b(\d{1,2}\.\d{1,2}\.\d{4})\b", text)
-    if date_match:
-        info["deadline_date"] = date_match.group(1)
-
-    # примитив: "в течение N дней"
-    days_match = re.search(r"в течение\s+(\d+)\s+дн", text.lower())
-    if days_match:
-        days = int(days_match.group(1))
-        info["deadline_relative"] = f"{days} дней"
-        info["deadline_date_estimated"] = (
-            datetime.now() + timedelta(days=days)
-        ).strftime("%d.%m.%Y")
-
-    # номер договора/закона вида №123-ХХ или № 123
-    contract_match = re.search(r"№\s*([\w\-\/]+)", text)
-    if contract_match:
-        info["document_number"] = contract_match.group(1)
-
-    # очень простое извлечение суммы (например, 100 000 руб.)
-    amount_match = re.search(r"(\d[\d\s]{2,})\s*(?:руб\.?|₽)", text.lower())
-    if amount_match:
-        info["amount"] = amount_match.group(1).strip().replace(" ", "")
-
-    # попытка вытащить компанию-отправителя: ООО/АО/ПАО «...» или "..."
-    company_match = re.search(r"(ООО|АО|ПАО)\s+\"?«?([^»\"]+)\"?»?", text)
-    if company_match:
-        sender_company = f'{company_match.group(1)} "{company_match.group(2).strip()}"'
-        info["sender_company"] = sender_company
+    ]),
+]
 
-    return info
-
-def estimate_urgency(text: str) -> str:
-    lowered = text.lower()
-
-    high_markers = [
+URGENCY_MARKERS: list[tuple[str, list[str]]] = [
+    ("Высокая срочность", [
         "срочно",
         "в кратчайшие сроки",
         "немедленно",
         "в ближайшее время",
         "незамедлительно",
         "до конца дня",
-    ]
-    medium_markers = [
+    ]),
+    ("Средняя срочность", [
         "крайний срок",
         "срок исполнения",
         "просим ответить в течение",
         "до ",
-    ]
+    ]),
+]
+
+# Все таблицы компилируются один раз при импорте в общий автомат:
+# текст письма просматривается за один проход, сколько бы слов ни было.
+keyword_matcher = KeywordMatcher()
+keyword_matcher.add_table("category", CATEGORY_KEYWORDS)
+keyword_matcher.add_table("urgency", URGENCY_MARKERS)
+keyword_matcher.compile()
+
+
+def category_from_labels(labels: dict[str, str]) -> str:
+    return labels.get("category", "Иное обращение")
+
+
+def urgency_from_labels(labels: dict[str, str]) -> str:
+    return labels.get("urgency", "Низкая срочность")
+
+
+def classify_letter(text: str) -> str:
+    text = preprocess_text(text)
+    if not text:
+        return "Иное обращение"
+
+    return category_from_labels(keyword_matcher.labels(text.lower(), ("category",)))
+
+# даты, сроки, номера документов, суммы и компании — по регулярке на тип
+entity_extractor = EntityExtractor()
+
 
-    if any(m in lowered for m in high_markers):
-        return "Высокая срочность"
+def extract_entities(text: str) -> dict[str, list[Entity]]:
+    """Все найденные сущности каждого типа со спанами (а не только первая, как в extract_info)."""
+    return entity_extractor.extract(text)
 
-    if any(m in lowered for m in medium_markers):
-        return "Средняя срочность"
 
-    return "Низкая срочность"
+def extract_info(text: str, today: datetime | None = None) -> dict:
+    # нужны только первые вхождения — поиск каждого типа останавливается на первом
+    return entities_to_info(entity_extractor.first(text), today)
+
+
+def estimate_urgency(text: str) -> str:
+    return urgency_from_labels(keyword_matcher.labels(text.lower(), ("urgency",)))
 
 def get_company_profile(sender_company: str | None) -> dict | None:
     if not sender_company:
         return None
-    key = sender_company.lower()
-    return COMPANY_PRIORITY_TABLE.get(key)
+    # только точное (после нормализации) совпадение: по префиксу «ООО «Р» нашёлся бы чужой профиль
+    return company_registry.get(sender_company)
 
 
 def calculate_priority(
@@ -275,30 +575,240 @@ def calculate_priority(
         "company_profile": company_profile,
     }
 
-def summarize_letter(text: str, max_sentences: int = 2) -> str:
-    text = preprocess_text(text)
-    if not text:
-        return ""
+SUMMARY_INSTRUCTIONS = "Ты кратко пересказываешь содержание деловых писем."
+RESPONSE_INSTRUCTIONS = "Ты - ассистент деловой переписки банка."
 
-    prompt = f"""
-Тебе дан текст входящего письма.
+# тексты на месте резюме / ответа, если вызов модели не удался или не уложился в таймаут
+SUMMARY_FAILED = "Не удалось сформировать краткое резюме письма."
+RESPONSE_FAILED = "Не удалось сгенерировать ответ."
 
-Задача: кратко пересказать суть письма {max_sentences} предложениями на русском языке, 
-нейтральным деловым стилем, без приветствий и лишних деталей.
+
+def fit_prompt_text(text: str, entities: dict | None = None) -> tuple[str, dict | None]:
+    """
+    Текст письма для промпта в пределах PROMPT_TOKEN_BUDGET. Короткое письмо возвращается
+    как есть (статистика None), длинное сжимается prompt_budget.compress_letter:
+    остаются начало, конец и предложения с фактами, служебные строки выбрасываются.
+    entities — сущности по preprocess_text(text), если уже посчитаны.
+    """
+    if PROMPT_TOKEN_BUDGET <= 0 or estimate_tokens(text) <= PROMPT_TOKEN_BUDGET:
+        return text, None
+    if entities is None:
+        entities = entity_extractor.extract(preprocess_text(text))
+    compressed, stats = compress_letter(text, entities, PROMPT_TOKEN_BUDGET)
+    metrics.inc("prompt_letters_compressed_total")
+    metrics.inc("prompt_tokens_cut_total", stats["original_tokens"] - stats["prompt_tokens"])
+    return compressed, stats
+
+
+def build_summary_prompt(text: str, max_sentences: int = 2) -> str:
+    text, _ = fit_prompt_text(text)
+    # письмо — до параметров задачи, как и в build_prompt_prefix
+    return f"""
+Тебе дан текст входящего письма.
 
 Письмо:
 \"\"\"{text}\"\"\"
+
+Задача: кратко пересказать суть письма {max_sentences} предложениями на русском языке,
+нейтральным деловым стилем, без приветствий и лишних деталей.
 """.strip()
 
-    try:
-        res = client.responses.create(
-            model=model,
-            instructions="Ты кратко пересказываешь содержание деловых писем.",
-            input=prompt,
-        )
+
+def _record_llm_call(kind: str, started: float, res=None, error: Exception | None = None) -> None:
+    """Метрики одного вызова модели: время, исход, токены из res.usage, тип ошибки."""
+    elapsed = perf_counter() - started
+    metrics.observe("letter_stage_seconds", elapsed, stage=kind)
+    llm_load.observe_latency(elapsed)
+    if error is not None:
+        metrics.inc("llm_requests_total", kind=kind, outcome="error")
+        metrics.inc("errors_total", stage=kind, type=type(error).__name__)
+        return
+
+    metrics.inc("llm_requests_total", kind=kind, outcome="ok")
+    usage = getattr(res, "usage", None)
+    if usage is not None:
+        metrics.inc("llm_tokens_total", getattr(usage, "input_tokens", 0) or 0, kind=kind, direction="input")
+        metrics.inc("llm_tokens_total", getattr(usage, "output_tokens", 0) or 0, kind=kind, direction="output")
+        # часть входных токенов, взятая из кэша префиксов провайдера (см. build_prompt_prefix)
+        details = getattr(usage, "input_tokens_details", None)
+        metrics.inc("llm_tokens_total", getattr(details, "cached_tokens", 0) or 0, kind=kind, direction="cached")
+
+
+def _reserved_tokens(instructions: str, prompt: str) -> int:
+    # резерв квоты TPM до ответа: оценка промпта + ожидаемый ответ
+    return estimate_tokens(instructions) + estimate_tokens(prompt) + LLM_EXPECTED_OUTPUT_TOKENS
+
+
+def _release_permit(
+    permit, res=None, error: BaseException | None = None, latency: float | None = None
+) -> None:
+    """
+    Возвращает разрешение llm_limiter: фактические токены из usage или признак 429 / Retry-After.
+    latency — время ответа для AIMD, если не время с выдачи разрешения (у потока — до первого токена).
+    """
+    if error is None:
+        usage = getattr(res, "usage", None)
+        used = None
+        if usage is not None:
+            used = getattr(usage, "total_tokens", None) or (
+                (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+            )
+        llm_limiter.release(permit, used, latency=latency)
+        return
+
+    throttled = classify_error(error)[0] == "rate_limited"
+    retry_after = None
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if throttled and headers is not None:
+        try:
+            retry_after = float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    llm_limiter.release(permit, ok=False, throttled=throttled, retry_after=retry_after, latency=latency)
+
+
+def _call_model(kind: str, instructions: str, prompt: str, deadline: float | None = None) -> str:
+    """
+    Вызов модели через llm_caller: повторы, хеджирование, таймаут каждой попытки —
+    остаток дедлайна (time.monotonic(); None — LLM_CALL_TIMEOUT от текущего момента).
+    Каждая попытка сначала получает разрешение llm_limiter (квоты и параллельность).
+    При неудаче — LLMCallError.
+    """
+    reserved = _reserved_tokens(instructions, prompt)
+
+    def attempt(timeout: float) -> str:
+        attempt_deadline = time.monotonic() + timeout
+        started = perf_counter()
+        permit = llm_limiter.acquire(reserved, attempt_deadline)
+        metrics.observe("letter_stage_seconds", perf_counter() - started, stage="llm_limiter_wait")
+
+        started = perf_counter()
+        try:
+            res = get_client().responses.create(
+                model=get_model(),
+                instructions=instructions,
+                input=prompt,
+                timeout=max(0.001, attempt_deadline - time.monotonic()),
+            )
+        except Exception as e:
+            _release_permit(permit, error=e)
+            _record_llm_call(kind, started, error=e)
+            raise
+        _release_permit(permit, res)
+        _record_llm_call(kind, started, res)
         return res.output_text.strip()
-    except Exception as e:
-        return f"Не удалось сформировать краткое резюме письма ({e})."
+
+    return llm_caller.call(kind, attempt, deadline)
+
+
+async def _call_model_async(kind: str, instructions: str, prompt: str, deadline: float | None = None) -> str:
+    reserved = _reserved_tokens(instructions, prompt)
+
+    async def attempt(timeout: float) -> str:
+        attempt_deadline = time.monotonic() + timeout
+        started = perf_counter()
+        permit = await llm_limiter.acquire_async(reserved, attempt_deadline)
+        metrics.observe("letter_stage_seconds", perf_counter() - started, stage="llm_limiter_wait")
+
+        started = perf_counter()
+        try:
+            res = await get_async_client().responses.create(
+                model=get_model(),
+                instructions=instructions,
+                input=prompt,
+                timeout=max(0.001, attempt_deadline - time.monotonic()),
+            )
+        except BaseException as e:
+            # в том числе отмена проигравшего хеджированного запроса — слот надо вернуть
+            _release_permit(permit, error=e)
+            if isinstance(e, Exception):
+                _record_llm_call(kind, started, error=e)
+            raise
+        _release_permit(permit, res)
+        _record_llm_call(kind, started, res)
+        return res.output_text.strip()
+
+    return await llm_caller.call_async(kind, attempt, deadline)
+
+
+def _coalesced(kind: str, key: str, call, deadline: float | None):
+    """
+    call() через llm_flights: одинаковый вызов, который уже идёт, не повторяется —
+    ждём его результат или его ошибку (LLMCallError). Не дождались до своего
+    дедлайна — LLMCallError timeout, а идущий вызов доработает для остальных.
+    """
+    try:
+        return llm_flights.do(f"{kind}:{key}", call, deadline)
+    except TimeoutError as e:
+        raise LLMCallError("timeout", "Истёк дедлайн запроса", True, 0) from e
+
+
+async def _coalesced_async(kind: str, key: str, call, deadline: float | None):
+    try:
+        return await llm_flights.do_async(f"{kind}:{key}", call, deadline)
+    except TimeoutError as e:
+        raise LLMCallError("timeout", "Истёк дедлайн запроса", True, 0) from e
+
+
+def _cached(key: str, use_cache: bool) -> str | None:
+    return llm_cache.get(key) if use_cache else None
+
+
+def _remember(key: str, value: str) -> str:
+    # запоминаем и при use_cache=False: это «дай свежий вариант», а не «не кэшируй»
+    llm_cache.set(key, value)
+    return value
+
+
+def _summary_key(text: str, max_sentences: int) -> str:
+    """Ключ кэша резюме по уже очищенному тексту."""
+    return LLMCache.make_key("summary", get_model(), text, max_sentences=max_sentences)
+
+
+def summarize_letter(
+    text: str,
+    max_sentences: int = 2,
+    use_cache: bool = True,
+    deadline: float | None = None,
+) -> str:
+    """
+    Резюме письма. Ошибка модели — LLMCallError (см. _call_model), в кэш не попадает.
+    Такое же резюме, которое уже запрашивается, не запрашивается второй раз (llm_flights).
+    """
+    text = preprocess_text(text)
+    if not text:
+        return ""
+    key = _summary_key(text, max_sentences)
+    cached = _cached(key, use_cache)
+    if cached is not None:
+        return cached
+
+    def call() -> str:
+        prompt = build_summary_prompt(text, max_sentences)
+        return _remember(key, _call_model("summarize", SUMMARY_INSTRUCTIONS, prompt, deadline))
+
+    return _coalesced("summary", key, call, deadline)
+
+
+async def summarize_letter_async(
+    text: str,
+    max_sentences: int = 2,
+    use_cache: bool = True,
+    deadline: float | None = None,
+) -> str:
+    text = preprocess_text(text)
+    if not text:
+        return ""
+    key = _summary_key(text, max_sentences)
+    cached = _cached(key, use_cache)
+    if cached is not None:
+        return cached
+
+    async def call() -> str:
+        prompt = build_summary_prompt(text, max_sentences)
+        return _remember(key, await _call_model_async("summarize", SUMMARY_INSTRUCTIONS, prompt, deadline))
+
+    return await _coalesced_async("summary", key, call, deadline)
 
 
 ANSWER_LENGTH_PRESETS = {
@@ -307,68 +817,85 @@ ANSWER_LENGTH_PRESETS = {
     "long":   "Ответ не более 12–15 предложений.",
 }
 
-def build_prompt(
+# Инструкции тона. Неизвестный тон или None (в том числе "деловой" — значение
+# по умолчанию у API) — корпоративный деловой.
+TONE_INSTRUCTIONS = {
+    "Официальный строгий": (
+        "Используй максимально официальный и строгий тон: "
+        "деловой стиль, опора на нормы и формулировки документов, "
+        "минимум эмоций и разговорных оборотов."
+    ),
+    "Корпоративный-деловой": (
+        "Пиши в корпоративном деловом стиле: вежливо, профессионально, "
+        "структурированно и по делу, без излишней эмоциональности."
+    ),
+    "Клиентоориентированный": (
+        "Сохраняй вежливый и клиентоориентированный тон: подчёркивай внимание к "
+        "клиенту, проявляй эмпатию, предлагай помощь и варианты решения, "
+        "избегай резких формулировок."
+    ),
+}
+DEFAULT_TONE = "Корпоративный-деловой"
+
+
+def build_prompt_prefix(
     original_text: str,
     category: str | None,
     info: dict | None,
-    tone: str | None = None,
-    answer_length: str | None = None,
 ) -> str:
+    """
+    Общая для всех вариантов ответа часть промпта: постоянные инструкции, затем письмо,
+    категория и факты. От тона и длины не зависит — варианты одного письма начинаются
+    одинаково, и провайдер может переиспользовать посчитанный префикс (prompt caching).
+    """
+    original_text, _ = fit_prompt_text(original_text)
+
     info_lines = []
     if info:
         for k, v in info.items():
             info_lines.append(f"- {k}: {v}")
     info_block = "\n".join(info_lines) if info_lines else "нет дополнительных данных"
 
-    # Тон
-    if tone == "Официальный строгий":
-        tone_instruction = (
-            "Используй максимально официальный и строгий тон: "
-            "деловой стиль, опора на нормы и формулировки документов, "
-            "минимум эмоций и разговорных оборотов."
-        )
-    elif tone == "Корпоративный-деловой":
-        tone_instruction = (
-            "Пиши в корпоративном деловом стиле: вежливо, профессионально, "
-            "структурированно и по делу, без излишней эмоциональности."
-        )
-    elif tone == "Клиентоориентированный":
-        tone_instruction = (
-            "Сохраняй вежливый и клиентоориентированный тон: подчёркивай внимание к "
-            "клиенту, проявляй эмпатию, предлагай помощь и варианты решения, "
-            "избегай резких формулировок."
-        )
+    return f"""
+Ты - ассистент деловой переписки крупного банка. Пиши строго на «Вы», официально-деловым стилем.
+Сформируй вежливый, профессиональный ответ от лица банка на входящее письмо клиента.
+Структура:
+- Обращение (если нет имени, используй «Уважаемый клиент»)
+- 1–2 абзаца по сути
+- При необходимости: сроки и дальнейшие шаги
+- Завершение с фразой «С уважением, ПСБ Банк».
+
+Входящее письмо клиента:
+\"\"\"{original_text}\"\"\"
+
+Категория письма: {category or "не определено"}.
+Извлечённые ключевые факты:
+{info_block}
+""".strip()
 
-    # Длина ответа
-    if answer_length is None:
-        answer_length = "medium"  # значение по умолчанию
 
+def build_variant_instructions(tone: str | None = None, answer_length: str | None = None) -> str:
+    """Хвост промпта, который отличает варианты ответа: тон и длина."""
+    tone_instruction = TONE_INSTRUCTIONS.get(tone, TONE_INSTRUCTIONS[DEFAULT_TONE])
     length_instruction = ANSWER_LENGTH_PRESETS.get(
-        answer_length,
+        answer_length or "medium",
         ANSWER_LENGTH_PRESETS["medium"],
     )
+    return f"{tone_instruction}\n{length_instruction}"
 
-    return f"""
-        Ты - ассистент деловой переписки крупного банка. Пиши строго на «Вы», официально-деловым стилем.
-
-        Входящее письмо клиента:
-        \"\"\"{original_text}\"\"\"
-
-        Категория письма: {category or "не определено"}.
-        Извлечённые ключевые факты:
-        {info_block}
-
-        {tone_instruction}
-        {length_instruction}
-
-        Сформируй вежливый, профессиональный ответ от лица банка. 
-        Структура:
-        - Обращение (если нет имени, используй «Уважаемый клиент»)
-        - 1–2 абзаца по сути
-        - При необходимости: сроки и дальнейшие шаги
-        - Завершение с фразой «С уважением, ПСБ Банк».
-        """.strip()
 
+def build_prompt(
+    original_text: str,
+    category: str | None,
+    info: dict | None,
+    tone: str | None = None,
+    answer_length: str | None = None,
+) -> str:
+    return (
+        build_prompt_prefix(original_text, category, info)
+        + "\n\n"
+        + build_variant_instructions(tone, answer_length)
+    )
 
 
 def generate_response(
@@ -387,13 +914,90 @@ def generate_response(
     )
 
 
+def _response_cache_key(
+    text: str,
+    category: str | None,
+    info: dict | None,
+    tone: str | None,
+    answer_length: str | None,
+) -> str:
+    return LLMCache.make_key(
+        "response",
+        get_model(),
+        preprocess_text(text),
+        category=category,
+        info=info,
+        tone=tone,
+        answer_length=answer_length or "medium",
+    )
+
+
 def generate_response_with_tone(
     text: str,
     category: str | None = None,
     info: dict | None = None,
     tone: str | None = None,
     answer_length: str | None = None,
+    use_cache: bool = True,
+    deadline: float | None = None,
+) -> str:
+    key = _response_cache_key(text, category, info, tone, answer_length)
+    cached = _cached(key, use_cache)
+    if cached is not None:
+        return cached
+
+    def call() -> str:
+        prompt = build_prompt(text, category, info, tone, answer_length)
+        return _remember(key, _call_model("generate", RESPONSE_INSTRUCTIONS, prompt, deadline))
+
+    return _coalesced("response", key, call, deadline)
+
+
+async def generate_response_with_tone_async(
+    text: str,
+    category: str | None = None,
+    info: dict | None = None,
+    tone: str | None = None,
+    answer_length: str | None = None,
+    use_cache: bool = True,
+    deadline: float | None = None,
 ) -> str:
+    key = _response_cache_key(text, category, info, tone, answer_length)
+    cached = _cached(key, use_cache)
+    if cached is not None:
+        return cached
+
+    async def call() -> str:
+        prompt = build_prompt(text, category, info, tone, answer_length)
+        return _remember(key, await _call_model_async("generate", RESPONSE_INSTRUCTIONS, prompt, deadline))
+
+    return await _coalesced_async("response", key, call, deadline)
+
+
+def stream_response_with_tone(
+    text: str,
+    category: str | None = None,
+    info: dict | None = None,
+    tone: str | None = None,
+    answer_length: str | None = None,
+    use_cache: bool = True,
+    deadline: float | None = None,
+) -> Iterator[str]:
+    """
+    Потоковый вариант generate_response_with_tone: отдаёт куски ответа по мере того,
+    как модель их генерирует. Готовый ответ кладётся в llm_cache; при попадании
+    в кэш весь текст отдаётся одним куском.
+
+    Через llm_caller (с повторами, без хеджирования) проходит только открытие потока:
+    после первого отданного куска повторять запрос уже нельзя.
+    """
+    key = _response_cache_key(text, category, info, tone, answer_length)
+    if use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
     prompt = build_prompt(
         original_text=text,
         category=category,
@@ -402,37 +1006,329 @@ def generate_response_with_tone(
         answer_length=answer_length,
     )
 
+    reserved = _reserved_tokens(RESPONSE_INSTRUCTIONS, prompt)
+
+    def open_stream(timeout: float):
+        # разрешение llm_limiter держится до конца потока
+        attempt_deadline = time.monotonic() + timeout
+        permit = llm_limiter.acquire(reserved, attempt_deadline)
+        try:
+            return permit, get_client().responses.create(
+                model=get_model(),
+                instructions=RESPONSE_INSTRUCTIONS,
+                input=prompt,
+                stream=True,
+                timeout=max(0.001, attempt_deadline - time.monotonic()),
+            )
+        except Exception as e:
+            _release_permit(permit, error=e)
+            _record_llm_call("generate_stream", started, error=e)
+            raise
+
+    started = perf_counter()
+    completed = None
+    parts: list[str] = []
+    # AIMD лимитера смотрит на время до первого токена: длина потока зависит от ответа,
+    # а не от нагрузки на модель, и раздувала бы «обычное» время вызова
+    first_token = None
+    permit, stream = llm_caller.call("generate_stream", open_stream, deadline, hedge=False)
+    try:
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                if not parts:
+                    first_token = time.monotonic() - permit.started
+                    metrics.observe("letter_stage_seconds", perf_counter() - started, stage="generate_first_token")
+                parts.append(event.delta)
+                yield event.delta
+            elif event.type == "response.completed":
+                completed = event.response
+    except BaseException as e:
+        # в том числе клиент закрыл SSE (GeneratorExit) — слот лимитера возвращается
+        _release_permit(permit, error=e, latency=first_token)
+        if isinstance(e, Exception):
+            _record_llm_call("generate_stream", started, error=e)
+        raise
+    _release_permit(permit, completed, latency=first_token)
+    _record_llm_call("generate_stream", started, completed)
+
+    llm_cache.set(key, "".join(parts).strip())
+
+
+# Режимы LLM-части пайплайна:
+# "separate" — резюме и ответ двумя вызовами модели (параллельно);
+# "combined" — один вызов, модель возвращает оба поля в JSON.
+LLM_MODES = ("separate", "combined")
+
+COMBINED_INSTRUCTIONS = (
+    "Ты - ассистент деловой переписки банка. "
+    "Отвечай только JSON-объектом, без пояснений и разметки markdown."
+)
+
+
+def build_combined_prompt(
+    text: str,
+    category: str | None,
+    info: dict | None,
+    tone: str | None = None,
+    answer_length: str | None = None,
+    max_sentences: int = 2,
+) -> str:
+    response_prompt = build_prompt(
+        original_text=text,
+        category=category,
+        info=info,
+        tone=tone,
+        answer_length=answer_length,
+    )
+    return f"""
+{response_prompt}
+
+Дополнительно кратко перескажи суть письма {max_sentences} предложениями на русском языке,
+нейтральным деловым стилем, без приветствий и лишних деталей.
+
+Верни результат строго в виде JSON-объекта с двумя строковыми полями:
+{{"summary": "краткое резюме письма", "response": "текст ответа"}}
+""".strip()
+
+
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def parse_combined_output(raw: str) -> tuple[str, str]:
+    """
+    Разбирает ответ модели в режиме "combined" в пару (резюме, ответ).
+    Модель иногда оборачивает JSON в ```json … ``` или добавляет фразу до/после,
+    поэтому берётся внешний {...}. ValueError, если JSON не разобрался
+    или поля summary/response пустые либо не строки.
+    """
+    m = _JSON_OBJECT_RE.search(raw or "")
+    if m is None:
+        raise ValueError("в ответе модели нет JSON-объекта")
+    data = json.loads(m.group())  # json.JSONDecodeError — подкласс ValueError
+    if not isinstance(data, dict):
+        raise ValueError("ответ модели — не JSON-объект")
+
+    fields = []
+    for name in ("summary", "response"):
+        value = data.get(name)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"поле {name!r} отсутствует или пустое")
+        fields.append(value.strip())
+    return fields[0], fields[1]
+
+
+def _call_both(first, second, deadline: float | None) -> tuple:
+    """
+    (first(), second()) параллельно: first — в llm_executor, second — в текущем потоке.
+    Вызывающий сам часто работает в llm_executor, поэтому ждать двух задач пула нельзя —
+    при занятом пуле они бы не дождались свободного потока. Если first так и не начался,
+    пока шёл second, он снимается с очереди и выполняется здесь же.
+    Ошибка любого вызова пробрасывается как есть.
+    """
+    future = llm_executor.submit(first)
+    try:
+        second_result = second()
+    except BaseException:
+        future.cancel()
+        raise
+    if future.cancel():
+        return first(), second_result
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    try:
+        return future.result(timeout=timeout), second_result
+    except FutureTimeoutError as e:
+        raise LLMCallError("timeout", "Истёк дедлайн запроса", True, 0) from e
+
+
+class _CombinedPlan(NamedTuple):
+    """Что известно summarize_and_respond до вызова модели (общее для sync и async)."""
+    text: str             # preprocess_text(text)
+    summary_key: str
+    response_key: str
+    summary: str | None   # из кэша; у пустого письма — ""
+    response: str | None  # из кэша
+    prompt: str | None    # промпт общего вызова; None — он не нужен
+
+
+def _combined_plan(
+    text: str,
+    category: str | None,
+    info: dict | None,
+    tone: str | None,
+    answer_length: str | None,
+    max_sentences: int,
+    use_cache: bool,
+) -> _CombinedPlan:
+    text = preprocess_text(text)
+    summary_key = _summary_key(text, max_sentences)
+    response_key = _response_cache_key(text, category, info, tone, answer_length)
+    summary = "" if not text else _cached(summary_key, use_cache)
+    response = _cached(response_key, use_cache)
+    prompt = None
+    # половина уже есть — дешевле добрать вторую отдельным вызовом
+    if summary is None and response is None:
+        prompt = build_combined_prompt(text, category, info, tone, answer_length, max_sentences)
+    return _CombinedPlan(text, summary_key, response_key, summary, response, prompt)
+
+
+def _combined_result(raw: str, plan: _CombinedPlan) -> tuple[str, str] | None:
+    """
+    Ответ общего вызова: (резюме, ответ), обе половины кладутся в кэш под ключами
+    раздельных вызовов. None — модель вернула невалидный JSON, нужны раздельные вызовы.
+    """
     try:
-        res = client.responses.create(
-            model=model,
-            instructions="Ты - ассистент деловой переписки банка.",
-            input=prompt,
+        summary, response = parse_combined_output(raw)
+    except ValueError as e:
+        metrics.inc("llm_combined_fallback_total", reason=type(e).__name__)
+        return None
+    llm_cache.set(plan.summary_key, summary)
+    llm_cache.set(plan.response_key, response)
+    return summary, response
+
+
+def summarize_and_respond(
+    text: str,
+    category: str | None = None,
+    info: dict | None = None,
+    tone: str | None = None,
+    answer_length: str | None = None,
+    max_sentences: int = 2,
+    use_cache: bool = True,
+    deadline: float | None = None,
+) -> tuple[str, str]:
+    """
+    Резюме и ответ одним вызовом модели (режим "combined"): письмо уходит в модель
+    один раз, поэтому входных токенов и запросов вдвое меньше, чем у пары
+    summarize_letter + generate_response_with_tone.
+
+    Результаты кладутся в llm_cache под теми же ключами, что и у раздельных вызовов,
+    так что режимы делят кэш. Если модель вернула невалидный JSON — раздельные вызовы.
+    Ошибка модели — LLMCallError.
+    """
+    plan = _combined_plan(text, category, info, tone, answer_length, max_sentences, use_cache)
+    if plan.prompt is not None:
+        raw = _coalesced(
+            "combined",
+            plan.summary_key + plan.response_key,
+            lambda: _call_model("combined", COMBINED_INSTRUCTIONS, plan.prompt, deadline),
+            deadline,
         )
-        return res.output_text.strip()
-    except Exception as e:
-        return f"Не удалось сгенерировать ответ: {e}"
+        pair = _combined_result(raw, plan)
+        if pair is not None:
+            return pair
 
+    def summary() -> str:
+        return summarize_letter(plan.text, max_sentences, use_cache=False, deadline=deadline)
 
-def process_letter(
+    def response() -> str:
+        return generate_response_with_tone(
+            plan.text, category, info, tone, answer_length, use_cache=False, deadline=deadline
+        )
+
+    if plan.summary is None and plan.response is None:
+        return _call_both(summary, response, deadline)
+    return (
+        plan.summary if plan.summary is not None else summary(),
+        plan.response if plan.response is not None else response(),
+    )
+
+
+async def summarize_and_respond_async(
     text: str,
+    category: str | None = None,
+    info: dict | None = None,
     tone: str | None = None,
-    sender_company: str | None = None,
     answer_length: str | None = None,
+    max_sentences: int = 2,
+    use_cache: bool = True,
+    deadline: float | None = None,
+) -> tuple[str, str]:
+    """Асинхронный вариант summarize_and_respond."""
+    plan = _combined_plan(text, category, info, tone, answer_length, max_sentences, use_cache)
+    if plan.prompt is not None:
+        raw = await _coalesced_async(
+            "combined",
+            plan.summary_key + plan.response_key,
+            lambda: _call_model_async("combined", COMBINED_INSTRUCTIONS, plan.prompt, deadline),
+            deadline,
+        )
+        pair = _combined_result(raw, plan)
+        if pair is not None:
+            return pair
+
+    async def summary() -> str:
+        return await summarize_letter_async(plan.text, max_sentences, use_cache=False, deadline=deadline)
+
+    async def response() -> str:
+        return await generate_response_with_tone_async(
+            plan.text, category, info, tone, answer_length, use_cache=False, deadline=deadline
+        )
+
+    if plan.summary is None and plan.response is None:
+        summary_text, response_text = await asyncio.gather(summary(), response())
+        return summary_text, response_text
+    return (
+        plan.summary if plan.summary is not None else await summary(),
+        plan.response if plan.response is not None else await response(),
+    )
+
+
+def _resolve_llm_mode(llm_mode: str | None) -> str:
+    return llm_mode if llm_mode in LLM_MODES else LLM_MODE
+
+
+def _wait_llm_result(future, deadline: float | None, what: str, errors: dict, fallback: str) -> str:
+    """
+    Дожидается результата LLM-вызова из пула до общего дедлайна.
+    При таймауте или исключении возвращает fallback-текст и пишет в errors[what]
+    структурированную ошибку (describe_error: code, message, retryable, attempts).
+    """
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        # сам вызов продолжит работу в пуле, но ждать его мы больше не будем
+        future.cancel()
+        errors[what] = LLMCallError("timeout", "Истёк дедлайн запроса", True, 0).to_dict()
+    except Exception as e:
+        errors[what] = describe_error(e)
+    return fallback
+
+
+def analyze_letter(
+    text: str,
+    sender_company: str | None = None,
+    today: datetime | None = None,
+    draft: bool = False,
 ) -> dict:
     """
-    Главный хелпер: принимает текст письма (и, опционально, компанию-отправителя и длину ответа).
-    Возвращает всё, что нужно фронту.
+    Дешёвая часть пайплайна без LLM: очистка, категория, факты, срочность, приоритет.
+    Общая для process_letter и process_letter_async.
+
+    draft=True — разбор черновика по мере набора (/analyze): без сжатия текста для промпта
+    (prompt_text — cleaned) и без учёта в метриках писем: ни letters_total / letters_urgency_total,
+    ни этапов letter_stage_seconds — черновик разбирается на каждое нажатие и исказил бы их.
     """
+    observe = metrics.observe
+    t0 = perf_counter()
     cleaned = preprocess_text(text)
-    category = classify_letter(cleaned)
-    info = extract_info(cleaned)
+    t1 = perf_counter()
+    # один проход по тексту даёт и категорию, и срочность
+    lowered = cleaned.lower()
+    labels = keyword_matcher.labels(lowered)
+    category = category_from_labels(labels) if cleaned else "Иное обращение"
+    t2 = perf_counter()
+    # сущности — по регулярке на тип, по тому же lowered без новой копии
+    entities = entity_extractor.extract(cleaned, lowered)
+    info = entities_to_info(entities, today)
 
     # если компанию явно передали в аргументе — считаем, что она приоритетнее парсинга из текста
     if sender_company:
         info["sender_company"] = sender_company
 
-    urgency = estimate_urgency(cleaned)
-    summary = summarize_letter(cleaned)
+    t3 = perf_counter()
+    urgency = urgency_from_labels(labels)
+    t4 = perf_counter()
 
     priority_info = calculate_priority(
         category=category,
@@ -440,20 +1336,713 @@ def process_letter(
         info=info,
         sender_company=info.get("sender_company"),
     )
-
-    response = generate_response_with_tone(
-        cleaned,
-        category,
-        info,
-        tone=tone,
-        answer_length=answer_length,
-    )
+    t5 = perf_counter()
+    prompt_text, prompt_stats = cleaned, None
+    if not draft and PROMPT_TOKEN_BUDGET > 0 and estimate_tokens(cleaned) > PROMPT_TOKEN_BUDGET:
+        # сжимается исходный текст: по переводам строк видны абзацы и служебные строки
+        prompt_text, prompt_stats = fit_prompt_text(text, entities)
+    t6 = perf_counter()
+
+    if not draft:
+        observe("letter_stage_seconds", t1 - t0, stage="preprocess")
+        observe("letter_stage_seconds", t2 - t1, stage="classify")
+        observe("letter_stage_seconds", t3 - t2, stage="extract")
+        observe("letter_stage_seconds", t4 - t3, stage="urgency")
+        observe("letter_stage_seconds", t5 - t4, stage="priority")
+        observe("letter_stage_seconds", t6 - t5, stage="prompt_budget")
+        metrics.inc("letters_total", category=category)
+        metrics.inc("letters_urgency_total", urgency=urgency)
 
     return {
+        "cleaned": cleaned,
+        # текст письма для промптов: cleaned или его сжатая версия (см. fit_prompt_text)
+        "prompt_text": prompt_text,
+        "prompt_stats": prompt_stats,
         "category": category,
         "info": info,
+        "entities": entities,
         "urgency": urgency,
+        "priority": priority_info,
+    }
+
+
+def analyze_letters(texts: Iterable[str]) -> Iterator[dict]:
+    """analyze_letter для списка или потока писем с общей датой отсчёта сроков."""
+    today = datetime.now()
+    for text in texts:
+        yield analyze_letter(text, today=today)
+
+
+def _build_result(analysis: dict, summary: str, response: str, errors: dict) -> dict:
+    return {
+        "category": analysis["category"],
+        "info": analysis["info"],
+        "urgency": analysis["urgency"],
         "summary": summary,
         "response": response,
-        "priority": priority_info,
+        "priority": analysis["priority"],
+        "prompt_stats": analysis.get("prompt_stats"),
+        "route": analysis.get("route"),
+        "errors": errors,
     }
+
+
+def route_letter(analysis: dict, route: str | None = None) -> str:
+    """
+    Выбирает маршрут письма ("llm" или "template") через letter_router и запоминает
+    решение в analysis["route"]. route — явный выбор из запроса ("llm"/"template"),
+    None или "auto" — решает роутер по категории, приоритету и нагрузке.
+    """
+    decision, reason = letter_router.decide(
+        analysis["category"], analysis["priority"]["final_priority"], route
+    )
+    analysis["route"] = {"route": decision, "reason": reason}
+    metrics.inc("letters_route_total", route=decision, reason=reason)
+    return decision
+
+
+def _template_result(analysis: dict, tone: str | None, answer_length: str | None) -> dict:
+    summary = extractive_summary(analysis["cleaned"])
+    response = render_template_reply(analysis["category"], analysis["info"], tone, answer_length)
+    return _build_result(analysis, summary, response, {})
+
+
+def _submit_llm_stages(
+    analysis: dict,
+    tone: str | None,
+    answer_length: str | None,
+    use_cache: bool = True,
+    llm_mode: str | None = None,
+    deadline: float | None = None,
+):
+    # info дальше не меняется, поэтому его можно спокойно отдать в другой поток
+    if _resolve_llm_mode(llm_mode) == "combined":
+        # один вызов на оба поля: одна и та же future для резюме и ответа
+        future = llm_executor.submit(
+            summarize_and_respond,
+            analysis["prompt_text"],
+            analysis["category"],
+            analysis["info"],
+            tone=tone,
+            answer_length=answer_length,
+            use_cache=use_cache,
+            deadline=deadline,
+        )
+        llm_load.track(future)
+        return future, future
+
+    summary_future = llm_executor.submit(
+        summarize_letter, analysis["prompt_text"], use_cache=use_cache, deadline=deadline
+    )
+    response_future = llm_executor.submit(
+        generate_response_with_tone,
+        analysis["prompt_text"],
+        analysis["category"],
+        analysis["info"],
+        tone=tone,
+        answer_length=answer_length,
+        use_cache=use_cache,
+        deadline=deadline,
+    )
+    llm_load.track(summary_future)
+    llm_load.track(response_future)
+    return summary_future, response_future
+
+
+# поля info, которые подставляются в ответ почти-дубликата; остальные должны совпадать
+_PATCHABLE_FIELDS = ("document_number", "deadline_date", "deadline_date_estimated", "amount", "sender_company")
+
+
+def _can_reuse(old_info: dict, new_info: dict) -> bool:
+    """Ответ письма с old_info подходит письму с new_info: те же поля, расходятся только подставляемые."""
+    if old_info.keys() != new_info.keys():
+        return False
+    return all(
+        old_info[k] == new_info[k] for k in old_info if k not in _PATCHABLE_FIELDS
+    )
+
+
+# Граница факта в тексте: вплотную не стоят буквы и цифры, в том числе через разделитель
+# («9» не совпадает внутри «19.03.2025» и «№ 9/1»). У сумм ещё и разряд через пробел
+# («900» внутри «1 900»).
+_FACT_BEFORE = r"(?<!\w)(?<!\w[.,/\-])"
+_FACT_AFTER = r"(?!\w|[.,/\-]\w)"
+_AMOUNT_BEFORE = r"(?<!\d[\s\u00a0])"
+_AMOUNT_AFTER = r"(?![\s\u00a0]\d)"
+
+
+def _fact_body(field: str, value: str) -> str:
+    if field == "amount":
+        # суммы — с любой разбивкой на разряды
+        return r"[\s\u00a0]?".join(re.escape(d) for d in value)
+    return re.escape(value)
+
+
+def _patch_facts(text: str, old_info: dict, new_info: dict) -> str | None:
+    """
+    Заменяет в тексте факты старого письма на факты нового — только целыми токенами.
+    None — подставлять небезопасно: старое значение встречается больше одного раза
+    или внутри другого токена (тогда на письмо отвечаем сами, а не правкой чужого ответа).
+    """
+    replacements: dict[str, str] = {}
+    patterns = []
+    for field in _PATCHABLE_FIELDS:
+        old, new = old_info.get(field), new_info.get(field)
+        if not old or old == new:
+            continue
+        body = _fact_body(field, old)
+        before, after = _FACT_BEFORE, _FACT_AFTER
+        if field == "amount":
+            before, after = before + _AMOUNT_BEFORE, after + _AMOUNT_AFTER
+        anchored = len(re.findall(f"{before}{body}{after}", text))
+        if anchored > 1 or len(re.findall(body, text)) != anchored:
+            return None
+        group = f"f{len(patterns)}"
+        replacements[group] = new
+        patterns.append(f"(?P<{group}>{before}{body}{after})")
+    if not patterns:
+        return text
+    # одним проходом: подставленное значение не может совпасть со следующим старым
+    return re.sub("|".join(patterns), lambda m: replacements[m.lastgroup], text)
+
+
+def _pair_future(summary_future, response_future) -> Future:
+    """Future пары (резюме, ответ), готовая, когда готовы обе части."""
+    pair = Future()
+
+    def on_done(_):
+        if not (summary_future.done() and response_future.done()):
+            return
+        try:
+            if summary_future is response_future:
+                result = summary_future.result()
+            else:
+                result = (summary_future.result(), response_future.result())
+        except Exception as e:
+            result = e
+        try:
+            if isinstance(result, Exception):
+                pair.set_exception(result)
+            else:
+                pair.set_result(result)
+        except InvalidStateError:
+            pass  # вторая часть завершилась одновременно, пара уже заполнена
+
+    summary_future.add_done_callback(on_done)
+    if response_future is not summary_future:
+        response_future.add_done_callback(on_done)
+    return pair
+
+
+def _copy_future(source: Future, target: Future) -> None:
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _leader_ok(pair: Future) -> bool:
+    # ошибки модели приходят исключением (LLMCallError), а не текстом-заглушкой
+    return pair.exception() is None
+
+
+def _submit_or_reuse(
+    analysis: dict,
+    tone: str | None,
+    answer_length: str | None,
+    use_cache: bool = True,
+    llm_mode: str | None = None,
+    deadline: float | None = None,
+):
+    """
+    _submit_llm_stages с переиспользованием ответа почти-дубликата.
+
+    Письмо, для которого похожего нет, становится «ведущим»: его LLM-вызовы уходят
+    в пул, а пара (резюме, ответ) сразу регистрируется в near_duplicates — похожие письма,
+    пришедшие до завершения, ждут её, а не зовут модель сами. Волна одинаковых писем
+    стоит один LLM-вызов. Если у ведущего ошибка, запись удаляется, а ждавшие
+    письма делают свои вызовы. use_cache=False — без переиспользования.
+    """
+    params = (tone, answer_length or "medium")
+    text = analysis["cleaned"]
+    info = analysis["info"]
+
+    hit = None
+    if use_cache and NEAR_DUP_THRESHOLD > 0:
+        hit = near_duplicates.lookup(text, params, accept=lambda value: _can_reuse(value[0], info))
+    if hit is not None:
+        (leader_info, leader_pair), similarity = hit
+        analysis["route"] = {"route": "duplicate", "reason": "near_duplicate", "similarity": similarity}
+        follower = Future()
+
+        def answer_ourselves() -> None:
+            own = _pair_future(*_submit_llm_stages(
+                analysis, tone, answer_length, False, llm_mode, deadline
+            ))
+            own.add_done_callback(lambda f: _copy_future(f, follower))
+
+        def on_leader(pair: Future) -> None:
+            if not _leader_ok(pair):
+                # ведущий не справился — отвечаем на это письмо сами
+                answer_ourselves()
+                return
+            summary, response = pair.result()
+            summary = _patch_facts(summary, leader_info, info)
+            response = _patch_facts(response, leader_info, info)
+            if summary is None or response is None:
+                # факты ведущего нельзя однозначно заменить в его ответе
+                analysis["route"] = {"route": "llm", "reason": "near_duplicate_unpatchable"}
+                metrics.inc("letters_route_total", route="llm", reason="near_duplicate_unpatchable")
+                answer_ourselves()
+                return
+            near_duplicates.record_hit()
+            metrics.inc("letters_route_total", route="duplicate", reason="near_duplicate")
+            follower.set_result((summary, response))
+
+        leader_pair.add_done_callback(on_leader)
+        return follower, follower
+
+    summary_future, response_future = _submit_llm_stages(
+        analysis, tone, answer_length, use_cache, llm_mode, deadline
+    )
+    if NEAR_DUP_THRESHOLD > 0:
+        pair = _pair_future(summary_future, response_future)
+        entry_id = near_duplicates.add(text, (info, pair), params)
+        pair.add_done_callback(lambda f: None if _leader_ok(f) else near_duplicates.discard(entry_id))
+    return summary_future, response_future
+
+
+def _build_pair_result(analysis: dict, pair: tuple[str, str] | None, errors: dict) -> dict:
+    """Результат режима "combined": один вызов — одна ошибка на обе половины."""
+    if pair is None:
+        errors["summary"] = errors["response"]
+        pair = (SUMMARY_FAILED, RESPONSE_FAILED)
+    return _build_result(analysis, pair[0], pair[1], errors)
+
+
+def _join_llm_stages(analysis: dict, summary_future, response_future, deadline: float | None) -> dict:
+    errors: dict = {}
+    if summary_future is response_future:
+        pair = _wait_llm_result(response_future, deadline, "response", errors, None)
+        return _build_pair_result(analysis, pair, errors)
+
+    summary = _wait_llm_result(summary_future, deadline, "summary", errors, SUMMARY_FAILED)
+    response = _wait_llm_result(response_future, deadline, "response", errors, RESPONSE_FAILED)
+    return _build_result(analysis, summary, response, errors)
+
+
+def _run_llm_stage(call, what: str, errors: dict, fallback: str) -> str:
+    """Последовательный (без пула) LLM-вызов: при ошибке — fallback и описание в errors[what]."""
+    try:
+        return call()
+    except Exception as e:
+        errors[what] = describe_error(e)
+        return fallback
+
+
+def _deadline(timeout: float | None) -> float | None:
+    if timeout is None:
+        timeout = LLM_CALL_TIMEOUT
+    return time.monotonic() + timeout if timeout and timeout > 0 else None
+
+
+def complete_letter(
+    analysis: dict,
+    tone: str | None = None,
+    answer_length: str | None = None,
+    use_cache: bool = True,
+    timeout: float | None = None,
+    llm_mode: str | None = None,
+    route: str | None = None,
+) -> dict:
+    """
+    LLM-часть пайплайна для уже посчитанного analyze_letter: резюме и ответ
+    параллельно в llm_executor (или одним вызовом при llm_mode="combined").
+    Нужна, когда правила считаются заранее (например, чтобы по приоритету
+    поставить письмо в очередь). Если роутер выбрал шаблон (route_letter),
+    модель не вызывается.
+    """
+    if route_letter(analysis, route) == "template":
+        return _template_result(analysis, tone, answer_length)
+
+    deadline = _deadline(timeout)
+    summary_future, response_future = _submit_or_reuse(
+        analysis, tone, answer_length, use_cache, llm_mode, deadline
+    )
+    return _join_llm_stages(analysis, summary_future, response_future, deadline)
+
+
+def process_letter(
+    text: str,
+    tone: str | None = None,
+    sender_company: str | None = None,
+    answer_length: str | None = None,
+    parallel: bool = True,
+    timeout: float | None = None,
+    use_cache: bool = True,
+    llm_mode: str | None = None,
+    route: str | None = None,
+) -> dict:
+    """
+    Главный хелпер: принимает текст письма (и, опционально, компанию-отправителя и длину ответа).
+    Возвращает всё, что нужно фронту.
+
+    parallel=True — резюме и ответ запрашиваются у модели одновременно через общий пул
+    llm_executor (они не зависят друг от друга), timeout — ограничение на каждый вызов
+    в секундах (по умолчанию LLM_CALL_TIMEOUT): это дедлайн, в который укладываются и повторы
+    временных ошибок (llm_caller). Если один из вызовов упал или не успел, остальной
+    результат всё равно возвращается, а в поле "errors" попадает структурированная ошибка
+    {"code", "message", "retryable", "attempts"}.
+
+    use_cache=False — не брать резюме и ответ из llm_cache (например, «Перегенерировать»),
+    свежий результат при этом заменит закэшированный.
+
+    llm_mode — "separate" (два вызова модели) или "combined" (один вызов, резюме и ответ
+    в JSON; при невалидном JSON — откат на два вызова). По умолчанию LLM_MODE.
+
+    route — "llm" / "template" / None ("auto"): нужен ли модели этот конкретный ответ.
+    По умолчанию решает letter_router: малоценные категории и (при перегрузке модели)
+    письма с низким приоритетом получают шаблонный ответ без LLM.
+    """
+    analysis = analyze_letter(text, sender_company)
+
+    if parallel:
+        return complete_letter(analysis, tone, answer_length, use_cache, timeout, llm_mode, route)
+
+    if route_letter(analysis, route) == "template":
+        return _template_result(analysis, tone, answer_length)
+
+    deadline = _deadline(timeout)
+    errors: dict = {}
+    if _resolve_llm_mode(llm_mode) == "combined":
+        pair = _run_llm_stage(
+            lambda: summarize_and_respond(
+                analysis["prompt_text"],
+                analysis["category"],
+                analysis["info"],
+                tone=tone,
+                answer_length=answer_length,
+                use_cache=use_cache,
+                deadline=deadline,
+            ),
+            "response", errors, None,
+        )
+        return _build_pair_result(analysis, pair, errors)
+
+    summary = _run_llm_stage(
+        lambda: summarize_letter(analysis["prompt_text"], use_cache=use_cache, deadline=deadline),
+        "summary", errors, SUMMARY_FAILED,
+    )
+    response = _run_llm_stage(
+        lambda: generate_response_with_tone(
+            analysis["prompt_text"],
+            analysis["category"],
+            analysis["info"],
+            tone=tone,
+            answer_length=answer_length,
+            use_cache=use_cache,
+            deadline=deadline,
+        ),
+        "response", errors, RESPONSE_FAILED,
+    )
+    return _build_result(analysis, summary, response, errors)
+
+
+def process_letter_variants(
+    text: str,
+    variants: list[dict] | None = None,
+    answer_length: str | None = None,
+    sender_company: str | None = None,
+    timeout: float | None = None,
+    use_cache: bool = True,
+    route: str | None = None,
+) -> dict:
+    """
+    Несколько вариантов ответа на одно письмо, например для сравнения тонов.
+    variants — [{"tone"?, "length"?}, ...], по умолчанию — все тона TONE_INSTRUCTIONS;
+    answer_length — длина для вариантов без "length" (по умолчанию "medium").
+
+    Правила и резюме считаются один раз, ответы всех вариантов запрашиваются у модели
+    параллельно в llm_executor — по времени это примерно один вызов. Промпты вариантов
+    отличаются только хвостом (build_variant_instructions), общий префикс с письмом
+    провайдер может взять из кэша.
+
+    Результат — как у process_letter (в "response" — первый удавшийся вариант) плюс
+    "variants": [{"tone", "length", "response", "error"?}, ...]; ошибка одного
+    варианта не мешает остальным.
+    """
+    if not variants:
+        variants = [{"tone": tone} for tone in TONE_INSTRUCTIONS]
+    variants = [
+        {"tone": v.get("tone"), "length": v.get("length") or answer_length or "medium"} for v in variants
+    ]
+    analysis = analyze_letter(text, sender_company)
+
+    if route_letter(analysis, route) == "template":
+        results = [
+            {**v, "response": render_template_reply(analysis["category"], analysis["info"], v["tone"], v["length"])}
+            for v in variants
+        ]
+        result = _build_result(analysis, extractive_summary(analysis["cleaned"]), results[0]["response"], {})
+        result["variants"] = results
+        return result
+
+    deadline = _deadline(timeout)
+    summary_future = llm_executor.submit(
+        summarize_letter, analysis["prompt_text"], use_cache=use_cache, deadline=deadline
+    )
+    response_futures = [
+        llm_executor.submit(
+            generate_response_with_tone,
+            analysis["prompt_text"],
+            analysis["category"],
+            analysis["info"],
+            tone=v["tone"],
+            answer_length=v["length"],
+            use_cache=use_cache,
+            deadline=deadline,
+        )
+        for v in variants
+    ]
+    for future in (summary_future, *response_futures):
+        llm_load.track(future)
+
+    errors: dict = {}
+    summary = _wait_llm_result(summary_future, deadline, "summary", errors, SUMMARY_FAILED)
+    results = []
+    for v, future in zip(variants, response_futures):
+        variant_errors: dict = {}
+        response = _wait_llm_result(future, deadline, "response", variant_errors, RESPONSE_FAILED)
+        results.append({**v, "response": response, **({"error": variant_errors["response"]} if variant_errors else {})})
+    # основной ответ — первый удавшийся вариант; ошибка ответа — только если не удался ни один
+    main = next((r for r in results if "error" not in r), None)
+    if main is None:
+        main = results[0]
+        errors["response"] = main["error"]
+
+    result = _build_result(analysis, summary, main["response"], errors)
+    result["variants"] = results
+    return result
+
+
+def process_batch(
+    letters: list[dict],
+    max_concurrency: int | None = None,
+    timeout: float | None = None,
+) -> Iterator[tuple[int, dict]]:
+    """
+    Пакетная обработка писем. letters — список словарей
+    {"text", "tone"?, "length"?, "sender_company"?, "use_cache"?, "llm_mode"?, "route"?}.
+
+    Сначала за один проход считаются правила для всего батча, затем LLM-вызовы
+    раздаются в общий пул llm_executor так, чтобы одновременно у модели было
+    не больше max_concurrency писем (по умолчанию BATCH_MAX_CONCURRENCY).
+    Генератор отдаёт пары (индекс письма, результат) по мере готовности —
+    порядок восстанавливается по индексу. timeout — как в process_letter,
+    отсчитывается с момента отправки письма в модель.
+    """
+    if not max_concurrency or max_concurrency <= 0:
+        max_concurrency = BATCH_MAX_CONCURRENCY
+
+    today = datetime.now()
+    analyses = [
+        analyze_letter(letter.get("text", ""), letter.get("sender_company"), today)
+        for letter in letters
+    ]
+
+    pending = deque(range(len(letters)))
+    # индекс письма -> (future резюме, future ответа, дедлайн)
+    in_flight: dict[int, tuple] = {}
+
+    while pending or in_flight:
+        while pending and len(in_flight) < max_concurrency:
+            i = pending.popleft()
+            letter = letters[i]
+            # шаблонные ответы не занимают слоты модели и отдаются сразу
+            if route_letter(analyses[i], letter.get("route")) == "template":
+                yield i, _template_result(analyses[i], letter.get("tone"), letter.get("length"))
+                continue
+            deadline = _deadline(timeout)
+            summary_future, response_future = _submit_or_reuse(
+                analyses[i],
+                letter.get("tone"),
+                letter.get("length"),
+                letter.get("use_cache", True),
+                letter.get("llm_mode"),
+                deadline,
+            )
+            in_flight[i] = (summary_future, response_future, deadline)
+
+        not_done = [f for sf, rf, _ in in_flight.values() for f in (sf, rf) if not f.done()]
+        deadlines = [d for _, _, d in in_flight.values() if d is not None]
+        if not_done:
+            wait_timeout = None
+            if deadlines:
+                wait_timeout = max(0.0, min(deadlines) - time.monotonic())
+            wait(not_done, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+        now = time.monotonic()
+        for i, (summary_future, response_future, deadline) in list(in_flight.items()):
+            finished = summary_future.done() and response_future.done()
+            expired = deadline is not None and now >= deadline
+            if finished or expired:
+                del in_flight[i]
+                yield i, _join_llm_stages(analyses[i], summary_future, response_future, deadline)
+
+
+async def _await_llm_result(coro, deadline: float | None, what: str, errors: dict, fallback: str) -> str:
+    """Асинхронный аналог _wait_llm_result: ждёт вызов до общего дедлайна, иначе fallback."""
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        errors[what] = LLMCallError("timeout", "Истёк дедлайн запроса", True, 0).to_dict()
+    except Exception as e:
+        errors[what] = describe_error(e)
+    return fallback
+
+
+async def process_letter_async(
+    text: str,
+    tone: str | None = None,
+    sender_company: str | None = None,
+    answer_length: str | None = None,
+    timeout: float | None = None,
+    use_cache: bool = True,
+    llm_mode: str | None = None,
+    route: str | None = None,
+) -> dict:
+    """
+    Асинхронный вариант process_letter на AsyncOpenAI.
+    Правила (классификация, факты, срочность, приоритет) выполняются синхронно прямо здесь,
+    оба LLM-вызова идут конкурентно в текущем event loop. Формат результата тот же.
+    """
+    analysis = analyze_letter(text, sender_company)
+    if route_letter(analysis, route) == "template":
+        return _template_result(analysis, tone, answer_length)
+
+    prompt_text = analysis["prompt_text"]
+    errors: dict = {}
+    deadline = _deadline(timeout)
+
+    if _resolve_llm_mode(llm_mode) == "combined":
+        pair = await _await_llm_result(
+            summarize_and_respond_async(
+                prompt_text,
+                analysis["category"],
+                analysis["info"],
+                tone=tone,
+                answer_length=answer_length,
+                use_cache=use_cache,
+                deadline=deadline,
+            ),
+            deadline, "response", errors, None,
+        )
+        return _build_pair_result(analysis, pair, errors)
+
+    summary, response = await asyncio.gather(
+        _await_llm_result(
+            summarize_letter_async(prompt_text, use_cache=use_cache, deadline=deadline),
+            deadline, "summary", errors,
+            SUMMARY_FAILED,
+        ),
+        _await_llm_result(
+            generate_response_with_tone_async(
+                prompt_text,
+                analysis["category"],
+                analysis["info"],
+                tone=tone,
+                answer_length=answer_length,
+                use_cache=use_cache,
+                deadline=deadline,
+            ),
+            deadline, "response", errors,
+            RESPONSE_FAILED,
+        ),
+    )
+
+    return _build_result(analysis, summary, response, errors)
+
+
+def process_letter_stream(
+    text: str,
+    tone: str | None = None,
+    sender_company: str | None = None,
+    answer_length: str | None = None,
+    use_cache: bool = True,
+    route: str | None = None,
+) -> Iterator[tuple[str, dict]]:
+    """
+    Потоковый пайплайн для SSE. Отдаёт пары (событие, данные):
+    - ("meta", {...}) — сразу после правил: категория, факты, срочность, приоритет;
+    - ("delta", {"text"}) — очередной кусок ответа модели;
+    - ("summary", {"summary"}) — резюме (считается параллельно в llm_executor);
+    - ("done", {"response", "errors"}) — в конце; ("error", {"error", "code", "retryable"}) —
+      если ответ не получен.
+    Шаблонный ответ (route_letter) приходит одним delta.
+    """
+    analysis = analyze_letter(text, sender_company)
+    prompt_text = analysis["prompt_text"]
+    template = route_letter(analysis, route) == "template"
+
+    meta = {
+        "classification": analysis["category"],
+        "extractedInfo": analysis["info"],
+        "urgency": analysis["urgency"],
+        "priority": analysis["priority"],
+        "route": analysis["route"],
+    }
+
+    if template:
+        result = _template_result(analysis, tone, answer_length)
+        yield "meta", meta
+        yield "delta", {"text": result["response"]}
+        yield "summary", {"summary": result["summary"]}
+        yield "done", {"response": result["response"], "errors": {}}
+        return
+
+    deadline = _deadline(None)
+    summary_future = llm_executor.submit(
+        summarize_letter, prompt_text, use_cache=use_cache, deadline=deadline
+    )
+    llm_load.track(summary_future)
+
+    yield "meta", meta
+
+    summary_sent = False
+    parts: list[str] = []
+    errors: dict = {}
+    try:
+        for delta in stream_response_with_tone(
+            prompt_text,
+            analysis["category"],
+            analysis["info"],
+            tone=tone,
+            answer_length=answer_length,
+            use_cache=use_cache,
+            deadline=deadline,
+        ):
+            parts.append(delta)
+            yield "delta", {"text": delta}
+            # резюме отправляем, как только оно готово, не дожидаясь конца ответа
+            if not summary_sent and summary_future.done():
+                summary_sent = True
+                yield "summary", {"summary": _wait_llm_result(
+                    summary_future, None, "summary", errors,
+                    SUMMARY_FAILED,
+                )}
+    except Exception as e:
+        errors["response"] = describe_error(e)
+        yield "error", {
+            "error": f"{RESPONSE_FAILED} {errors['response']['message']}",
+            "code": errors["response"]["code"],
+            "retryable": errors["response"]["retryable"],
+        }
+
+    if not summary_sent:
+        yield "summary", {"summary": _wait_llm_result(
+            summary_future, deadline, "summary", errors,
+            SUMMARY_FAILED,
+        )}
+
+    yield "done", {"response": "".join(parts).strip(), "errors": errors}
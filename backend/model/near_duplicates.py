@@ -0,0 +1,192 @@
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 61) - 1
+
+# цифры маскируются: письма одной волны отличаются номерами договоров, датами и суммами
+_DIGITS_RE = re.compile(r"\d+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def _choose_rows(num_perm: int, threshold: float) -> int:
+    """
+    Число строк в полосе LSH. Пара с похожестью s становится кандидатом с вероятностью
+    1 - (1 - s^r)^b; её «порог» ≈ (1/b)^(1/r). Берём самый строгий вариант, порог которого
+    ещё заметно ниже threshold, чтобы письма около порога почти наверняка нашлись.
+    """
+    best = 1
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold - 0.1:
+            best = rows
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    Индекс недавних писем для поиска почти-дубликатов (MinHash + LSH).
+
+    Текст приводится к нижнему регистру, цифры маскируются, по словам строятся шинглы
+    (по shingle_size слов), от них — MinHash-подпись из num_perm значений. Подпись
+    режется на полосы; письма с совпавшей полосой — кандидаты, среди них выбирается
+    самое похожее с оценкой Жаккара не ниже threshold.
+
+    Хранится не больше max_items писем не дольше ttl секунд (вытесняются самые старые),
+    память — O(max_items * num_perm). params — то, что должно совпадать у письма-дубликата
+    помимо текста (тон, длина ответа): письма с разными params не сравниваются.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = 64,
+        shingle_size: int = 3,
+        max_items: int = 5000,
+        ttl: float = 3600.0,
+        seed: int = 1,
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.max_items = max_items
+        self.ttl = ttl
+        self.rows = _choose_rows(num_perm, threshold)
+        self.bands = num_perm // self.rows
+
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+        # id -> (подпись, params, значение, время добавления, ключи полос)
+        self._entries: OrderedDict[int, tuple] = OrderedDict()
+        self._buckets: dict[tuple, set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "added": 0, "evictions": 0, "expired": 0}
+
+    # ---------- подписи ----------
+
+    def _shingles(self, text: str) -> set[str]:
+        words = _WORD_RE.findall(_DIGITS_RE.sub("0", text.lower()))
+        k = self.shingle_size
+        if len(words) <= k:
+            return {" ".join(words)} if words else set()
+        return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+    def signature(self, text: str) -> tuple[int, ...] | None:
+        shingles = self._shingles(text)
+        if not shingles:
+            return None
+        hashes = [hash(s) & _MAX_HASH for s in shingles]
+        p = _MERSENNE_PRIME
+        return tuple(min((a * h + b) % p for h in hashes) for a, b in self._perms)
+
+    def _band_keys(self, signature: tuple[int, ...], params) -> list[tuple]:
+        r = self.rows
+        return [(params, i, signature[i * r:(i + 1) * r]) for i in range(self.bands)]
+
+    @staticmethod
+    def similarity(sig_a: tuple[int, ...], sig_b: tuple[int, ...]) -> float:
+        """Оценка коэффициента Жаккара по доле совпавших позиций подписи."""
+        return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+    # ---------- поиск и добавление ----------
+
+    def lookup(
+        self, text: str, params=None, accept: Callable[[object], bool] | None = None
+    ) -> tuple[object, float] | None:
+        """
+        (значение самого похожего письма, похожесть) или None.
+        accept(value) — отсеивает кандидатов, чей ответ нельзя переиспользовать.
+        Попадание не засчитывается: это делает record_hit, когда ответ действительно отдан.
+        """
+        signature = self.signature(text)
+        now = time.monotonic()
+        with self._lock:
+            self._stats["lookups"] += 1
+            if signature is None:
+                return None
+            self._expire(now)
+
+            candidates: set[int] = set()
+            for key in self._band_keys(signature, params):
+                candidates |= self._buckets.get(key, set())
+
+            best = None
+            best_similarity = self.threshold
+            for entry_id in candidates:
+                entry_signature, _, value, _, _ = self._entries[entry_id]
+                sim = self.similarity(signature, entry_signature)
+                if sim >= best_similarity and (accept is None or accept(value)):
+                    best, best_similarity = value, sim
+            if best is None:
+                return None
+            return best, round(best_similarity, 3)
+
+    def record_hit(self) -> None:
+        """Ответ найденного письма переиспользован (для hits / hit_rate)."""
+        with self._lock:
+            self._stats["hits"] += 1
+
+    def add(self, text: str, value, params=None) -> int | None:
+        """Добавляет письмо; возвращает id записи (для discard) или None для пустого текста."""
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        keys = self._band_keys(signature, params)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (signature, params, value, time.monotonic(), keys)
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            self._stats["added"] += 1
+            while len(self._entries) > self.max_items:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+        return entry_id
+
+    def discard(self, entry_id: int | None) -> None:
+        if entry_id is None:
+            return
+        with self._lock:
+            if entry_id in self._entries:
+                self._remove(entry_id)
+
+    def _remove(self, entry_id: int) -> None:
+        # вызывается под self._lock
+        _, _, _, _, keys = self._entries.pop(entry_id)
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def _expire(self, now: float) -> None:
+        # записи идут в порядке добавления: просроченные — в начале
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if now - entry[3] <= self.ttl:
+                break
+            self._remove(entry_id)
+            self._stats["expired"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["items"] = len(self._entries)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["threshold"] = self.threshold
+        stats["bands"] = self.bands
+        stats["rows"] = self.rows
+        return stats
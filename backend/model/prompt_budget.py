@@ -0,0 +1,203 @@
+import math
+import re
+from bisect import bisect_left
+from typing import NamedTuple
+
+# Грубая локальная оценка: русский текст у токенизаторов LLM — примерно 3–4 символа
+# на токен. Берём нижнюю границу, чтобы оценка была с запасом (лучше недобрать бюджет).
+CHARS_PER_TOKEN = 3.0
+
+# сколько предложений начала и конца письма сохраняется всегда (обращение, суть, подпись)
+OPENING_SENTENCES = 3
+CLOSING_SENTENCES = 2
+
+GAP_MARKER = "[…]"
+
+# строка не длиннее этого считается одной служебной строкой (подпись, адрес, реквизиты)
+BOILERPLATE_LINE_CHARS = 160
+
+# граница предложения внутри строки: знак конца + пробел + заглавная буква / цифра / кавычка
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?…])\s+(?=[«\"(]?[A-ZА-ЯЁ0-9№])")
+
+# Служебные строки: контакты, адреса, реквизиты, ссылки. Короткая строка проверяется целиком
+# (адрес «г. Москва, ул. …» иначе рассыпается на «предложения»), длинная — по предложениям.
+# Поэтому лучше передавать текст с исходными переводами строк (до preprocess_text).
+_BOILERPLATE_RE = re.compile(
+    r"(?i:"
+    r"\b(?:тел|телефон|факс|моб)\b\.?\s*:?"
+    r"|\+7[\s(\-]*\d"
+    r"|\b8\s*\(\d{3}\)"
+    r"|[\w.+\-]+@[\w\-]+\.[\w.]+"
+    r"|https?://|www\."
+    r"|\bадрес\b"
+    r"|\b\d{6},"
+    r"|\b(?:ул|пр-т|просп|пер|корп|стр|оф)\.\s*\S"
+    r"|\b(?:инн|кпп|огрн|огрнип|бик|окпо|р/с|к/с)\b"
+    r")"
+)
+
+
+# начало подписи: всё после неё — подпись, а «конец письма» ищется до неё
+_SIGNATURE_RE = re.compile(r"(?i)^(?:с уважением|с наилучшими пожеланиями|искренне ваш)")
+
+
+class _Unit(NamedTuple):
+    text: str
+    start: int       # спан в тексте после preprocess_text (как у сущностей)
+    end: int
+    line: int
+    paragraph: int
+    boilerplate: bool
+
+
+def estimate_tokens(text: str, chars_per_token: float = CHARS_PER_TOKEN) -> int:
+    """Оценка числа токенов без токенизатора: по длине текста."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / chars_per_token)
+
+
+def _split_units(text: str) -> list[_Unit]:
+    """
+    Предложения письма с разметкой строк и абзацев. Смещения считаются в тексте,
+    каким его делает preprocess_text (строки склеены через один пробел),
+    чтобы с ними можно было сопоставлять спаны сущностей.
+    """
+    units: list[_Unit] = []
+    offset = 0
+    line_no = 0
+    paragraph = 0
+    blank = False
+    for raw_line in text.splitlines():
+        words = raw_line.split()
+        if not words:
+            blank = True
+            continue
+        if blank and units:
+            paragraph += 1
+        blank = False
+
+        line = " ".join(words)
+        short_boilerplate = (
+            len(line) <= BOILERPLATE_LINE_CHARS and _BOILERPLATE_RE.search(line) is not None
+        )
+        bounds = [0]
+        for m in _SENTENCE_BREAK_RE.finditer(line):
+            bounds.extend((m.start(), m.end()))
+        bounds.append(len(line))
+        for start, end in zip(bounds[::2], bounds[1::2]):
+            sentence = line[start:end]
+            boilerplate = short_boilerplate or _BOILERPLATE_RE.search(sentence) is not None
+            units.append(_Unit(sentence, offset + start, offset + end, line_no, paragraph, boilerplate))
+
+        offset += len(line) + 1
+        line_no += 1
+    return units
+
+
+def _fact_units(units: list[_Unit], entities: dict | None) -> set[int]:
+    """Индексы предложений, в которые попадает хотя бы одна сущность."""
+    if not entities:
+        return set()
+    starts = [u.start for u in units]
+    facts = set()
+    for found in entities.values():
+        for entity in found:
+            # предложение, внутри которого начинается сущность
+            i = bisect_left(starts, entity.start + 1) - 1
+            if i >= 0:
+                facts.add(i)
+                # сущность может продолжаться в следующих предложениях
+                j = i + 1
+                while j < len(units) and units[j].start < entity.end:
+                    facts.add(j)
+                    j += 1
+    return facts
+
+
+def compress_letter(
+    text: str,
+    entities: dict | None,
+    budget_tokens: int,
+    chars_per_token: float = CHARS_PER_TOKEN,
+) -> tuple[str, dict]:
+    """
+    Сжимает письмо до budget_tokens (по estimate_tokens).
+
+    Служебные строки (адреса, телефоны, почта, реквизиты) выбрасываются, если в них нет
+    фактов. Дальше предложения берутся по очереди: начало и конец письма (последние
+    предложения перед «С уважением» и сама подпись), предложения
+    с сущностями из entities (даты, сроки, номера, суммы, компании), затем остальные —
+    пока помещаются в бюджет. Порядок предложений сохраняется, пропуски помечаются «[…]».
+
+    entities — результат EntityExtractor.extract по preprocess_text(text).
+    Возвращает (сжатый текст, статистика).
+    """
+    units = _split_units(text)
+    original_tokens = estimate_tokens(" ".join(u.text for u in units), chars_per_token)
+    facts = _fact_units(units, entities)
+
+    content = [i for i, u in enumerate(units) if not u.boilerplate or i in facts]
+    signature = next((i for i in content if _SIGNATURE_RE.match(units[i].text)), len(units))
+    body = [i for i in content if i < signature]
+    edges = (
+        body[:OPENING_SENTENCES]
+        + body[-CLOSING_SENTENCES:]
+        + [i for i in content if i >= signature]
+    )
+    order = list(dict.fromkeys(
+        edges
+        + [i for i in content if i in facts]
+        + content
+    ))
+
+    # стоимость с запасом на разделитель и возможную метку пропуска
+    gap_cost = estimate_tokens(f"\n\n{GAP_MARKER}", chars_per_token)
+    kept: set[int] = set()
+    used = 0
+    for i in order:
+        cost = estimate_tokens(units[i].text + "\n\n", chars_per_token) + gap_cost
+        if used + cost <= budget_tokens:
+            kept.add(i)
+            used += cost
+
+    parts: list[str] = []
+    prev = None
+    for i, unit in enumerate(units):
+        if i not in kept:
+            continue
+        if prev is None:
+            if i > 0:
+                parts.append(GAP_MARKER + " ")
+        else:
+            if i != prev + 1:
+                parts.append(" " + GAP_MARKER)
+            if unit.paragraph != units[prev].paragraph:
+                parts.append("\n\n")
+            elif unit.line != units[prev].line:
+                parts.append("\n")
+            else:
+                parts.append(" ")
+        parts.append(unit.text)
+        prev = i
+    if prev is not None and prev != len(units) - 1:
+        parts.append(" " + GAP_MARKER)
+    compressed = "".join(parts)
+
+    if not compressed:
+        # даже первое предложение не влезает — режем по символам
+        limit = max(0, int(budget_tokens * chars_per_token) - len(GAP_MARKER) - 1)
+        compressed = " ".join(text.split())[:limit] + " " + GAP_MARKER
+
+    prompt_tokens = estimate_tokens(compressed, chars_per_token)
+    stats = {
+        "budget_tokens": budget_tokens,
+        "original_tokens": original_tokens,
+        "prompt_tokens": prompt_tokens,
+        "cut_ratio": round(1 - prompt_tokens / original_tokens, 3) if original_tokens else 0.0,
+        "sentences_total": len(units),
+        "sentences_kept": len(kept),
+        "fact_sentences": len(facts),
+        "boilerplate_dropped": sum(1 for i, u in enumerate(units) if u.boilerplate and i not in facts),
+    }
+    return compressed, stats
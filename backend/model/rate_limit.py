@@ -0,0 +1,241 @@
+import asyncio
+import math
+import threading
+import time
+from typing import NamedTuple
+
+
+class LimiterTimeout(Exception):
+    """Лимитер не выдал разрешение до дедлайна запроса (квота или лимит параллельности)."""
+
+
+class TokenBucket:
+    """
+    Ведро токенов на per_minute единиц в минуту (запросы или токены модели).
+    Пополняется непрерывно, вмещает не больше burst. Баланс может уйти в минус:
+    фактический расход становится известен после ответа модели (usage), и перерасход
+    отрабатывается паузой у следующих вызовов. per_minute <= 0 — без ограничения.
+    """
+
+    def __init__(self, per_minute: float, burst: float | None = None):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60
+        self.capacity = burst if burst else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Через сколько секунд в ведре наберётся amount (запрос больше burst ждёт полного ведра)."""
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        need = min(amount, self.capacity) - self.tokens
+        return need / self.rate if need > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        if self.enabled:
+            self.tokens -= amount
+
+    def pause(self, seconds: float, now: float) -> None:
+        """Retry-After от провайдера: ведро пустеет так, чтобы следующий вызов ждал seconds."""
+        if self.enabled:
+            self._refill(now)
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class Permit(NamedTuple):
+    reserved_tokens: int
+    started: float
+
+
+class UpstreamLimiter:
+    """
+    Клиентский лимитер перед каждым вызовом модели, общий для всех потоков процесса.
+
+    - Квоты провайдера: ведро запросов (rpm) и ведро токенов (tpm). Токены резервируются
+      по оценке промпта и ожидаемого ответа, после ответа резерв поправляется по usage.
+    - Параллельность по AIMD: после успешного вызова (если занята хотя бы половина слотов)
+      лимит растёт на 1/limit (то есть на единицу за «окно» вызовов), а при 429 или росте
+      времени ответа выше latency_tolerance × обычное — умножается на backoff_factor
+      (не чаще раза за обычное время вызова, чтобы одна волна ошибок не обнуляла лимит).
+      max_limit <= 0 — параллельность не ограничивается (AIMD выключен).
+
+    Итог: при устойчивой нагрузке поток упирается в квоту, а не в 429.
+    """
+
+    def __init__(
+        self,
+        rpm: float = 0,
+        tpm: float = 0,
+        burst_seconds: float = 2.0,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        backoff_factor: float = 0.7,
+        latency_tolerance: float = 2.0,
+    ):
+        # burst — запас на burst_seconds работы на квоте, чтобы короткие всплески не ждали
+        self.requests = TokenBucket(rpm, rpm * burst_seconds / 60 if rpm > 0 else None)
+        self.tokens = TokenBucket(tpm, tpm * burst_seconds / 60 if tpm > 0 else None)
+        self.adaptive = max_limit > 0
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self._baseline: float | None = None
+        self._samples = 0
+        self._last_decrease = 0.0
+        self._stats = {"acquired": 0, "waited": 0, "timeouts": 0, "throttled": 0, "decreases": 0}
+        self._cond = threading.Condition()
+
+    # ---------- выдача разрешений ----------
+
+    def _try_acquire(self, tokens: int, now: float) -> tuple[Permit | None, float | None]:
+        """(разрешение, None) или (None, сколько ждать; None — до освобождения слота)."""
+        # вызывается под self._cond
+        if self.adaptive and self.in_flight >= math.floor(self.limit):
+            return None, None
+        delay = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if delay > 0:
+            return None, delay
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.in_flight += 1
+        self._stats["acquired"] += 1
+        return Permit(tokens, now), None
+
+    def acquire(self, tokens: int, deadline: float | None = None) -> Permit:
+        """Ждёт разрешения на вызов с оценкой tokens; после дедлайна — LimiterTimeout."""
+        waited = False
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                permit, delay = self._try_acquire(tokens, now)
+                if permit is not None:
+                    self._stats["waited"] += waited
+                    return permit
+                remaining = None if deadline is None else deadline - now
+                if remaining is not None and remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise LimiterTimeout("Квота запросов к модели исчерпана до дедлайна")
+                waited = True
+                timeouts = [t for t in (delay, remaining) if t is not None]
+                self._cond.wait(min(timeouts) if timeouts else None)
+
+    async def acquire_async(self, tokens: int, deadline: float | None = None) -> Permit:
+        """То же для event loop: вместо блокировки потока — короткие asyncio.sleep."""
+        waited = False
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                permit, delay = self._try_acquire(tokens, now)
+                if permit is not None:
+                    self._stats["waited"] += waited
+                    return permit
+                remaining = None if deadline is None else deadline - now
+                if remaining is not None and remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise LimiterTimeout("Квота запросов к модели исчерпана до дедлайна")
+            waited = True
+            # освобождение слота из другого потока event loop не разбудит — опрашиваем
+            sleep = delay if delay is not None else 0.05
+            if remaining is not None:
+                sleep = min(sleep, remaining)
+            await asyncio.sleep(sleep)
+
+    # ---------- результат вызова ----------
+
+    def release(
+        self,
+        permit: Permit,
+        used_tokens: int | None = None,
+        ok: bool = True,
+        throttled: bool = False,
+        retry_after: float | None = None,
+        latency: float | None = None,
+    ) -> None:
+        """
+        Завершение вызова: used_tokens — фактический расход из usage (None — оценка
+        была верной), ok=False — вызов упал, throttled — ответ 429, retry_after — пауза,
+        которую просит провайдер. Прочие ошибки лимит не растят и (если не медленные) не режут.
+        latency — время ответа модели, если оно не равно времени с выдачи разрешения:
+        у потоковых вызовов — время до первого токена, а не длина всего потока.
+        """
+        now = time.monotonic()
+        if latency is None:
+            latency = now - permit.started
+        with self._cond:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                self.tokens.take(used_tokens - permit.reserved_tokens)
+
+            if throttled:
+                self._stats["throttled"] += 1
+                if retry_after:
+                    self.requests.pause(retry_after, now)
+                    self.tokens.pause(retry_after, now)
+                self._decrease(now)
+            elif not self.adaptive:
+                pass
+            elif self._is_slow(latency):
+                self._decrease(now)
+            elif ok and self.in_flight + 1 >= self.limit / 2:
+                # растим, только если лимит реально используется: когда упираемся в квоту
+                # RPM/TPM, а не в параллельность, рост ничего не даст и только раздует лимит
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if ok:
+                # медленные ответы тоже сдвигают «обычное» время: устойчиво медленная модель
+                # со временем перестаёт считаться перегруженной
+                self._observe(latency)
+            self._cond.notify_all()
+
+    def _observe(self, latency: float) -> None:
+        self._samples += 1
+        if self._baseline is None:
+            self._baseline = latency
+        else:
+            self._baseline += 0.05 * (latency - self._baseline)
+
+    def _is_slow(self, latency: float) -> bool:
+        return (
+            self._samples >= 10
+            and self._baseline is not None
+            and latency > self._baseline * self.latency_tolerance
+        )
+
+    def _decrease(self, now: float) -> None:
+        if not self.adaptive:
+            return
+        # не чаще раза за обычное время вызова: ответы одной волны приходят пачкой
+        if now - self._last_decrease < (self._baseline or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.backoff_factor)
+        self._stats["decreases"] += 1
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            self.requests._refill(now)
+            self.tokens._refill(now)
+            return {
+                **self._stats,
+                "limit": round(self.limit, 2) if self.adaptive else None,
+                "in_flight": self.in_flight,
+                "baseline_latency": round(self._baseline or 0.0, 3),
+                "rpm": self.requests.per_minute,
+                "tpm": self.tokens.per_minute,
+                "requests_available": round(self.requests.tokens, 1) if self.requests.enabled else None,
+                "tokens_available": round(self.tokens.tokens, 1) if self.tokens.enabled else None,
+            }
@@ -0,0 +1,303 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+# HTTP-статусы, после которых запрос имеет смысл повторить
+TRANSIENT_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class LLMCallError(Exception):
+    """
+    Вызов модели не удался после всех попыток. Вместо текста-заглушки в ответе
+    вызывающий получает код ошибки: timeout / rate_limited / unavailable / auth /
+    bad_request / internal, признак retryable и число сделанных попыток.
+    """
+
+    def __init__(self, code: str, message: str, retryable: bool = False, attempts: int = 1):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.retryable = retryable
+        self.attempts = attempts
+
+    def to_dict(self) -> dict:
+        return {
+            "code": self.code,
+            "message": self.message,
+            "retryable": self.retryable,
+            "attempts": self.attempts,
+        }
+
+
+def classify_error(e: BaseException) -> tuple[str, bool]:
+    """
+    (код, можно ли повторить) по исключению openai / httpx. Классы openai
+    сравниваются по имени и status_code, чтобы модуль не импортировал openai.
+    """
+    name = type(e).__name__
+    status = getattr(e, "status_code", None)
+    # LimiterTimeout — свой лимитер (rate_limit.py) не дождался квоты: для клиента это 429/503
+    if status == 429 or name in ("RateLimitError", "LimiterTimeout"):
+        return "rate_limited", True
+    if isinstance(e, (TimeoutError, FutureTimeoutError, asyncio.TimeoutError)) or "Timeout" in name:
+        return "timeout", True
+    if status in TRANSIENT_STATUS or (status is not None and status >= 500):
+        return "unavailable", True
+    if "Connect" in name or "RemoteProtocol" in name:
+        return "unavailable", True
+    if status in (401, 403):
+        return "auth", False
+    if status is not None and 400 <= status < 500:
+        return "bad_request", False
+    return "internal", False
+
+
+# HTTP-статус ответа API, если ответ модели так и не получен
+ERROR_HTTP_STATUS = {
+    "timeout": 504,
+    "rate_limited": 503,
+    "unavailable": 503,
+}
+
+
+def error_http_status(error: dict | None) -> int:
+    """Статус для частичного результата: 200, если ответ есть, иначе по коду ошибки (502 по умолчанию)."""
+    if not error:
+        return 200
+    return ERROR_HTTP_STATUS.get(error.get("code"), 502)
+
+
+def describe_error(e: BaseException) -> dict:
+    """Структурированная ошибка для поля errors ответа API."""
+    if isinstance(e, LLMCallError):
+        return e.to_dict()
+    code, retryable = classify_error(e)
+    return {"code": code, "message": f"{type(e).__name__}: {e}", "retryable": retryable, "attempts": 1}
+
+
+class LatencyWindow:
+    """Последние size замеров времени вызова — для p95, после которого шлём хедж."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ResilientCaller:
+    """
+    Обёртка над одной попыткой вызова модели attempt(timeout):
+
+    - дедлайн (time.monotonic()) общий на все попытки; каждая попытка получает
+      оставшееся время как таймаут HTTP-запроса;
+    - временные ошибки (таймаут, 429, 5xx, обрыв соединения) повторяются до max_attempts
+      раз с экспоненциальной паузой и полным джиттером, если после паузы ещё остаётся
+      хотя бы min_attempt_time до дедлайна;
+    - hedge=True: если попытка идёт дольше hedge_quantile наблюдаемого времени этого
+      типа вызова, параллельно отправляется дубликат и берётся первый успешный ответ.
+
+    Итог — результат попытки или LLMCallError.
+    """
+
+    def __init__(
+        self,
+        default_timeout: float,
+        max_attempts: int = 3,
+        base_delay: float = 0.25,
+        max_delay: float = 4.0,
+        min_attempt_time: float = 1.0,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_workers: int = 16,
+        on_retry: Callable[[str, str], None] | None = None,
+        on_hedge: Callable[[str], None] | None = None,
+    ):
+        self.default_timeout = default_timeout
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_attempt_time = min_attempt_time
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_workers = hedge_workers
+        self.on_retry = on_retry
+        self.on_hedge = on_hedge
+
+        self._windows: dict[str, LatencyWindow] = {}
+        self._hedge_pool: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    # ---------- общие части ----------
+
+    def _window(self, kind: str) -> LatencyWindow:
+        window = self._windows.get(kind)
+        if window is None:
+            with self._lock:
+                window = self._windows.setdefault(kind, LatencyWindow())
+        return window
+
+    def hedge_delay(self, kind: str) -> float | None:
+        """Через сколько секунд отправлять дубликат (None — хеджирование выключено / мало данных)."""
+        if not self.hedge:
+            return None
+        return self._window(kind).quantile(self.hedge_quantile)
+
+    def backoff(self, attempt: int) -> float:
+        """Пауза перед попыткой attempt + 1: полный джиттер от 0 до base * 2^attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _resolve_deadline(self, deadline: float | None) -> float:
+        return deadline if deadline is not None else time.monotonic() + self.default_timeout
+
+    def _next_delay(self, kind: str, error: BaseException, attempts: int, deadline: float) -> float:
+        """Пауза перед следующей попыткой или LLMCallError, если повторять нельзя или некогда."""
+        code, retryable = classify_error(error)
+        message = f"{type(error).__name__}: {error}"
+        if not retryable or attempts >= self.max_attempts:
+            raise LLMCallError(code, message, retryable, attempts) from error
+        delay = self.backoff(attempts - 1)
+        if time.monotonic() + delay + self.min_attempt_time > deadline:
+            raise LLMCallError(code, message, retryable, attempts) from error
+        if self.on_retry is not None:
+            self.on_retry(kind, code)
+        return delay
+
+    # ---------- синхронный вызов ----------
+
+    def call(self, kind: str, attempt: Callable[[float], object], deadline: float | None = None,
+             hedge: bool = True):
+        deadline = self._resolve_deadline(deadline)
+        attempts = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMCallError("timeout", "Истёк дедлайн запроса", True, attempts)
+            attempts += 1
+            try:
+                if hedge:
+                    return self._hedged(kind, attempt, deadline)
+                return self._timed(kind, attempt, remaining)
+            except LLMCallError:
+                raise
+            except Exception as e:
+                time.sleep(self._next_delay(kind, e, attempts, deadline))
+
+    def _timed(self, kind: str, attempt: Callable[[float], object], timeout: float):
+        started = time.monotonic()
+        result = attempt(timeout)
+        self._window(kind).observe(time.monotonic() - started)
+        return result
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._hedge_pool is None:
+            with self._lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(
+                        max_workers=self.hedge_workers, thread_name_prefix="llm-hedge"
+                    )
+        return self._hedge_pool
+
+    def _hedged(self, kind: str, attempt: Callable[[float], object], deadline: float):
+        remaining = deadline - time.monotonic()
+        hedge_after = self.hedge_delay(kind)
+        if hedge_after is None or hedge_after >= remaining:
+            return self._timed(kind, attempt, remaining)
+
+        pool = self._pool()
+        first = pool.submit(self._timed, kind, attempt, remaining)
+        done, _ = wait([first], timeout=hedge_after)
+        if done:
+            return first.result()
+
+        if self.on_hedge is not None:
+            self.on_hedge(kind)
+        second = pool.submit(self._timed, kind, attempt, deadline - time.monotonic())
+        pending = {first, second}
+        error: BaseException = FutureTimeoutError()
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    # проигравший запрос дочитается в пуле, его результат не нужен
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    # ---------- асинхронный вызов ----------
+
+    async def call_async(self, kind: str, attempt: Callable[[float], Awaitable], deadline: float | None = None,
+                         hedge: bool = True):
+        deadline = self._resolve_deadline(deadline)
+        attempts = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMCallError("timeout", "Истёк дедлайн запроса", True, attempts)
+            attempts += 1
+            try:
+                if hedge:
+                    return await self._hedged_async(kind, attempt, deadline)
+                return await self._timed_async(kind, attempt, remaining)
+            except LLMCallError:
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._next_delay(kind, e, attempts, deadline))
+
+    async def _timed_async(self, kind: str, attempt: Callable[[float], Awaitable], timeout: float):
+        started = time.monotonic()
+        result = await asyncio.wait_for(attempt(timeout), timeout)
+        self._window(kind).observe(time.monotonic() - started)
+        return result
+
+    async def _hedged_async(self, kind: str, attempt: Callable[[float], Awaitable], deadline: float):
+        remaining = deadline - time.monotonic()
+        hedge_after = self.hedge_delay(kind)
+        if hedge_after is None or hedge_after >= remaining:
+            return await self._timed_async(kind, attempt, remaining)
+
+        first = asyncio.ensure_future(self._timed_async(kind, attempt, remaining))
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        if self.on_hedge is not None:
+            self.on_hedge(kind)
+        second = asyncio.ensure_future(self._timed_async(kind, attempt, deadline - time.monotonic()))
+        pending = {first, second}
+        error: BaseException = asyncio.TimeoutError()
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, deadline - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # в asyncio проигравший запрос можно отменить — соединение вернётся в пул
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,216 @@
+import re
+import threading
+import time
+from collections.abc import Callable
+
+# ---------- шаблонные ответы ----------
+
+TONE_GREETINGS = {
+    "Официальный строгий": "Уважаемый клиент!",
+    "Корпоративный-деловой": "Уважаемый клиент!",
+    "Клиентоориентированный": "Уважаемый клиент, здравствуйте!",
+}
+
+TONE_CLOSINGS = {
+    "Официальный строгий": "С уважением, ПСБ Банк",
+    "Корпоративный-деловой": "С уважением, ПСБ Банк",
+    "Клиентоориентированный": "Благодарим Вас за обращение.\n\nС уважением, ПСБ Банк",
+}
+
+# суть ответа по категории письма; {facts} — номер документа из письма (если есть),
+# {deadline} — срок из письма или «в установленные сроки»
+CATEGORY_TEMPLATES = {
+    "Уведомление или информирование": (
+        "Благодарим Вас за направленную информацию{facts}. "
+        "Уведомление получено и принято к сведению."
+    ),
+    "Запрос информации/документов": (
+        "Ваш запрос{facts} получен и зарегистрирован. "
+        "Запрошенные сведения будут подготовлены и направлены Вам{deadline}."
+    ),
+    "Запрос на согласование": (
+        "Ваш запрос на согласование{facts} получен и передан ответственному подразделению. "
+        "О результатах рассмотрения мы сообщим Вам{deadline}."
+    ),
+    "Партнёрское предложение": (
+        "Благодарим Вас за интерес к сотрудничеству с Банком. "
+        "Ваше предложение{facts} передано профильному подразделению для рассмотрения."
+    ),
+    "Официальная жалоба или претензия": (
+        "Ваше обращение{facts} зарегистрировано. "
+        "Мы проведём проверку изложенных обстоятельств и направим Вам ответ{deadline}."
+    ),
+    "Регуляторный запрос": (
+        "Подтверждаем получение запроса{facts}. "
+        "Ответ будет подготовлен и направлен{deadline}."
+    ),
+}
+DEFAULT_TEMPLATE = (
+    "Благодарим Вас за обращение{facts}. "
+    "Мы ознакомились с ним и при необходимости свяжемся с Вами{deadline}."
+)
+
+LENGTH_EXTRAS = {
+    "short": "",
+    "medium": " Если у Вас появятся дополнительные вопросы, Вы можете направить их ответным письмом.",
+    "long": (
+        " Если у Вас появятся дополнительные вопросы, Вы можете направить их ответным письмом."
+        " При необходимости мы готовы предоставить дополнительные пояснения и документы."
+    ),
+}
+
+
+def render_template_reply(
+    category: str | None,
+    info: dict | None,
+    tone: str | None = None,
+    answer_length: str | None = None,
+) -> str:
+    """Ответ без LLM: шаблон по категории, тону и длине с подстановкой фактов из info."""
+    info = info or {}
+    facts = f" (№{info['document_number']})" if info.get("document_number") else ""
+    deadline_date = info.get("deadline_date") or info.get("deadline_date_estimated")
+    deadline = f" в срок до {deadline_date}" if deadline_date else " в установленные сроки"
+
+    body = CATEGORY_TEMPLATES.get(category, DEFAULT_TEMPLATE).format(facts=facts, deadline=deadline)
+    body += LENGTH_EXTRAS.get(answer_length or "medium", LENGTH_EXTRAS["medium"])
+
+    greeting = TONE_GREETINGS.get(tone, "Уважаемый клиент!")
+    closing = TONE_CLOSINGS.get(tone, "С уважением, ПСБ Банк")
+    return f"{greeting}\n\n{body}\n\n{closing}"
+
+
+# граница предложения: знак конца + пробел + заглавная буква / цифра / кавычка
+# (точки внутри дат вроде 01.12.2025 границей не считаются)
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?…])\s+(?=[«\"(]?[A-ZА-ЯЁ0-9№])")
+
+
+def extractive_summary(text: str, max_sentences: int = 2, max_chars: int = 300) -> str:
+    """Резюме без LLM: первые предложения письма (обрезанные до max_chars)."""
+    sentences = _SENTENCE_BREAK_RE.split((text or "").strip(), maxsplit=max_sentences)
+    summary = " ".join(sentences[:max_sentences])
+    if len(summary) > max_chars:
+        summary = summary[:max_chars].rsplit(" ", 1)[0] + "…"
+    return summary
+
+
+# ---------- нагрузка на модель ----------
+
+class LoadMonitor:
+    """
+    Нагрузка на LLM: скользящее среднее (EWMA) времени вызова и глубина очереди
+    (незавершённые вызовы в пуле + внешние источники, например очередь /jobs).
+
+    degraded() включается, когда среднее время выше latency_limit или очередь длиннее
+    queue_limit, и выключается, только когда обе величины опустятся ниже
+    recover_ratio от порогов (гистерезис, чтобы режим не мигал на границе).
+    Замер старше stale_after секунд не учитывается: в деградации до модели доходит
+    меньше писем, и старое медленное среднее не должно держать режим вечно.
+    """
+
+    def __init__(
+        self,
+        latency_limit: float,
+        queue_limit: int,
+        alpha: float = 0.2,
+        recover_ratio: float = 0.7,
+        stale_after: float = 60.0,
+    ):
+        self.latency_limit = latency_limit
+        self.queue_limit = queue_limit
+        self.alpha = alpha
+        self.recover_ratio = recover_ratio
+        self.stale_after = stale_after
+
+        self._latency: float | None = None
+        self._latency_at = 0.0
+        self._pending = 0
+        self._sources: list[Callable[[], int]] = []
+        self._degraded = False
+        self._lock = threading.Lock()
+
+    def observe_latency(self, seconds: float) -> None:
+        with self._lock:
+            if self._latency is None:
+                self._latency = seconds
+            else:
+                self._latency += self.alpha * (seconds - self._latency)
+            self._latency_at = time.monotonic()
+
+    def track(self, future) -> None:
+        """Учитывает future из пула LLM в глубине очереди до её завершения."""
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(self._untrack)
+
+    def _untrack(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def add_queue_source(self, source: Callable[[], int]) -> None:
+        self._sources.append(source)
+
+    def latency(self) -> float:
+        if self._latency is None or time.monotonic() - self._latency_at > self.stale_after:
+            return 0.0
+        return self._latency
+
+    def queue_depth(self) -> int:
+        return self._pending + sum(source() for source in self._sources)
+
+    def degraded(self) -> bool:
+        latency = self.latency()
+        depth = self.queue_depth()
+        with self._lock:
+            if self._degraded:
+                ratio = self.recover_ratio
+                self._degraded = not (
+                    latency < self.latency_limit * ratio and depth < self.queue_limit * ratio
+                )
+            else:
+                self._degraded = latency > self.latency_limit or depth > self.queue_limit
+            return self._degraded
+
+    def snapshot(self) -> dict:
+        return {
+            "latency_ewma": round(self.latency(), 3),
+            "queue_depth": self.queue_depth(),
+            "degraded": self.degraded(),
+            "latency_limit": self.latency_limit,
+            "queue_limit": self.queue_limit,
+        }
+
+
+# ---------- маршрутизация ----------
+
+class LetterRouter:
+    """
+    Решает для письма, нужен ли LLM или хватит шаблонного ответа.
+
+    Обычный режим: шаблон для категорий из template_categories с приоритетом
+    не выше template_max_priority. Деградация (load.degraded()): шаблон для любого
+    письма с приоритетом не выше degraded_max_priority. Письма с приоритетом выше
+    порогов всегда получают ответ модели.
+    """
+
+    def __init__(
+        self,
+        load: LoadMonitor,
+        template_categories: list[str],
+        template_max_priority: int,
+        degraded_max_priority: int,
+    ):
+        self.load = load
+        self.template_categories = set(template_categories)
+        self.template_max_priority = template_max_priority
+        self.degraded_max_priority = degraded_max_priority
+
+    def decide(self, category: str, priority: int, route: str | None = None) -> tuple[str, str]:
+        """Возвращает (маршрут "llm"/"template", причина). route — явный выбор из запроса."""
+        if route in ("llm", "template"):
+            return route, "forced"
+        if category in self.template_categories and priority <= self.template_max_priority:
+            return "template", "category"
+        if priority <= self.degraded_max_priority and self.load.degraded():
+            return "template", "degraded"
+        return "llm", "default"
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых одновременных вызовов: пока вызов с ключом key выполняется,
+    остальные вызовы с тем же ключом не запускают свой, а ждут его результат
+    (или его исключение). После завершения ключ освобождается — это не кэш,
+    следующий вызов пойдёт заново.
+
+    Потоки и event loop учитываются отдельно: do — для потоков, do_async — для
+    корутин одного event loop.
+
+    on_join(key) вызывается, когда вызов присоединился к уже идущему (для метрик).
+    """
+
+    def __init__(self, on_join: Callable[[str], None] | None = None):
+        self._on_join = on_join
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future] = {}
+        # key -> (задача, сколько корутин её ждёт)
+        self._tasks: dict[str, list] = {}
+
+    def do(self, key: str, fn: Callable[[], T], deadline: float | None = None) -> T:
+        """
+        Результат fn() — своего вызова или уже идущего с тем же ключом.
+        Ждущий не дольше своего deadline (time.monotonic()): после него —
+        TimeoutError, а ведущий вызов продолжает работу для остальных.
+        """
+        with self._lock:
+            shared = self._calls.get(key)
+            if shared is None:
+                own = self._calls[key] = Future()
+        if shared is not None:
+            if self._on_join:
+                self._on_join(key)
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                return shared.result(timeout)
+            except FutureTimeoutError:
+                raise TimeoutError("Истёк дедлайн ожидания одинакового запроса") from None
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, own)
+            own.set_exception(e)
+            raise
+        self._finish(key, own)
+        own.set_result(result)
+        return result
+
+    def _finish(self, key: str, own: Future) -> None:
+        # ключ освобождается до публикации результата: пришедшие позже начнут новый вызов
+        with self._lock:
+            if self._calls.get(key) is own:
+                del self._calls[key]
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[T]], deadline: float | None = None) -> T:
+        """
+        То же для корутин. Вызов выполняется отдельной задачей: отмена одного из ждущих
+        (клиент закрыл соединение, проигравший хедж) не отменяет вызов для остальных.
+        Задача отменяется, только когда её перестали ждать все.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._tasks.get(key)
+            if entry is None or entry[0].get_loop() is not loop:
+                task = loop.create_task(fn())
+                entry = self._tasks[key] = [task, 0]
+                task.add_done_callback(lambda t: self._forget(key, t))
+            elif self._on_join:
+                self._on_join(key)
+            entry[1] += 1
+        task = entry[0]
+
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception() from None
+            raise TimeoutError("Истёк дедлайн ожидания одинакового запроса") from None
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                orphaned = entry[1] == 0
+            if orphaned and not task.done():
+                task.cancel()
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        with self._lock:
+            entry = self._tasks.get(key)
+            if entry is not None and entry[0] is task:
+                del self._tasks[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._tasks)
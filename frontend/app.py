@@ -1,12 +1,29 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+from requests.adapters import HTTPAdapter
+import json
 import re
 import requests
 import os
+import threading
+import time
 
 app = Flask(__name__)
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:5001/process")
+BACKEND_STREAM_URL = os.getenv("BACKEND_STREAM_URL", BACKEND_URL.rstrip("/") + "/stream")
+BACKEND_VARIANTS_URL = os.getenv("BACKEND_VARIANTS_URL", BACKEND_URL.rstrip("/") + "/variants")
+BACKEND_ANALYZE_URL = os.getenv("BACKEND_ANALYZE_URL", BACKEND_URL.rstrip("/").rsplit("/", 1)[0] + "/analyze")
+# анализ по мере набора: правила на бэкенде — миллисекунды, дольше ждать незачем
+ANALYZE_TIMEOUT = float(os.getenv("ANALYZE_TIMEOUT", "1"))
 USE_BACKEND = os.getenv("USE_BACKEND", "true").lower() in ("1", "true", "yes")
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "10"))
+# сколько keep-alive соединений к бэкенду держим (≈ число потоков фронта)
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "32"))
+# после стольких ошибок подряд перестаём ходить в бэкенд на BREAKER_COOLDOWN секунд
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+TONE_MAP = {"formal": "Официальный строгий", "business": "Корпоративный-деловой", "client": "Клиентоориентированный"}
 
 
 def detect_classification(text: str) -> str:
@@ -88,20 +105,84 @@ def build_answer(text: str, style: str, length: str, classification_label: str)
     return f"{intro}\n\n{base_body}{extra_details}\n\n{outro}\n[Название компании]"
 
 
-def try_use_backend(text, style, length):
-    if not USE_BACKEND:
+class CircuitBreaker:
+    """
+    Предохранитель для обращений к бэкенду.
+    closed — ходим как обычно; после failure_threshold ошибок подряд — open:
+    сразу отдаём локальный fallback, не дожидаясь таймаутов; через cooldown секунд —
+    half_open: пропускаем один пробный запрос, по его итогу снова closed или open.
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Сервер недоступен, переходим на локальные ответы на {self.cooldown:.0f} с")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+# Общая сессия: keep-alive соединения к BACKEND_URL переиспользуются между запросами
+backend_session = requests.Session()
+_backend_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=BACKEND_POOL_SIZE, max_retries=0)
+backend_session.mount("http://", _backend_adapter)
+backend_session.mount("https://", _backend_adapter)
+
+backend_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+# Свой предохранитель у /api/analyze: запросы по мере набора частые и с коротким таймаутом,
+# их ошибки не должны открывать backend_breaker и занимать его пробный запрос.
+analyze_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+
+
+def try_use_backend(text, style, length, regenerate=False):
+    if not USE_BACKEND or not backend_breaker.allow_request():
         return None
 
-    tone_map = {"formal": "Официальный строгий", "business": "Корпоративный-деловой", "client": "Клиентоориентированный"}
-    tone = tone_map.get(style, "деловой")
+    tone = TONE_MAP.get(style, "деловой")
 
 
     try:
-        resp = requests.post(
+        resp = backend_session.post(
             BACKEND_URL,
-            json={"text": text, "tone": tone, "length": length},
-            timeout=10
+            json={"text": text, "tone": tone, "length": length, "no_cache": regenerate},
+            # бэкенд укладывает повторы вызовов модели в наш таймаут (с запасом на сеть)
+            headers={"X-Request-Timeout": str(max(1.0, BACKEND_TIMEOUT - 0.5))},
+            timeout=BACKEND_TIMEOUT
         )
+        # 4xx — ошибка запроса, а не признак того, что бэкенд лежит
+        if resp.status_code >= 500:
+            backend_breaker.record_failure()
+        else:
+            backend_breaker.record_success()
+
         if resp.status_code == 200:
             data = resp.json()
             if "classification" in data and "response" in data:
@@ -116,12 +197,126 @@ def try_use_backend(text, style, length):
                 }
 
     except Exception as e:
+        backend_breaker.record_failure()
         print(f"Ошибка обращения к серверу {e}")
         pass  # любая ошибка -> fallback
 
     return None
 
 
+def try_use_backend_variants(text, styles, length, regenerate=False):
+    """Варианты ответа в нескольких стилях одним запросом к /process/variants; None — fallback."""
+    if not USE_BACKEND or not backend_breaker.allow_request():
+        return None
+
+    try:
+        resp = backend_session.post(
+            BACKEND_VARIANTS_URL,
+            json={
+                "text": text,
+                "variants": [{"tone": TONE_MAP.get(style, "деловой"), "length": length} for style in styles],
+                "no_cache": regenerate,
+            },
+            headers={"X-Request-Timeout": str(max(1.0, BACKEND_TIMEOUT - 0.5))},
+            timeout=BACKEND_TIMEOUT
+        )
+        if resp.status_code >= 500:
+            backend_breaker.record_failure()
+        else:
+            backend_breaker.record_success()
+
+        if resp.status_code == 200:
+            data = resp.json()
+            if "classification" in data and "variants" in data:
+                variants = []
+                for style, variant in zip(styles, data["variants"]):
+                    item = {"emailStyle": style, "answerText": variant["response"]}
+                    if variant.get("error"):
+                        item["error"] = variant["error"]
+                    variants.append(item)
+                return {
+                    "classification": data["classification"],
+                    "extractedInfo": data.get("extractedInfo", []),
+                    "summary": data.get("summary", ""),
+                    "variants": variants,
+                }
+
+    except Exception as e:
+        backend_breaker.record_failure()
+        print(f"Ошибка обращения к серверу {e}")
+
+    return None
+
+
+def sse_event(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def open_backend_stream(text, style, length, regenerate=False):
+    """
+    Открывает SSE-поток бэкенда /process/stream. Возвращает response (ещё не прочитанный)
+    или None, если бэкенд недоступен — тогда фронт отвечает локальным шаблоном.
+    """
+    if not USE_BACKEND or not backend_breaker.allow_request():
+        return None
+
+    tone = TONE_MAP.get(style, "деловой")
+    try:
+        resp = backend_session.post(
+            BACKEND_STREAM_URL,
+            json={"text": text, "tone": tone, "length": length, "no_cache": regenerate},
+            stream=True,
+            # (соединение, пауза между кусками) — общий таймаут генерации здесь не нужен
+            timeout=(3, 30),
+        )
+        if resp.status_code == 200:
+            backend_breaker.record_success()
+            return resp
+        if resp.status_code >= 500:
+            backend_breaker.record_failure()
+        else:
+            backend_breaker.record_success()
+        resp.close()
+    except Exception as e:
+        backend_breaker.record_failure()
+        print(f"Ошибка обращения к серверу {e}")
+
+    return None
+
+
+def fallback_events(text, style, length):
+    classification = detect_classification(text)
+    info = extract_info(text)
+    answer = build_answer(text, style, length, classification)
+    summary = ""
+    for item in info:
+        if item.get("label") == "Краткая суть обращения":
+            summary = item.get("value", "")
+            break
+
+    yield sse_event("meta", {"classification": classification, "extractedInfo": info})
+    yield sse_event("delta", {"text": answer})
+    yield sse_event("summary", {"summary": summary})
+    yield sse_event("done", {"response": answer, "errors": {}})
+
+
+# SIGTERM от gunicorn (gunicorn.conf.py): /readyz отвечает 503, пока доделываются запросы
+draining = threading.Event()
+
+
+@app.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz")
+def readyz():
+    # фронт готов и без бэкенда (есть локальный fallback), состояние бэкенда — для мониторинга
+    if draining.is_set():
+        return jsonify({"status": "draining"}), 503
+    return jsonify({"status": "ready", "backend": backend_breaker.state if USE_BACKEND else "disabled"})
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -133,12 +328,14 @@ def api_generate():
     incoming_text = data.get("incomingText", "").strip()
     email_style = data.get("emailStyle", "business")
     email_length = data.get("emailLength", "short")
+    # «Перегенерировать» должен дать новый вариант, а не ответ из кэша бэкенда
+    regenerate = bool(data.get("regenerate", False))
 
     if not incoming_text:
         return jsonify({"error": "Пустой текст письма."}), 400
 
     # Пытаемся использовать бэкенд
-    backend_res = try_use_backend(incoming_text, email_style, email_length)
+    backend_res = try_use_backend(incoming_text, email_style, email_length, regenerate)
     if backend_res:
         return jsonify(backend_res)
 
@@ -162,5 +359,123 @@ def api_generate():
     })
 
 
+@app.route("/api/analyze", methods=["POST"])
+def api_analyze():
+    """
+    Категория, факты и приоритет без модели — для показа по мере набора письма.
+    Ответ бэкенда /analyze отдаётся как есть, без повторной сериализации.
+    """
+    data = request.get_json() or {}
+    incoming_text = data.get("incomingText", "").strip()
+
+    if not incoming_text:
+        return jsonify({"error": "Пустой текст письма."}), 400
+
+    # backend_breaker только читаем: если бэкенд уже признан недоступным, не ждём таймаут
+    if USE_BACKEND and backend_breaker.state == "closed" and analyze_breaker.allow_request():
+        try:
+            resp = backend_session.post(
+                BACKEND_ANALYZE_URL, json={"text": incoming_text}, timeout=ANALYZE_TIMEOUT
+            )
+            if resp.status_code >= 500:
+                analyze_breaker.record_failure()
+            else:
+                analyze_breaker.record_success()
+            if resp.status_code == 200:
+                return Response(resp.content, mimetype="application/json")
+        except Exception as e:
+            analyze_breaker.record_failure()
+            print(f"Ошибка обращения к серверу {e}")
+
+    # Fallback
+    return jsonify({
+        "classification": detect_classification(incoming_text),
+        "extractedInfo": extract_info(incoming_text),
+    })
+
+
+@app.route("/api/generate/variants", methods=["POST"])
+def api_generate_variants():
+    """
+    Ответ на письмо сразу в нескольких стилях (emailStyles, по умолчанию — все из TONE_MAP):
+    бэкенд генерирует варианты параллельно, по времени это примерно один ответ.
+    """
+    data = request.get_json() or {}
+    incoming_text = data.get("incomingText", "").strip()
+    email_styles = data.get("emailStyles") or list(TONE_MAP)
+    email_length = data.get("emailLength", "short")
+    regenerate = bool(data.get("regenerate", False))
+
+    if not incoming_text:
+        return jsonify({"error": "Пустой текст письма."}), 400
+    if not isinstance(email_styles, list):
+        return jsonify({"error": "emailStyles должен быть списком."}), 400
+
+    backend_res = try_use_backend_variants(incoming_text, email_styles, email_length, regenerate)
+    if backend_res:
+        backend_res["emailLength"] = email_length
+        return jsonify(backend_res)
+
+    # Fallback
+    classification = detect_classification(incoming_text)
+    info = extract_info(incoming_text)
+
+    summary = ""
+    for item in info:
+        if item.get("label") == "Краткая суть обращения":
+            summary = item.get("value", "")
+            break
+
+    return jsonify({
+        "classification": classification,
+        "extractedInfo": info,
+        "summary": summary,
+        "variants": [
+            {"emailStyle": style, "answerText": build_answer(incoming_text, style, email_length, classification)}
+            for style in email_styles
+        ],
+        "emailLength": email_length
+    })
+
+
+@app.route("/api/generate/stream", methods=["POST"])
+def api_generate_stream():
+    """
+    Потоковая генерация: события бэкенда /process/stream пробрасываются в браузер
+    как есть, без буферизации. Если бэкенд недоступен — те же события из шаблона.
+    """
+    data = request.get_json() or {}
+    incoming_text = data.get("incomingText", "").strip()
+    email_style = data.get("emailStyle", "business")
+    email_length = data.get("emailLength", "short")
+    regenerate = bool(data.get("regenerate", False))
+
+    if not incoming_text:
+        return jsonify({"error": "Пустой текст письма."}), 400
+
+    backend_resp = open_backend_stream(incoming_text, email_style, email_length, regenerate)
+
+    if backend_resp is not None:
+        def relay():
+            try:
+                # chunk_size=None — отдаём куски сразу, как они пришли из сокета
+                for chunk in backend_resp.iter_content(chunk_size=None):
+                    yield chunk
+            except Exception as e:
+                print(f"Обрыв потока от сервера {e}")
+                yield sse_event("error", {"error": "Соединение с сервером прервано."}).encode("utf-8")
+            finally:
+                backend_resp.close()
+        body = relay()
+    else:
+        body = fallback_events(incoming_text, email_style, email_length)
+
+    return Response(
+        body,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,30 @@
+# Продакшен-запуск фронтенда (run.py --prod делает то же самое):
+#   gunicorn -c frontend/gunicorn.conf.py --pythonpath frontend app:app   (из корня репозитория)
+#
+# Фронт в основном ждёт бэкенд (в том числе держит SSE-потоки), поэтому процессов мало,
+# потоков много — примерно по BACKEND_POOL_SIZE соединений к бэкенду на процесс.
+import os
+import signal
+
+bind = os.getenv("FRONTEND_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("FRONTEND_WORKERS", "2"))
+threads = int(os.getenv("FRONTEND_THREADS", os.getenv("BACKEND_POOL_SIZE", "32")))
+worker_class = "gthread"
+preload_app = True
+keepalive = 5
+# потоковый ответ идёт, пока модель генерирует, — даём ему закончиться
+graceful_timeout = int(os.getenv("FRONTEND_GRACEFUL_TIMEOUT", "90"))
+accesslog = os.getenv("FRONTEND_ACCESS_LOG", "-") or None
+
+
+def post_worker_init(worker):
+    import app
+
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_term(signum, frame):
+        app.draining.set()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
@@ -34,7 +34,7 @@ document.addEventListener("DOMContentLoaded", () => {
     if (!classification) {
       classificationBlock.innerHTML = `
         <div class="placeholder">
-          Классификация появится после генерации ответа.
+          Классификация появится по мере ввода письма.
         </div>
       `;
       return;
@@ -45,7 +45,16 @@ document.addEventListener("DOMContentLoaded", () => {
     `;
   }
 
+  function normalizeInfoItems(items) {
+    // бэкенд отдаёт факты словарём {ключ: значение}, локальный шаблон — списком
+    if (!items || Array.isArray(items)) {
+      return items;
+    }
+    return Object.entries(items).map(([label, value]) => ({ label, value }));
+  }
+
   function renderExtractedInfo(items, summary) {
+    items = normalizeInfoItems(items);
     const hasItems = items && items.length;
     const hasSummary = Boolean(summary && summary.trim());
 
@@ -90,6 +99,61 @@ document.addEventListener("DOMContentLoaded", () => {
     extractedInfoBlock.innerHTML = summaryHtml + listHtml;
   }
 
+  // Анализ по мере набора: только правила, без модели (/api/analyze). Запрос уходит
+  // через ANALYZE_DEBOUNCE_MS после последнего нажатия, устаревший — отменяется.
+  const ANALYZE_DEBOUNCE_MS = 300;
+  let analyzeTimer = null;
+  let analyzeController = null;
+  let lastAnalyzedText = "";
+
+  function scheduleAnalyze() {
+    clearTimeout(analyzeTimer);
+    analyzeTimer = setTimeout(runAnalyze, ANALYZE_DEBOUNCE_MS);
+  }
+
+  async function runAnalyze() {
+    const text = incomingTextEl.value.trim();
+    if (isLoading || text === lastAnalyzedText) {
+      return;
+    }
+    if (analyzeController) {
+      analyzeController.abort();
+    }
+    if (!text) {
+      lastAnalyzedText = "";
+      renderClassification(null);
+      renderExtractedInfo(null, "");
+      return;
+    }
+
+    analyzeController = new AbortController();
+    try {
+      const response = await fetch("/api/analyze", {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+        },
+        body: JSON.stringify({ incomingText: text }),
+        signal: analyzeController.signal,
+      });
+      if (!response.ok) {
+        return;
+      }
+      const data = await response.json();
+      // пока шёл запрос, письмо могли изменить или запустить генерацию
+      if (isLoading || incomingTextEl.value.trim() !== text) {
+        return;
+      }
+      lastAnalyzedText = text;
+      renderClassification(data.classification);
+      renderExtractedInfo(data.extractedInfo || [], "");
+    } catch (e) {
+      if (e.name !== "AbortError") {
+        console.error(e);
+      }
+    }
+  }
+
 
   async function sendGenerateRequest(payload) {
     try {
@@ -113,7 +177,63 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
-  async function handleGenerate() {
+  function parseSseEvent(rawEvent) {
+    let event = "message";
+    const dataLines = [];
+    rawEvent.split("\n").forEach((line) => {
+      if (line.startsWith("event:")) {
+        event = line.slice(6).trim();
+      } else if (line.startsWith("data:")) {
+        dataLines.push(line.slice(5).trimStart());
+      }
+    });
+    if (!dataLines.length) {
+      return null;
+    }
+    return { event, data: JSON.parse(dataLines.join("\n")) };
+  }
+
+  // Потоковая генерация: /api/generate/stream отдаёт server-sent events
+  // meta → delta… → summary → done, ответ дописывается по мере прихода токенов.
+  async function streamGenerateRequest(payload, onEvent) {
+    const response = await fetch("/api/generate/stream", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify(payload),
+    });
+
+    if (!response.ok) {
+      const errData = await response.json().catch(() => ({}));
+      const msg = errData.error || "Ошибка при генерации ответа.";
+      throw new Error(msg);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder("utf-8");
+    let buffer = "";
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) {
+        break;
+      }
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary = buffer.indexOf("\n\n");
+      while (boundary !== -1) {
+        const parsed = parseSseEvent(buffer.slice(0, boundary));
+        buffer = buffer.slice(boundary + 2);
+        if (parsed) {
+          onEvent(parsed.event, parsed.data);
+        }
+        boundary = buffer.indexOf("\n\n");
+      }
+    }
+  }
+
+  async function handleGenerate(regenerate = false) {
     const text = incomingTextEl.value.trim();
     if (!text) {
       setStatus("Введите текст входящего письма.", "error");
@@ -124,19 +244,56 @@ document.addEventListener("DOMContentLoaded", () => {
       incomingText: text,
       emailStyle: emailStyleEl.value,
       emailLength: emailLengthEl.value,
+      regenerate: regenerate,
     };
 
     lastRequestPayload = payload;
+    // анализ этого текста придёт вместе с ответом
+    clearTimeout(analyzeTimer);
+    if (analyzeController) {
+      analyzeController.abort();
+    }
+    lastAnalyzedText = text;
 
     setLoading(true);
     setStatus("Генерируем ответ…", "info");
 
     try {
-      const data = await sendGenerateRequest(payload);
-
-      renderClassification(data.classification);
-      renderExtractedInfo(data.extractedInfo || [], data.summary);
-      answerTextEl.value = data.answerText || "";
+      if (window.ReadableStream && window.TextDecoder) {
+        let extractedInfo = [];
+        let streamError = null;
+        answerTextEl.value = "";
+
+        await streamGenerateRequest(payload, (event, data) => {
+          if (event === "meta") {
+            extractedInfo = data.extractedInfo || [];
+            renderClassification(data.classification);
+            renderExtractedInfo(extractedInfo, "");
+            setStatus("Анализ готов, модель пишет ответ…", "info");
+          } else if (event === "delta") {
+            answerTextEl.value += data.text;
+            answerTextEl.scrollTop = answerTextEl.scrollHeight;
+          } else if (event === "summary") {
+            renderExtractedInfo(extractedInfo, data.summary);
+          } else if (event === "done") {
+            if (data.response) {
+              answerTextEl.value = data.response;
+            }
+          } else if (event === "error") {
+            streamError = data.error;
+          }
+        });
+
+        if (streamError) {
+          throw new Error(streamError);
+        }
+      } else {
+        const data = await sendGenerateRequest(payload);
+
+        renderClassification(data.classification);
+        renderExtractedInfo(data.extractedInfo || [], data.summary);
+        answerTextEl.value = data.answerText || "";
+      }
 
       setStatus("Ответ успешно сгенерирован.", "success");
     } catch (e) {
@@ -196,7 +353,8 @@ function flashButton(btn, className) {
       return;
     }
 
-    await handleGenerate();
+    // просим бэкенд не брать ответ из кэша — нужен новый вариант
+    await handleGenerate(true);
   }
 
   function handleExampleClick(type) {
@@ -218,8 +376,11 @@ function flashButton(btn, className) {
     }
 
     setStatus("Пример письма подставлен. Нажмите «Сгенерировать ответ».", "info");
+    runAnalyze();
   }
 
+  incomingTextEl.addEventListener("input", scheduleAnalyze);
+
   generateBtn.addEventListener("click", () => {
     if (!isLoading) {
       handleGenerate();
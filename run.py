@@ -1,38 +1,117 @@
 # ai-assistant/run.py
+#
+#   python run.py          — разработка: Flask dev-серверы (debug, автоперезагрузка)
+#   python run.py --prod   — продакшен: gunicorn, несколько процессов и потоков на сервис
+#                            (BACKEND_WORKERS / BACKEND_THREADS, FRONTEND_WORKERS / FRONTEND_THREADS,
+#                            см. backend/gunicorn.conf.py и frontend/gunicorn.conf.py)
+#
+# Фронтенд стартует, только когда бэкенд ответил 200 на /readyz. Ctrl+C / SIGTERM —
+# плавная остановка: сначала фронтенд, потом бэкенд, каждый доделывает начатые запросы.
+# SIGHUP в --prod — плавная замена воркеров обоих сервисов.
+import argparse
+import os
+import signal
 import subprocess
 import sys
 import time
+import urllib.error
+import urllib.request
 
-def run():
-    # Запускаем бэкенд в фоне
-    backend = subprocess.Popen([
-        sys.executable, "-u", "backend/api.py"
-    ], cwd=".", stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+BACKEND_READY_URL = os.getenv("BACKEND_READY_URL", "http://127.0.0.1:5001/readyz")
+FRONTEND_READY_URL = os.getenv("FRONTEND_READY_URL", "http://127.0.0.1:5000/healthz")
+# сколько ждать готовности сервиса при старте
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "60"))
+# сколько ждать остановки сервиса, прежде чем убить его
+STOP_TIMEOUT = float(os.getenv("STOP_TIMEOUT", "120"))
 
-    print("Бэкенд запущен (порт 5001)")
 
-    try:
-        # Ждём немного, чтобы бэкенд стартовал
-        time.sleep(2)
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = READY_TIMEOUT) -> bool:
+    """Опрашивает url, пока он не ответит 200; False — процесс умер или не успел."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(url, timeout=2) as resp:
+                if resp.status == 200:
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass  # ещё не слушает или отвечает 503 (прогрев)
+        time.sleep(0.2)
+    return False
+
+
+# запуск из корня репозитория: .env модели читается из текущей директории
+def dev_commands() -> list[tuple[str, list[str]]]:
+    return [
+        ("backend", [sys.executable, "-u", "backend/api.py"]),
+        ("frontend", [sys.executable, "-u", "frontend/app.py"]),
+    ]
+
+
+def prod_commands() -> list[tuple[str, list[str]]]:
+    gunicorn = [sys.executable, "-m", "gunicorn"]
+    return [
+        ("backend", gunicorn + ["-c", "backend/gunicorn.conf.py", "--pythonpath", "backend", "api:app"]),
+        ("frontend", gunicorn + ["-c", "frontend/gunicorn.conf.py", "--pythonpath", "frontend", "app:app"]),
+    ]
+
 
-        # Читаем логи бэкенда
-        def log_backend():
-            for line in iter(backend.stdout.readline, ''):
-                if line:
-                    print(f"[BACKEND] {line.rstrip()}")
-        import threading
-        threading.Thread(target=log_backend, daemon=True).start()
+def stop(processes: list[tuple[str, subprocess.Popen]]) -> None:
+    # в обратном порядке: фронтенд перестаёт слать запросы раньше, чем уходит бэкенд
+    for name, process in reversed(processes):
+        if process.poll() is not None:
+            continue
+        process.terminate()
+        try:
+            process.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            print(f"{name} не остановился за {STOP_TIMEOUT:.0f} с, завершаем принудительно")
+            process.kill()
+            process.wait()
 
-        # Запускаем фронтенд в основном процессе
-        print("Запускаем фронтенд (порт 5000)...")
-        subprocess.run([sys.executable, "-u", "frontend/app.py"])
 
+def run(prod: bool = False):
+    commands = prod_commands() if prod else dev_commands()
+    ready_urls = {"backend": BACKEND_READY_URL, "frontend": FRONTEND_READY_URL}
+    processes: list[tuple[str, subprocess.Popen]] = []
+
+    def on_signal(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, on_signal)
+    if prod and hasattr(signal, "SIGHUP"):
+        # gunicorn по SIGHUP перечитывает конфиг и плавно меняет воркеров
+        signal.signal(signal.SIGHUP, lambda signum, frame: [p.send_signal(signal.SIGHUP) for _, p in processes])
+
+    try:
+        for name, command in commands:
+            # логи сервисов идут прямо в наш stdout/stderr, без перекачки через поток;
+            # своя группа процессов — Ctrl+C из терминала получаем только мы и останавливаем
+            # сервисы плавно (SIGTERM), а не SIGINT-ом сразу всем
+            process = subprocess.Popen(command, start_new_session=True)
+            processes.append((name, process))
+            if not wait_ready(ready_urls[name], process):
+                print(f"{name} не стал готов за {READY_TIMEOUT:.0f} с (код выхода {process.poll()})")
+                return 1
+            print(f"{name} готов ({ready_urls[name]})")
+
+        # работаем, пока жив любой из сервисов
+        while all(process.poll() is None for _, process in processes):
+            time.sleep(1)
+        name, process = next((n, p) for n, p in processes if p.poll() is not None)
+        print(f"{name} завершился с кодом {process.returncode}")
+        return 1
     except KeyboardInterrupt:
         print("\nОстановка...")
+        return 0
     finally:
-        backend.terminate()
-        backend.wait()
+        stop(processes)
         print("Оба сервиса остановлены.")
 
+
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Запуск бэкенда и фронтенда")
+    parser.add_argument("--prod", action="store_true", help="gunicorn вместо Flask dev-серверов")
+    args = parser.parse_args()
+    sys.exit(run(prod=args.prod))